@@ -107,12 +107,9 @@ echo '#!/bin/bash' > "$prefetchruncounts_bin"
 echo "python3 \"/opt/prefetchruncounts.py\" \"\$@\"" >> "$prefetchruncounts_bin"
 chmod +x "$prefetchruncounts_bin"
 
-echo "Install PowerShellScriptBlockExtractor..."
-curl -L -o /opt/script_block_extract.py https://raw.githubusercontent.com/sweesiahh/PowerShellScriptBlockExtractor/refs/heads/main/script_block_extract.py
-script_block_extract_bin="/usr/local/bin/script_block_extract"
-echo '#!/bin/bash' > "$script_block_extract_bin"
-echo "python3 \"/opt/script_block_extract.py\" \"\$@\"" >> "$script_block_extract_bin"
-chmod +x "$script_block_extract_bin"
+echo "Install output conversion modules (optional, OutputFormat in windows_config.py)..."
+pip3 install zstandard pyarrow
+
 
 
 
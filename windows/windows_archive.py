@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from datetime import datetime
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import zipfile
+import windows_config
+
+def is_archive(path):
+    return os.path.splitext(str(path))[1].lower() in windows_config.ArchiveExtensions
+
+def list_archive(archive, sevenzip_bin):
+    # [member path with / separators, size, is directory], zip from its central directory, anything else through 7z
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zip_file:
+            return [[info.filename.replace("\\", "/").strip("/"), info.file_size, info.is_dir()] for info in zip_file.infolist()]
+    output = subprocess.run([sevenzip_bin, "l", "-slt", "-ba", "-sccUTF-8", str(archive)], capture_output=True, check=True).stdout.decode("utf-8", errors="replace")
+    members = []
+    member = None
+    for line in output.splitlines():
+        key, _, value = line.partition(" = ")
+        if key == "Path":
+            member = [value.replace("\\", "/").strip("/"), 0, False]
+            members.append(member)
+        elif member != None and key == "Size" and value.isdigit():
+            member[1] = int(value)
+        elif member != None and (key == "Folder" and value == "+" or key == "Attributes" and value.startswith("D")):
+            member[2] = True
+    return members
+
+def find_archive_targets(members, target_pattern, archive_stem, whole_archive=False):
+    # member folders matching target.txt (not below another match), else the whole archive when its name matches (or whole_archive)
+    member_dirs = set()
+    for name, _, is_dir in members:
+        parts = name.split("/")
+        for depth in range(1, len(parts) + 1 if is_dir else len(parts)):
+            member_dirs.add("/".join(parts[:depth]))
+    targets = []
+    for member_dir in sorted(member_dirs, key=lambda member_dir: (member_dir.count("/"), member_dir)):
+        if target_pattern.search(member_dir.rsplit("/", 1)[-1]) and not any(member_dir.startswith(target + "/") for target in targets):
+            targets.append(member_dir)
+    if not targets and (whole_archive or target_pattern.search(archive_stem)):
+        targets.append("")
+    return targets
+
+def match_artifact(parts, artifact):
+    file_name = parts[-1]
+    if "name" in artifact:
+        return file_name == artifact["name"].lower()
+    if "ext" in artifact:
+        return os.path.splitext(file_name)[1] == artifact["ext"].lower()
+    if "suffix" in artifact:
+        return file_name.endswith(artifact["suffix"].lower())
+    if "under" in artifact:
+        return artifact["under"].lower() in parts[:-1]
+    return False
+
+def select_members(members, target, artifact_list):
+    selected = []
+    for name, size, is_dir in members:
+        if is_dir or target and not name.startswith(target + "/"):
+            continue
+        parts = name.lower().split("/")
+        if ".." in parts or "" in parts:
+            continue
+        if any(match_artifact(parts, artifact) for artifact in artifact_list):
+            selected.append([name, size])
+    return selected
+
+def split_members(members, groups):
+    # largest first onto the smallest group, like the evtx shards
+    member_groups = [[0, []] for _ in range(max(1, min(groups, len(members))))]
+    for name, size in sorted(members, key=lambda member: member[1], reverse=True):
+        member_group = min(member_groups, key=lambda member_group: member_group[0])
+        member_group[0] += size
+        member_group[1].append(name)
+    return [member_group[1] for member_group in member_groups if member_group[1]]
+
+def extract_zip_members(archive, names, extract_dir):
+    with zipfile.ZipFile(archive) as zip_file:
+        infos = {info.filename.replace("\\", "/").strip("/"): info for info in zip_file.infolist()}
+        for name in names:
+            info = infos[name]
+            dest_file = Path(extract_dir).joinpath(*name.split("/"))
+            os.makedirs(dest_file.parent, exist_ok=True)
+            with zip_file.open(info) as source_f, open(dest_file, "wb") as dest_f:
+                shutil.copyfileobj(source_f, dest_f, 1024 * 1024)
+            # keep the archived time so incremental manifests match on the next run
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(dest_file, (mtime, mtime))
+
+def extract_7z_members(archive, names, extract_dir, sevenzip_bin):
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8", delete=False) as list_file:
+        list_file.write("\n".join(names) + "\n")
+    try:
+        subprocess.run([sevenzip_bin, "x", str(archive), f"-o{extract_dir}", "-y", "-scsUTF-8", f"@{list_file.name}"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    finally:
+        os.remove(list_file.name)
+
+def extract_members(archive, members, extract_dir, sevenzip_bin):
+    member_groups = split_members(members, windows_config.ArchiveExtractWorkers)
+    is_zip = zipfile.is_zipfile(archive)
+    with ThreadPoolExecutor(max_workers=max(1, len(member_groups))) as executor:
+        futures = []
+        for names in member_groups:
+            if is_zip:
+                futures.append(executor.submit(extract_zip_members, archive, names, extract_dir))
+            else:
+                futures.append(executor.submit(extract_7z_members, archive, names, extract_dir, sevenzip_bin))
+        for future in futures:
+            future.result()
+
+def get_scratch_dir(archive):
+    scratch_root = Path(windows_config.ArchiveScratchDir) if windows_config.ArchiveScratchDir else Path(tempfile.gettempdir()).joinpath("dfir_archive")
+    archive_hash = hashlib.sha1(str(Path(archive).resolve()).encode("utf-8")).hexdigest()[:12]
+    return scratch_root.joinpath(archive_hash)
+
+def remove_scratch_dir(scratch_dir, extract_slots=None):
+    # the target copy, then the archive folder once its last target is gone, and its extraction slot is free again
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    try:
+        os.rmdir(Path(scratch_dir).parent)
+    except OSError:
+        pass
+    if extract_slots != None:
+        extract_slots.release()
+
+def is_result_dir(path, result_dir_name):
+    # <stem>/ next to an archive only holds <target>/<result_dir_name> folders, a folder with any other file is a real one
+    for current_dir, dir_names, file_names in os.walk(path):
+        if file_names:
+            return False
+        dir_names[:] = [dir_name for dir_name in dir_names if dir_name != result_dir_name]
+    return True
+
+def iter_archive_targets(archive, target_pattern, artifact_list, result_dir_name, sevenzip_bin, whole_archive=False, extract_slots=None):
+    # extract one target at a time (only the members its modules read), results go next to the archive in <stem>/<target>.
+    # extract_slots (a semaphore shared by the run) blocks the next extraction until the cleanup of a parsed target
+    archive = Path(archive).resolve()
+    archive_stem = archive.name[:-len(archive.suffix)] if archive.suffix else archive.name
+    try:
+        members = list_archive(archive, sevenzip_bin)
+    except (OSError, zipfile.BadZipFile, subprocess.CalledProcessError) as e:
+        print(f"Failed to list {archive}: {e}")
+        return
+    targets = find_archive_targets(members, target_pattern, archive_stem, whole_archive)
+    print("{0}: Found {1} targets in {2} ({3} members)".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(targets), archive, len(members)))
+
+    for target_number, target in enumerate(targets):
+        selected = select_members(members, target, artifact_list)
+        if not selected:
+            continue
+        if extract_slots != None:
+            extract_slots.acquire()
+        scratch_dir = get_scratch_dir(archive).joinpath(str(target_number))
+        if scratch_dir.exists():
+            shutil.rmtree(scratch_dir)
+        start_time = time.monotonic()
+        try:
+            extract_members(archive, selected, scratch_dir.joinpath(archive_stem), sevenzip_bin)
+        except (OSError, KeyError, zipfile.BadZipFile, subprocess.CalledProcessError) as e:
+            print(f"Failed to extract {target or archive_stem} from {archive}: {e}")
+            remove_scratch_dir(scratch_dir, extract_slots)
+            continue
+        total_size = sum(size for _, size in selected)
+        print("{0}: Extracted {1} of {2} members ({3} MB) of {4} in {5:.1f}s".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(selected), len(members), total_size // (1024 * 1024), target or archive_stem, time.monotonic() - start_time))
+        target_parts = target.split("/") if target else []
+        yield {
+            "full_path": str(scratch_dir.joinpath(archive_stem, *target_parts)),
+            "result_path": str(archive.parent.joinpath(archive_stem, *target_parts, result_dir_name)),
+            "archive": str(archive),
+            # called with the pending output conversions of the target, they do not read the scratch copy
+            "cleanup": lambda conversions, scratch_dir=scratch_dir: remove_scratch_dir(scratch_dir, extract_slots),
+            "extracted_bytes": total_size,
+        }
@@ -0,0 +1,274 @@
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import windows_config
+import windows_parser
+
+STUB_TOOL = r'''#!/usr/bin/env python3
+import json
+import os
+import sys
+import time
+
+name = os.path.basename(sys.argv[0])
+with open(os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "stub_profile.json")) as f:
+    profile = json.load(f).get(name, {"runtime": 0, "lines": 0})
+
+args = sys.argv[1:]
+output_file = None
+for flag in ["--csv", "-o", "--output", "--outfile", "--json"]:
+    if flag in args and args.index(flag) + 1 < len(args):
+        target = args[args.index(flag) + 1]
+        output_file = os.path.join(target, f"{time.strftime('%Y%m%d%H%M%S')}_{name}_Output.csv") if os.path.isdir(target) or flag in ["--csv", "--json"] else target
+        break
+
+time.sleep(profile["runtime"])
+row = "2024-01-01 00:00:00.0000000,stub,{0},C:\\Windows\\System32\\stub.exe,0123456789abcdef0123456789abcdef01234567\n"
+if output_file != None:
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    with open(output_file, "w") as f:
+        f.write("Timestamp,Computer,Line,Path,SHA1\n")
+        for line in range(profile["lines"]):
+            f.write(row.format(line))
+for line in range(profile["lines"]):
+    sys.stdout.write(f"{name}: processed record {line}\n")
+'''
+
+# [tool attribute in windows_parser, runtime in seconds, output lines]
+stub_profiles = [
+    ["AmcacheParser_bin", 0.5, 2000],
+    ["AppCompatCacheParser_bin", 0.3, 500],
+    ["PECmd_bin", 0.5, 2000],
+    ["prefetchruncounts_bin", 0.3, 500],
+    ["JLECmd_bin", 0.3, 500],
+    ["RBCmd_bin", 0.2, 100],
+    ["SBECmd_bin", 0.5, 1000],
+    ["WxTCmd_bin", 0.3, 500],
+    ["RecentFileCacheParser_bin", 0.1, 50],
+    ["RECmd_bin", 1.0, 5000],
+    ["SQLECmd_bin", 0.5, 1000],
+    ["MFTECmd_bin", 2.0, 20000],
+    ["EvtxEcmd_bin", 2.0, 20000],
+    ["hayabusa_bin", 1.5, 10000],
+    ["chainsaw_bin", 1.0, 2000],
+    ["zircolite_bin", 1.0, 2000],
+    ["zircolite_evtx_bin", 0.5, 5000],
+]
+
+def create_stub_tools(bin_dir, time_scale, line_scale):
+    os.makedirs(bin_dir, exist_ok=True)
+    profile = {}
+    for tool_attribute, runtime, lines in stub_profiles:
+        tool_name = tool_attribute[:-len("_bin")]
+        stub_file = Path(bin_dir).joinpath(tool_name)
+        with open(stub_file, "w") as f:
+            f.write(STUB_TOOL)
+        os.chmod(stub_file, 0o755)
+        profile[tool_name] = {"runtime": runtime * time_scale, "lines": int(lines * line_scale)}
+        setattr(windows_parser, tool_attribute, str(stub_file))
+    with open(Path(bin_dir).joinpath("stub_profile.json"), "w") as f:
+        json.dump(profile, f, indent=1)
+    for tool_dir in ["hayabusa_dir", "chainsaw_dir", "zircolite_dir"]:
+        setattr(windows_parser, tool_dir, str(bin_dir))
+    return profile
+
+def create_file(path, size=0):
+    with open(path, "wb") as f:
+        if size:
+            f.truncate(size)
+
+def create_filler_tree(root, depth, fanout, files):
+    leaf_dirs = [Path(root)]
+    for _ in range(depth):
+        leaf_dirs = [leaf_dir.joinpath(f"dir{n}") for leaf_dir in leaf_dirs for n in range(fanout)]
+    for leaf_dir in leaf_dirs:
+        os.makedirs(leaf_dir, exist_ok=True)
+    for n in range(files):
+        create_file(leaf_dirs[n % len(leaf_dirs)].joinpath(f"file{n}.dat"))
+
+def generate_target(target_dir, args):
+    volume = Path(target_dir).joinpath("C")
+    evtx_dir = volume.joinpath("Windows", "System32", "winevt", "Logs")
+    config_dir = volume.joinpath("Windows", "System32", "config")
+    prefetch_dir = volume.joinpath("Windows", "Prefetch")
+    for directory in [evtx_dir, config_dir, prefetch_dir, volume.joinpath("$Extend")]:
+        os.makedirs(directory, exist_ok=True)
+    evtx_names = ["Security.evtx", "System.evtx", "Application.evtx", "Microsoft-Windows-PowerShell%4Operational.evtx"]
+    for n in range(args.evtx):
+        create_file(evtx_dir.joinpath(evtx_names[n] if n < len(evtx_names) else f"Channel-{n}%4Operational.evtx"), args.evtx_size)
+    for hive in ["SYSTEM", "SOFTWARE", "SAM", "SECURITY", "DEFAULT"]:
+        create_file(config_dir.joinpath(hive), 4096)
+        create_file(config_dir.joinpath(f"{hive}.LOG1"), 1024)
+    for n in range(args.prefetch):
+        create_file(prefetch_dir.joinpath(f"PROGRAM{n}.EXE-{n:08X}.pf"), 1024)
+    for n in range(args.users):
+        user_dir = volume.joinpath("Users", f"user{n}")
+        os.makedirs(user_dir.joinpath("AppData", "Local", "Microsoft", "Windows"), exist_ok=True)
+        create_file(user_dir.joinpath("NTUSER.DAT"), 4096)
+        create_file(user_dir.joinpath("AppData", "Local", "Microsoft", "Windows", "UsrClass.dat"), 4096)
+    create_file(volume.joinpath("$MFT"), 1024 * 1024)
+    create_file(volume.joinpath("$Extend", "$J"), 1024 * 1024)
+    create_filler_tree(volume.joinpath("Users", "user0", "AppData", "Local", "Temp"), args.depth, args.fanout, args.filler_files)
+
+def generate_corpus(root, targets, args):
+    for n in range(targets):
+        generate_target(Path(root).joinpath(f"collection{n % 10}", f"HOST{n:05d}_20240101000000"), args)
+    for n in range(args.decoys):
+        create_filler_tree(Path(root).joinpath(f"notes{n}"), 2, 2, 10)
+
+def legacy_find_targets(target_dir, pattern_list):
+    data_entry = []
+    for path in Path(target_dir).rglob("*"):
+        if path.is_dir():
+            for pattern in pattern_list:
+                if re.search(pattern, path.name):
+                    data_entry.append({"full_path": str(path.resolve())})
+    return data_entry
+
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start_time, result
+
+def reset_parser_state():
+    windows_parser.artifact_index_cache.clear()
+    windows_parser.artifact_index_locks.clear()
+    with windows_parser.run_metrics_lock:
+        windows_parser.run_metrics.clear()
+
+def benchmark_artifact_lookup(entries):
+    reset_parser_state()
+    index_time = 0.0
+    lookup_time = 0.0
+    lookups = 0
+    for entry in entries:
+        elapsed, _ = timed(windows_parser.get_artifact_index, entry["full_path"])
+        index_time += elapsed
+        for module_name in windows_parser.module_artifacts:
+            elapsed, _ = timed(windows_parser.get_module_inputs, entry["full_path"], module_name)
+            lookup_time += elapsed
+            lookups += 1
+    return {"index_s": index_time, "lookup_s": lookup_time, "lookups": lookups}
+
+def benchmark_scheduling(entries):
+    scheduler = windows_parser.JobScheduler(windows_config.MaxJobs, {}, 0, 0)
+    jobs = 0
+    start_time = time.perf_counter()
+    for entry in entries:
+        for module in windows_parser.processing_module:
+            for module_function in module["module_list"]:
+                scheduler.submit({"name": module_function.__name__, "target": entry["full_path"], "tool": "noop", "function": lambda: None, "args": ()})
+                jobs += 1
+    scheduler.close()
+    scheduler.run()
+    elapsed = time.perf_counter() - start_time
+    return {"jobs": jobs, "scheduling_s": elapsed, "per_job_ms": elapsed / max(jobs, 1) * 1000}
+
+def benchmark_output_handling(work_dir, lines):
+    profile_file = Path(windows_parser.EvtxEcmd_bin).parent.joinpath("stub_profile.json")
+    with open(profile_file, "r") as f:
+        profile = json.load(f)
+    saved_profile = dict(profile["EvtxEcmd"])
+    profile["EvtxEcmd"] = {"runtime": 0, "lines": lines}
+    with open(profile_file, "w") as f:
+        json.dump(profile, f)
+    log_file = Path(work_dir).joinpath("output_benchmark.txt")
+    try:
+        elapsed, result = timed(windows_parser.execute_process, windows_parser.EvtxEcmd_bin, "", log_file, str(work_dir), None)
+    finally:
+        profile["EvtxEcmd"] = saved_profile
+        with open(profile_file, "w") as f:
+            json.dump(profile, f)
+        if log_file.exists():
+            os.remove(log_file)
+    return {"lines": lines, "output_s": elapsed, "output_mb": result["bytes"] / 1048576, "output_mb_per_s": result["bytes"] / 1048576 / max(elapsed, 1e-9), "peak_rss_kb": result["peak_rss_kb"]}
+
+def benchmark_end_to_end(root, pattern_file, max_jobs):
+    reset_parser_state()
+    elapsed, _ = timed(windows_parser.windows_parser, root, pattern_file, None, max_jobs)
+    return {"end_to_end_s": elapsed}
+
+def run_benchmark(args):
+    work_dir = Path(tempfile.mkdtemp(prefix="dfir_benchmark_", dir=args.work_dir))
+    bin_dir = work_dir.joinpath("bin")
+    create_stub_tools(bin_dir, args.time_scale, args.line_scale)
+    windows_config.IncrementalCache = False
+    windows_parser.init_module_config()
+    pattern_file = Path(windows_parser.__file__).parent.joinpath("target.txt")
+    pattern_list = windows_parser.load_target_patterns(pattern_file)
+
+    results = []
+    try:
+        for targets in args.scales:
+            root = work_dir.joinpath(f"corpus_{targets}")
+            print("{0}: Generating {1} targets in {2}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), targets, root))
+            generate_seconds, _ = timed(generate_corpus, root, targets, args)
+            result = {"targets": targets, "generate_s": generate_seconds}
+
+            result["discovery_s"], entries = timed(lambda: list(windows_parser.find_targets(root, pattern_list)))
+            result["discovered_targets"] = len(entries)
+            if args.legacy:
+                result["legacy_discovery_s"], _ = timed(legacy_find_targets, root, pattern_list)
+            result.update(benchmark_artifact_lookup(entries))
+            result.update(benchmark_scheduling(entries))
+            result.update(benchmark_output_handling(work_dir, args.output_lines))
+            if targets <= args.end_to_end_max:
+                result.update(benchmark_end_to_end(root, pattern_file, args.max_jobs))
+            results.append(result)
+            print(json.dumps(result))
+            if not args.keep:
+                shutil.rmtree(root, ignore_errors=True)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "benchmark": "windows_parser",
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ["o", "work_dir"]},
+        "results": results,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", help="result_json_file (default stdout)")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100, 1000], help="target_counts")
+    parser.add_argument("--evtx", type=int, default=20, help="evtx_files_per_target")
+    parser.add_argument("--evtx-size", type=int, default=65536, help="evtx_placeholder_bytes (sparse)")
+    parser.add_argument("--prefetch", type=int, default=50, help="prefetch_files_per_target")
+    parser.add_argument("--users", type=int, default=3, help="user_profiles_per_target")
+    parser.add_argument("--filler-files", type=int, default=200, help="other_files_per_target")
+    parser.add_argument("--depth", type=int, default=4, help="filler_directory_depth")
+    parser.add_argument("--fanout", type=int, default=3, help="filler_directory_fanout")
+    parser.add_argument("--decoys", type=int, default=5, help="non_target_folders_in_root")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="stub_tool_runtime_multiplier")
+    parser.add_argument("--line-scale", type=float, default=0.1, help="stub_tool_output_multiplier")
+    parser.add_argument("--output-lines", type=int, default=200000, help="lines_for_output_handling_benchmark")
+    parser.add_argument("--end-to-end-max", type=int, default=10, help="largest_scale_with_full_stub_run")
+    parser.add_argument("--max-jobs", type=int, help="max_concurrent_jobs_for_full_run")
+    parser.add_argument("--legacy", action="store_true", help="also_time_original_rglob_discovery")
+    parser.add_argument("--work-dir", help="folder_for_generated_corpora (default system temp)")
+    parser.add_argument("--keep", action="store_true", help="keep_generated_corpora")
+
+    args = parser.parse_args()
+
+    report = json.dumps(run_benchmark(args), indent=2)
+    if args.o:
+        with open(args.o, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+    exit(0)
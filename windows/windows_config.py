@@ -29,3 +29,161 @@ RegistryASEPParser = True
 
 # sqldb module (for browser, electron application..)
 SQLDataParser = False
+
+# artifact index
+# save the artifact index of each target as WindowsParser/artifact_index.json and reuse it on rerun
+# (indexed again when the mtime of any folder of the target changed)
+ArtifactIndexSidecar = False
+
+# target discovery
+# artifact folders of a collection never searched for targets (case insensitive), only pruned in a volume folder
+# (one holding Windows/System32 or $Extend), so a case folder named like one of them is still searched
+DiscoveryPruneDirs = ["Windows", "Users", "ProgramData", "Program Files", "Program Files (x86)", "$Extend", "$Recycle.Bin", "System Volume Information"]
+# max folder depth below -r searched for targets (None for unlimited)
+DiscoveryMaxDepth = None
+
+# local staging (-r/-s without --queue/--watch), for collections on SMB/NFS: the artifacts read by the enabled modules are
+# copied to fast local storage before parsing, results are written back to the share in the background
+# local folder (SSD/tmpfs) for the copies, None to parse in place
+StagingDir = None
+# targets staged at a time, the ones being parsed plus the read-ahead of the next ones
+StagingTargets = 3
+# bytes kept in StagingDir (copies and their local results), copies of finished targets are evicted least recently used first
+StagingBudgetBytes = 100 * 1024 * 1024 * 1024
+# parallel file copies while staging a target
+StagingCopyWorkers = 4
+
+# batched EZ tools (-r without --queue/--watch), one dotnet run over the staged inputs of many targets, split back per target
+# modules run batched, any of module_PECmd, module_JLECmd, module_RBCmd, module_SQLECmd, module_RECmd, module_RECmd_ASEP
+# (PECmd writes its _Timeline.csv without the source file, so it is dropped in batched runs)
+BatchModules = ["module_JLECmd", "module_RBCmd", "module_SQLECmd", "module_RECmd", "module_RECmd_ASEP"]
+# targets per batched run
+BatchTargets = 32
+
+# event filter (--since/--until/--event-ids/--channels override these), for incidents with a known time window
+# UTC times as "YYYY-MM-DD HH:MM:SS" (None for no limit), passed to hayabusa, chainsaw, zircolite and EvtxECmd as their
+# own filters, evtx files with no record in the window are skipped and $J is cut before --since (with NtfsTrimUsnJournal)
+FilterSince = None
+FilterUntil = None
+# event ids kept by hayabusa csv-timeline and EvtxECmd ([] for all)
+FilterEventIds = []
+# channels whose evtx files are parsed, e.g. ["Security", "Microsoft-Windows-PowerShell/Operational"] ([] for all)
+FilterChannels = []
+
+# archive targets (zip from its central directory, 7z/vhdx/vhd through the 7z binary)
+# look into archives found by discovery (or given with -s) for targets
+ArchiveSources = True
+ArchiveExtensions = [".zip", ".7z", ".vhdx", ".vhd"]
+# parallel extraction streams per target (one 7z process or zip handle each)
+ArchiveExtractWorkers = 4
+# scratch directory for extracted artifacts, removed once the target is parsed (None for system temp)
+ArchiveScratchDir = None
+# archive targets extracted at a time (the ones being parsed plus the next one), bounds the scratch space used
+ArchiveExtractTargets = 2
+
+# job scheduler
+# max (target, module) jobs running at the same time
+MaxJobs = 4
+# max jobs per tool, hayabusa/chainsaw/zircolite are already multi-threaded
+ToolConcurrency = {"hayabusa": 1, "chainsaw": 1, "zircolite": 1, "eztool": 4, "python": 2}
+# do not start new jobs while 1-minute load average per cpu is above this value (0 to disable)
+CpuLoadLimit = 1.5
+# do not start new jobs while available memory is below this value in MB (0 to disable)
+MemoryReserveMB = 2048
+# seconds to wait before checking cpu/memory again when a job is held back
+ResourceRecheckSeconds = 10
+
+# process output
+# seconds between progress lines of a running tool
+ProgressIntervalSeconds = 60
+# write buffer in bytes used when streaming tool output to the log file
+OutputBufferSize = 1024 * 1024
+
+# incremental processing
+# keep a manifest (inputs, tool, command line) next to each tool log and rerun a tool only when it changed
+IncrementalCache = True
+# also hash the first and last MB of every input file (slower, catches changes that keep size and mtime)
+IncrementalCacheHash = False
+
+# evtx sharding (hayabusa timeline, chainsaw, zircolite)
+# split the evtx files of a target into this many size-balanced shards and run the tool on each shard in parallel
+# (each running shard takes a job slot and counts against ToolConcurrency, raise both together: with the default
+# ToolConcurrency of 1 for hayabusa/chainsaw/zircolite more shards only run one after another)
+EvtxShardCount = 1
+# targets with less evtx bytes than this run as a single shard
+EvtxShardMinBytes = 512 * 1024 * 1024
+# scratch directory for the links to the evtx files of a shard or of the logon summary, kept outside the target
+# so a tool given the whole target folder does not parse them a second time (None for system temp, on the same
+# file system as the targets the links are hard links, symlinks otherwise)
+EvtxStageDir = None
+
+# evtx decode cache
+# decode every evtx once with evtx_dump into WindowsParser/evtx_cache/<channel>/<EventID>/*.json,
+# zircolite and the powershell script block module then read the cache instead of the evtx files
+EvtxDecodeCache = False
+# evtx files decoded at the same time
+EvtxDecodeWorkers = 4
+
+# ntfs module (MFTECmd)
+# $MFT and $J of every volume parsed at the same time
+NtfsWorkers = 4
+# skip the empty (sparse) start of $J and parse a trimmed copy when it is at least NtfsTrimMinBytes
+NtfsTrimUsnJournal = True
+NtfsTrimMinBytes = 64 * 1024 * 1024
+
+# registry modules (RECmd, RECmd_ASEP)
+# distinct hives parsed by RECmd at the same time, copies with the same content (RegBack, VSS) are parsed once
+RegistryHiveWorkers = 4
+
+# powershell script block module
+# worker processes decoding PowerShell Operational evtx chunks
+ScriptBlockWorkers = 4
+# evtx chunks (64KB each) handed to a worker at a time
+ScriptBlockChunksPerTask = 64
+
+# output conversion (also windows_convert.py for already parsed targets)
+# None, zstd (csv/json compressed, requires zstandard) or parquet (csv with typed timestamps, requires pyarrow)
+# outputs of a category folder are converted once all its modules finished on a target, the timeline and case database read them transparently
+OutputFormat = None
+# worker processes converting outputs while other modules are still running
+ConvertWorkers = 2
+ConvertZstdLevel = 3
+# rows per parquet row group (each row group keeps min/max statistics of every column)
+ConvertRowGroupRows = 100000
+
+# super timeline (--timeline or windows_timeline.py)
+# csv or parquet (parquet requires pyarrow)
+TimelineFormat = "csv"
+# rows sorted in memory before being spilled to a temporary run file
+TimelineChunkRows = 500000
+# max run files merged at once
+TimelineMergeFanIn = 128
+# rows per output file
+TimelineOutputRows = 1000000
+# directory for temporary run files (None for system temp)
+TimelineTempDir = None
+
+# case database (--store or windows_store.py)
+# rows per batched insert
+StoreBatchRows = 50000
+
+# distributed queue (--queue/--listen on the coordinator, --worker on each node)
+# seconds a claimed job stays with a worker without heartbeat before it is queued again
+QueueLeaseSeconds = 300
+# seconds between worker heartbeats extending the lease of its running jobs
+QueueHeartbeatSeconds = 30
+# seconds between queue polls of idle workers and progress lines of the coordinator
+QueuePollSeconds = 5
+# claims of a job before it is marked failed (a crashed worker counts as one)
+QueueMaxAttempts = 3
+# shared secret sent with every request to --listen and checked by the coordinator, set the same value on every node
+# (None for no check, then only listen on a trusted network: anyone reaching the port can queue and complete jobs)
+QueueToken = None
+
+# watch folder (-r with --watch)
+# auto (inotify when available), inotify or poll (use poll for NFS/SMB volumes written by other hosts)
+WatchMode = "auto"
+# seconds without any change below a target before it is queued
+WatchStableSeconds = 120
+# seconds between polls (and max wait for inotify events)
+WatchPollSeconds = 10
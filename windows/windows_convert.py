@@ -0,0 +1,308 @@
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import csv
+import io
+import json
+import os
+import re
+import sys
+import windows_config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+SKIP_DIRS = ["timeline", "evtx_cache", "evtx_cache_logs", "shards", "hives", "usn_trim"]
+# the staged path rebase also covers the per-hive outputs and hive lists (merged again from there on a later run),
+# the shards are mapped by the merge and the evtx cache is keyed by the staged paths
+REBASE_SKIP_DIRS = ["evtx_cache", "evtx_cache_logs", "shards", "usn_trim"]
+OUTPUT_PATTERN = re.compile(r"\.(csv|json)$", re.IGNORECASE)
+TIMESTAMP_COLUMN_PATTERN = re.compile(r"time|date|created|modified|accessed|changed|lastrun|runtime|deletedon", re.IGNORECASE)
+TIMESTAMP_PATTERN = re.compile(r"^(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?\s*(Z|[+-]\d{2}:?\d{2})?$")
+EPOCH = datetime(1970, 1, 1)
+MIN_NS = -(2 ** 63)
+MAX_NS = 2 ** 63 - 1
+
+def get_converted_files(output_file):
+    output_file = Path(output_file)
+    return [output_file.with_name(output_file.name + ".zst"), output_file.with_suffix(".parquet")]
+
+def find_output(output_file):
+    # the output itself or its converted copy, None when neither exists
+    for candidate in [Path(output_file)] + get_converted_files(output_file):
+        if candidate.exists():
+            return candidate
+    return None
+
+def output_exists(output_file):
+    return find_output(output_file) != None
+
+def glob_outputs(directory, pattern):
+    # pattern for the raw output name (e.g. *_Output.csv), also matches .csv.zst and .parquet copies
+    patterns = [pattern, pattern + ".zst"]
+    if pattern.lower().endswith(".csv"):
+        patterns.append(pattern[:-len(".csv")] + ".parquet")
+    output_files = set()
+    for output_pattern in patterns:
+        output_files.update(Path(directory).glob(output_pattern))
+    return sorted(output_files)
+
+def get_output_name(output_file):
+    # name of the raw output, without the .zst or .parquet of a converted copy
+    name = Path(output_file).name
+    if name.endswith(".zst"):
+        return name[:-len(".zst")]
+    if name.endswith(".parquet"):
+        return name[:-len(".parquet")] + ".csv"
+    return name
+
+def open_text(output_file):
+    if str(output_file).endswith(".zst"):
+        if zstandard == None:
+            raise RuntimeError(f"zstandard is required to read {output_file}")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(output_file, "rb"), closefd=True), encoding="utf-8-sig", errors="replace", newline="")
+    return open(output_file, "r", newline="", encoding="utf-8-sig", errors="replace")
+
+def open_csv(csv_file):
+    with open_text(csv_file) as f:
+        sample = f.read(4096)
+    delimiter = "|" if sample.count("|") > sample.count(",") else ","
+    f = open_text(csv_file)
+    return f, csv.DictReader(f, delimiter=delimiter)
+
+def format_timestamp(value):
+    if value == None:
+        return ""
+    seconds, nanoseconds = divmod(value, 10 ** 9)
+    return "{0}.{1:07d}".format((EPOCH + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S"), nanoseconds // 100)
+
+def iter_parquet_rows(parquet_file):
+    if pyarrow == None:
+        raise RuntimeError(f"pyarrow is required to read {parquet_file}")
+    parquet = pyarrow.parquet.ParquetFile(parquet_file)
+    timestamp_columns = [field.name for field in parquet.schema_arrow if pyarrow.types.is_timestamp(field.type)]
+    for batch in parquet.iter_batches(batch_size=windows_config.ConvertRowGroupRows):
+        columns = {}
+        for name in batch.schema.names:
+            column = batch.column(name)
+            if name in timestamp_columns:
+                columns[name] = [format_timestamp(value) for value in column.cast(pyarrow.int64()).to_pylist()]
+            else:
+                columns[name] = ["" if value == None else value for value in column.to_pylist()]
+        names = list(columns.keys())
+        for values in zip(*columns.values()):
+            yield dict(zip(names, values))
+
+def iter_csv_rows(csv_file):
+    # rows of a csv output as dicts of strings, whether it is raw, zstd compressed or converted to parquet
+    if str(csv_file).endswith(".parquet"):
+        yield from iter_parquet_rows(csv_file)
+        return
+    f, reader = open_csv(csv_file)
+    with f:
+        yield from reader
+
+def parse_timestamp_ns(value):
+    match = TIMESTAMP_PATTERN.match(value.strip())
+    if match == None:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    try:
+        timestamp = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+    except ValueError:
+        return None
+    if offset != None and offset != "Z":
+        offset = offset.replace(":", "")
+        delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+        timestamp = timestamp - delta if offset[0] == "+" else timestamp + delta
+    value = (timestamp - EPOCH) // timedelta(seconds=1) * 10 ** 9 + int((fraction or "")[:9].ljust(9, "0"))
+    return value if MIN_NS <= value <= MAX_NS else None
+
+def find_timestamp_columns(csv_file):
+    # columns named like a timestamp where every non empty value parses, checked over the whole file before writing
+    timestamp_columns = None
+    for row in iter_csv_rows(csv_file):
+        if timestamp_columns == None:
+            timestamp_columns = set(column for column in row.keys() if column and TIMESTAMP_COLUMN_PATTERN.search(column))
+        for column in list(timestamp_columns):
+            value = row.get(column)
+            if value and parse_timestamp_ns(value) == None:
+                timestamp_columns.discard(column)
+        if not timestamp_columns:
+            break
+    return timestamp_columns or set()
+
+def write_parquet(csv_file, parquet_file):
+    timestamp_columns = find_timestamp_columns(csv_file)
+    f, reader = open_csv(csv_file)
+    with f:
+        header = [column for column in (reader.fieldnames or []) if column]
+        schema = pyarrow.schema([(column, pyarrow.timestamp("ns", tz="UTC") if column in timestamp_columns else pyarrow.string()) for column in header])
+        try:
+            writer = pyarrow.parquet.ParquetWriter(parquet_file, schema, compression="zstd", write_statistics=True, write_page_index=True)
+        except TypeError:
+            writer = pyarrow.parquet.ParquetWriter(parquet_file, schema, compression="zstd", write_statistics=True)
+        try:
+            rows = []
+            row_groups = 0
+            for row in reader:
+                rows.append(row)
+                if len(rows) >= windows_config.ConvertRowGroupRows:
+                    write_row_group(writer, schema, header, timestamp_columns, rows)
+                    row_groups += 1
+                    rows = []
+            if rows or row_groups == 0:
+                write_row_group(writer, schema, header, timestamp_columns, rows)
+        finally:
+            writer.close()
+
+def write_row_group(writer, schema, header, timestamp_columns, rows):
+    columns = []
+    for column in header:
+        if column in timestamp_columns:
+            columns.append(pyarrow.array([parse_timestamp_ns(row.get(column)) if row.get(column) else None for row in rows], type=pyarrow.int64()).cast(pyarrow.timestamp("ns", tz="UTC")))
+        else:
+            columns.append(pyarrow.array([row.get(column) for row in rows], type=pyarrow.string()))
+    writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema), row_group_size=windows_config.ConvertRowGroupRows)
+
+def write_zstd(output_file, zstd_file):
+    compressor = zstandard.ZstdCompressor(level=windows_config.ConvertZstdLevel)
+    with open(output_file, "rb") as source_f, open(zstd_file, "wb") as dest_f:
+        compressor.copy_stream(source_f, dest_f, read_size=1024 * 1024, write_size=1024 * 1024)
+
+def get_output_format(output_format=None):
+    output_format = output_format if output_format != None else windows_config.OutputFormat
+    if output_format == "parquet" and pyarrow == None:
+        print("pyarrow not installed, outputs are not converted to parquet")
+        return None
+    if output_format == "zstd" and zstandard == None:
+        print("zstandard not installed, outputs are not compressed")
+        return None
+    return output_format if output_format in ["zstd", "parquet"] else None
+
+def convert_output_file(output_file, output_format):
+    # csv goes to parquet (or zstd), json only to zstd, the raw output is removed once the copy is complete
+    output_file = Path(output_file)
+    if output_format == "parquet" and output_file.suffix.lower() == ".csv":
+        converted_file = output_file.with_suffix(".parquet")
+        write_function = write_parquet
+    elif zstandard != None:
+        converted_file = output_file.with_name(output_file.name + ".zst")
+        write_function = write_zstd
+    else:
+        return None
+    temp_file = converted_file.with_name(converted_file.name + ".tmp")
+    write_function(output_file, temp_file)
+    os.replace(temp_file, converted_file)
+    os.remove(output_file)
+    return converted_file
+
+def find_convertible_files(result_dir, skip_dirs=SKIP_DIRS):
+    output_files = []
+    for current_dir, dir_names, file_names in os.walk(result_dir):
+        dir_names[:] = [dir_name for dir_name in dir_names if dir_name not in skip_dirs]
+        for file_name in file_names:
+            if OUTPUT_PATTERN.search(file_name) and not file_name.endswith("_manifest.json") and file_name != "artifact_index.json":
+                output_files.append(Path(current_dir).joinpath(file_name))
+    return sorted(output_files)
+
+def rebase_output_file(output_file, path_prefixes):
+    # [[staged prefix, original prefix]], also in their json escaped form, the file is only rewritten when one shows up
+    replacements = []
+    for old_prefix, new_prefix in path_prefixes:
+        replacements.append([old_prefix, new_prefix])
+        if json.dumps(old_prefix)[1:-1] != old_prefix:
+            replacements.append([json.dumps(old_prefix)[1:-1], json.dumps(new_prefix)[1:-1]])
+    temp_file = Path(output_file).with_name(Path(output_file).name + ".tmp")
+    changed = False
+    with open(output_file, "r", newline="", encoding="utf-8", errors="surrogateescape") as f, open(temp_file, "w", newline="", encoding="utf-8", errors="surrogateescape") as temp_f:
+        for line in f:
+            for old_prefix, new_prefix in replacements:
+                if old_prefix in line:
+                    line = line.replace(old_prefix, new_prefix)
+                    changed = True
+            temp_f.write(line)
+    if changed:
+        os.replace(temp_file, output_file)
+    else:
+        os.remove(temp_file)
+    return changed
+
+def convert_result_dir(result_dir, output_format=None, path_prefixes=None):
+    # path_prefixes maps the paths of a staged target back to the original ones before the outputs are converted
+    if path_prefixes:
+        for output_file in find_convertible_files(result_dir, REBASE_SKIP_DIRS):
+            try:
+                rebase_output_file(output_file, path_prefixes)
+            except OSError as e:
+                print(f"Failed to map paths in {output_file}: {e}")
+    output_format = get_output_format(output_format)
+    if output_format == None:
+        return []
+    converted = []
+    for output_file in find_convertible_files(result_dir):
+        input_size = output_file.stat().st_size
+        try:
+            converted_file = convert_output_file(output_file, output_format)
+        except Exception as e:
+            print(f"Failed to convert {output_file}: {e}")
+            continue
+        if converted_file != None:
+            converted.append([str(converted_file), input_size, converted_file.stat().st_size])
+    return converted
+
+def find_result_dirs(root_dir, result_dir_name):
+    result_dirs = []
+    pending_dirs = [str(root_dir)]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as it:
+                for dir_entry in it:
+                    if not dir_entry.is_dir(follow_symlinks=False):
+                        continue
+                    if dir_entry.name == result_dir_name:
+                        result_dirs.append(Path(dir_entry.path))
+                    else:
+                        pending_dirs.append(dir_entry.path)
+        except OSError:
+            continue
+    return sorted(result_dirs)
+
+def convert_results(root_dir, result_dir_name="WindowsParser", output_format=None):
+    converted = []
+    for result_dir in find_result_dirs(root_dir, result_dir_name):
+        with os.scandir(result_dir) as it:
+            for dir_entry in it:
+                if dir_entry.is_dir(follow_symlinks=False) and dir_entry.name not in SKIP_DIRS:
+                    converted += convert_result_dir(dir_entry.path, output_format)
+    return converted
+
+def print_converted(converted):
+    for converted_file, input_size, output_size in converted:
+        print("{0}: Converted {1} ({2} MB -> {3} MB)".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), converted_file, input_size // (1024 * 1024), output_size // (1024 * 1024)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", required=True, help="parsed_target_folders")
+    parser.add_argument("--format", choices=["zstd", "parquet"], help="output_format (default OutputFormat from windows_config.py)")
+
+    args = parser.parse_args()
+
+    if not Path(args.r).exists():
+        print(f"target not found!")
+        exit(-1)
+    print_converted(convert_results(args.r, output_format=args.format))
+
+    exit(0)
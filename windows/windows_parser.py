@@ -1,18 +1,47 @@
 import argparse
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import inspect
 from pathlib import Path
-from datetime import datetime
-
+from datetime import datetime, timedelta
+
+import csv
+import errno
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import multiprocessing
 import os
 import re
+try:
+    import resource
+except ImportError:
+    resource = None
 import shlex
+import shutil
+import socket
+import sqlite3
+import struct
 import sys
 import subprocess
 import tempfile
 import threading
 import time
+from xml.etree import ElementTree
+import windows_archive
 import windows_config
+import windows_convert
+import windows_queue
+import windows_staging
+import windows_store
+import windows_timeline
+import windows_watch
+
+try:
+    import Evtx.Evtx as Evtx
+except ImportError:
+    Evtx = None
 
 ROOT_RESULT_PATH = "WindowsParser"
 # need config for each system...
@@ -36,7 +65,7 @@ if sys.platform == "linux":
     hayabusa_bin = "hayabusa"
     chainsaw_bin = "chainsaw"
     zircolite_bin = "zircolite"
-    script_block_bin = "script_block_extract"
+    sevenzip_bin = "7z"
 
     zircolite_evtx_bin = r"/opt/Zircolite/bin/evtx_dump_lin"
     eztool_dir = r"/opt/eztool/net9"
@@ -66,7 +95,7 @@ elif sys.platform == "win32":
     hayabusa_bin = r"D:\Tools\Get-ZimmermanTools\hayabusa.exe"
     chainsaw_bin = r"D:\Tools\Get-ZimmermanTools\chainsaw.exe"
     zircolite_bin = r"D:\Tools\Get-ZimmermanTools\zircolite.exe"
-    script_block_bin = r"D:\Tools\Get-ZimmermanTools\script_block_bin.exe"
+    sevenzip_bin = r"C:\Program Files\7-Zip\7z.exe"
 
     eztool_dir = r"D:\Tools\Get-ZimmermanTools"
     hayabusa_dir = r"D:\Tools\hayabusa"
@@ -78,216 +107,1406 @@ elif sys.platform == "win32":
 
 processing_module = []
 
-def run_and_get_output(args, working_dir):
-    proc = subprocess.Popen(args, cwd=working_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-    output = "".join(proc.stdout.readlines())
-    sts = proc.returncode
-    if sts is None: sts = 0
-    return sts, output
-
-def execute_process(path, command, log_file, working_dir = tempfile.gettempdir()):
-    if not log_file.exists():
-        if ' ' in path:
-            path = f"\"{path}\""
-        args = [path] + shlex.split(command)
-        status, output = run_and_get_output(args, working_dir)
-        if status == 0:
-            with open(log_file, "w") as f:
-                f.write(output)    
+ARTIFACT_INDEX_FILE = "artifact_index.json"
+artifact_index_cache = {}
+artifact_index_locks = {}
+artifact_index_lock = threading.Lock()
+
+def walk_artifacts(source):
+    # dir_mtimes of every scanned folder tell whether a saved index still lists the files of the target
+    index = {"source": str(source), "files": {}, "exts": {}, "dirs": {}, "dir_mtimes": {}}
+    pending_dirs = [str(source)]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            index["dir_mtimes"][current_dir] = os.stat(current_dir).st_mtime_ns
+            with os.scandir(current_dir) as it:
+                for dir_entry in it:
+                    name_lower = dir_entry.name.lower()
+                    try:
+                        if dir_entry.is_dir(follow_symlinks=False):
+                            if dir_entry.name == ROOT_RESULT_PATH and current_dir == str(source):
+                                continue
+                            index["dirs"].setdefault(name_lower, []).append(dir_entry.path)
+                            pending_dirs.append(dir_entry.path)
+                        elif dir_entry.is_file():
+                            index["files"].setdefault(name_lower, []).append(dir_entry.path)
+                            ext = os.path.splitext(name_lower)[1]
+                            if ext != "":
+                                index["exts"].setdefault(ext, []).append(dir_entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Failed to scan {current_dir}: {e}")
+    for key in ["files", "exts", "dirs"]:
+        for paths in index[key].values():
+            paths.sort()
+    return index
+
+def is_index_current(index):
+    # a file added, removed or renamed anywhere in the target changes the mtime of its folder
+    if not isinstance(index.get("dir_mtimes"), dict):
+        return False
+    for dir_path, mtime_ns in index["dir_mtimes"].items():
+        try:
+            if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
+
+def build_artifact_index(source, dest=None):
+    source = str(Path(source).resolve())
+    index_file = None
+    if dest != None and windows_config.ArtifactIndexSidecar:
+        index_file = Path(dest).joinpath(ARTIFACT_INDEX_FILE)
+        if index_file.exists():
+            try:
+                with open(index_file, "r") as f:
+                    index = json.load(f)
+                if index.get("source") == source and is_index_current(index):
+                    print("{0}: Loaded artifact index from {1}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), index_file))
+                    return index
+                print("{0}: Artifact index {1} is out of date, indexing again".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), index_file))
+            except (OSError, ValueError) as e:
+                print(f"Ignoring broken artifact index {index_file}: {e}")
+        # before the walk, creating the result folder inside the target would change the mtime recorded for it
+        os.makedirs(dest, exist_ok=True)
+
+    start_time = time.monotonic()
+    index = walk_artifacts(source)
+    record_metric("discovery", "artifact_index", Path(source).name, wall_time=time.monotonic() - start_time, files=sum(len(paths) for paths in index["files"].values()))
+    print("{0}: Indexed {1} files, {2} directories under {3}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), sum(len(paths) for paths in index["files"].values()), sum(len(paths) for paths in index["dirs"].values()), source))
+
+    if index_file != None:
+        with open(index_file, "w") as f:
+            json.dump(index, f)
+    return index
+
+def get_artifact_index(source, dest=None):
+    source = str(Path(source).resolve())
+    with artifact_index_lock:
+        source_lock = artifact_index_locks.setdefault(source, threading.Lock())
+    with source_lock:
+        if source not in artifact_index_cache:
+            artifact_index_cache[source] = build_artifact_index(source, dest)
+        return artifact_index_cache[source]
+
+def find_artifact_files(source, name=None, suffix=None, ext=None):
+    index = get_artifact_index(source)
+    if name != None:
+        return list(index["files"].get(name.lower(), []))
+    if ext != None:
+        return list(index["exts"].get(ext.lower(), []))
+    if suffix != None:
+        suffix = suffix.lower()
+        result = []
+        for file_name, paths in index["files"].items():
+            if file_name.endswith(suffix):
+                result += paths
+        return sorted(result)
+    return []
+
+def find_artifact_dirs(source, name):
+    return list(get_artifact_index(source)["dirs"].get(name.lower(), []))
+
+def find_artifact_files_under(source, name):
+    result = []
+    artifact_dirs = [os.path.join(artifact_dir, "") for artifact_dir in find_artifact_dirs(source, name)]
+    if not artifact_dirs:
+        return result
+    for paths in get_artifact_index(source)["files"].values():
+        for path in paths:
+            if any(path.startswith(artifact_dir) for artifact_dir in artifact_dirs):
+                result.append(path)
+    return sorted(result)
+
+evtx_artifacts = [{"ext": ".evtx"}]
+# transaction logs and uncommitted pages the tools read from next to a hive or database, extracted and staged with it
+hive_log_artifacts = [{"ext": ".log1"}, {"ext": ".log2"}]
+sqlite_sidecar_artifacts = [{"suffix": "-wal"}, {"suffix": "-journal"}]
+hive_artifacts = [{"name": "SYSTEM"}, {"name": "SOFTWARE"}, {"name": "SAM"}, {"name": "SECURITY"}, {"name": "DEFAULT"}, {"name": "NTUSER.DAT"}, {"name": "UsrClass.dat"}, {"name": "Amcache.hve"}] + hive_log_artifacts
+
+module_artifacts = {
+    "module_script_block_powershell": [{"name": "Microsoft-Windows-PowerShell%4Operational.evtx"}],
+    "module_SQLECmd": [{"ext": ".db"}, {"ext": ".sqlite"}, {"ext": ".sqlite3"}, {"name": "History"}, {"name": "Cookies"}, {"name": "Web Data"}, {"name": "Login Data"}, {"name": "Favicons"}, {"name": "Top Sites"}, {"name": "Shortcuts"}] + sqlite_sidecar_artifacts,
+    "module_MFTECmd": [{"suffix": "$MFT"}, {"suffix": "$J"}],
+    "module_AmcacheParser": [{"name": "Amcache.hve"}, {"name": "Amcache.hve.LOG1"}, {"name": "Amcache.hve.LOG2"}],
+    "module_AppCompatCacheParser": [{"name": "SYSTEM"}, {"name": "SYSTEM.LOG1"}, {"name": "SYSTEM.LOG2"}],
+    "module_prefetchruncounts": [{"ext": ".pf"}],
+    "module_PECmd": [{"ext": ".pf"}],
+    "module_EvtxECmd": evtx_artifacts,
+    "module_JLECmd": [{"ext": ".automaticdestinations-ms"}, {"ext": ".customdestinations-ms"}, {"ext": ".lnk"}],
+    "module_RBCmd": [{"under": "$Recycle.Bin"}],
+    "module_SBECmd": [{"name": "NTUSER.DAT"}, {"name": "UsrClass.dat"}] + hive_log_artifacts,
+    "module_WxTCmd": [{"name": "ActivitiesCache.db"}] + sqlite_sidecar_artifacts,
+    "module_RecentFileCacheParser": [{"name": "RecentFileCache.bcf"}],
+    "module_RECmd": hive_artifacts,
+    "module_RECmd_ASEP": hive_artifacts,
+    "module_hayabusa_logon": evtx_artifacts,
+    "module_hayabusa_timeline": evtx_artifacts,
+    "module_chainsaw": evtx_artifacts,
+    "module_zircolite": evtx_artifacts,
+}
+
+def find_artifacts(source, artifact_list):
+    result = set()
+    for artifact in artifact_list:
+        if "under" in artifact:
+            result.update(find_artifact_files_under(source, artifact["under"]))
         else:
-            with open(str(log_file).replace(".txt", "_failed.txt"), "w") as f:
-                f.write(f"Run '{path} {command}' failed!\r\n")   
-                f.write(output)
-    return
+            result.update(find_artifact_files(source, name=artifact.get("name"), suffix=artifact.get("suffix"), ext=artifact.get("ext")))
+    return sorted(result)
+
+def get_module_inputs(source, module_name):
+    return find_artifacts(source, module_artifacts.get(module_name, []))
+
+RUN_METRICS_FILE = "run_metrics.jsonl"
+run_metrics = []
+run_metrics_lock = threading.Lock()
+run_metrics_file = None
+run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+
+def init_run_metrics(case_dir, metrics_file_name=RUN_METRICS_FILE):
+    global run_metrics_file
+    os.makedirs(case_dir, exist_ok=True)
+    run_metrics_file = Path(case_dir).joinpath(metrics_file_name)
+    print(f"writing run metrics to {run_metrics_file}")
+
+def get_target_name(path):
+    for parent in Path(path).parents:
+        if parent.name == ROOT_RESULT_PATH:
+            return parent.parent.name
+    return Path(path).name
+
+def record_metric(metric_type, name, target, **values):
+    metric = {"run_id": run_id, "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "type": metric_type, "name": name, "target": target}
+    metric.update(values)
+    with run_metrics_lock:
+        run_metrics.append(metric)
+        if run_metrics_file != None:
+            with open(run_metrics_file, "a") as f:
+                f.write(json.dumps(metric) + "\n")
+    return metric
+
+output_dir_locks = {}
+output_dir_lock = threading.Lock()
+
+def list_output_files(output_dir):
+    # files below the log folder of a run, without the scratch folders and the subfolders holding logs of other runs
+    output_files = {}
+    for current_dir, dir_names, file_names in os.walk(output_dir):
+        if current_dir != str(output_dir) and any(file_name.startswith("output_") for file_name in file_names):
+            dir_names[:] = []
+            continue
+        dir_names[:] = [dir_name for dir_name in dir_names if dir_name not in windows_convert.SKIP_DIRS]
+        for file_name in file_names:
+            output_file = os.path.join(current_dir, file_name)
+            try:
+                file_stat = os.stat(output_file)
+            except OSError:
+                continue
+            output_files[output_file] = (file_stat.st_size, file_stat.st_mtime_ns)
+    return output_files
+
+def lock_output_dir(output_dir):
+    # tools writing into the same folder run one after another, what changed in it during a run is that run's output
+    with output_dir_lock:
+        lock_entry = output_dir_locks.setdefault(str(output_dir), [threading.Lock(), 0])
+        lock_entry[1] += 1
+    lock_entry[0].acquire()
+    return list_output_files(output_dir)
+
+def unlock_output_dir(output_dir, output_files):
+    # [bytes written, files created or changed relative to the folder] since the listing of lock_output_dir
+    produced_files = []
+    output_bytes = 0
+    for output_file, file_state in list_output_files(output_dir).items():
+        if output_files.get(output_file) != file_state and not os.path.basename(output_file).startswith("output_"):
+            produced_files.append(os.path.relpath(output_file, output_dir))
+            output_bytes += file_state[0]
+    with output_dir_lock:
+        lock_entry = output_dir_locks[str(output_dir)]
+        lock_entry[0].release()
+        lock_entry[1] -= 1
+        if lock_entry[1] == 0:
+            del output_dir_locks[str(output_dir)]
+    return output_bytes, sorted(produced_files)
+
+def print_metrics_summary():
+    summary = {}
+    with run_metrics_lock:
+        for metric in run_metrics:
+            key = (metric["type"], metric["name"])
+            if key not in summary:
+                summary[key] = {"count": 0, "failed": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_rss_kb": 0, "input_bytes": 0, "output_bytes": 0}
+            row = summary[key]
+            row["count"] += 1
+            if metric.get("status") not in [0, None] or metric.get("error"):
+                row["failed"] += 1
+            for column in ["wall_time", "cpu_time", "input_bytes", "output_bytes"]:
+                row[column] += metric.get(column) or 0
+            row["peak_rss_kb"] = max(row["peak_rss_kb"], metric.get("peak_rss_kb") or 0)
+    if not summary:
+        return
+    print("{0:<10} {1:<45} {2:>5} {3:>6} {4:>10} {5:>10} {6:>9} {7:>10} {8:>10}".format("type", "name", "runs", "failed", "wall(s)", "cpu(s)", "rss(MB)", "in(MB)", "out(MB)"))
+    for (metric_type, name), row in sorted(summary.items(), key=lambda item: item[1]["wall_time"], reverse=True):
+        print("{0:<10} {1:<45} {2:>5} {3:>6} {4:>10.1f} {5:>10.1f} {6:>9} {7:>10.1f} {8:>10.1f}".format(metric_type, name[:45], row["count"], row["failed"], row["wall_time"], row["cpu_time"], row["peak_rss_kb"] // 1024, row["input_bytes"] / 1048576, row["output_bytes"] / 1048576))
+
+def write_prometheus_metrics(prometheus_file):
+    series = {}
+    with run_metrics_lock:
+        for metric in run_metrics:
+            key = (metric["type"], metric["name"], metric["target"])
+            values = series.setdefault(key, {})
+            for column in ["wall_time", "cpu_time", "input_bytes", "output_bytes"]:
+                if metric.get(column) != None:
+                    values[column] = values.get(column, 0) + metric[column]
+            for column in ["peak_rss_kb", "status"]:
+                if metric.get(column) != None:
+                    values[column] = max(values.get(column, 0), metric[column])
+    lines = []
+    metric_names = [["wall_time", "dfir_parser_wall_seconds", 1], ["cpu_time", "dfir_parser_cpu_seconds", 1], ["peak_rss_kb", "dfir_parser_peak_rss_bytes", 1024], ["input_bytes", "dfir_parser_input_bytes", 1], ["output_bytes", "dfir_parser_output_bytes", 1], ["status", "dfir_parser_exit_status", 1]]
+    for column, metric_name, scale in metric_names:
+        lines.append(f"# TYPE {metric_name} gauge")
+        for key, values in sorted(series.items()):
+            if column not in values:
+                continue
+            labels = ",".join('{0}="{1}"'.format(label, str(value).replace("\\", "\\\\").replace('"', '\\"')) for label, value in zip(["type", "name", "target"], key))
+            lines.append(f"{metric_name}{{{labels}}} {values[column] * scale}")
+    temp_file = f"{prometheus_file}.tmp"
+    with open(temp_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_file, prometheus_file)
+    print(f"wrote prometheus metrics to {prometheus_file}")
+
+def print_progress(log_file, progress):
+    print("{0}: {1} running for {2:.0f}s, {3} lines ({4:.0f} lines/s)".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), Path(log_file).name, progress["wall_time"], progress["lines"], progress["lines"] / max(progress["wall_time"], 1)))
+
+def wait_process(proc):
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return proc.returncode, usage.ru_maxrss, usage.ru_utime + usage.ru_stime
+    return proc.wait(), None, None
+
+def run_and_get_output(args, working_dir, output_file, progress_callback=None):
+    start_time = time.monotonic()
+    result = {"lines": 0, "bytes": 0}
+    proc = subprocess.Popen(args, cwd=working_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, errors="replace")
+    next_progress = start_time + windows_config.ProgressIntervalSeconds
+    with open(output_file, "w", buffering=windows_config.OutputBufferSize) as f:
+        for line in proc.stdout:
+            f.write(line)
+            result["lines"] += 1
+            result["bytes"] += len(line)
+            if progress_callback != None and time.monotonic() >= next_progress:
+                next_progress = time.monotonic() + windows_config.ProgressIntervalSeconds
+                progress_callback(dict(result, wall_time=time.monotonic() - start_time))
+    proc.stdout.close()
+    result["status"], result["peak_rss_kb"], result["cpu_time"] = wait_process(proc)
+    result["wall_time"] = time.monotonic() - start_time
+    return result
+
+tool_fingerprint_cache = {}
+
+def get_tool_fingerprint(path):
+    if path not in tool_fingerprint_cache:
+        tool_path = shutil.which(path)
+        fingerprint = {"path": path}
+        if tool_path != None:
+            tool_path = os.path.realpath(tool_path)
+            tool_stat = os.stat(tool_path)
+            fingerprint = {"path": tool_path, "size": tool_stat.st_size, "mtime": tool_stat.st_mtime_ns}
+        tool_fingerprint_cache[path] = fingerprint
+    return tool_fingerprint_cache[path]
+
+def get_fast_hash(path, block_size=1024 * 1024):
+    file_hash = hashlib.sha1()
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        file_size = f.tell()
+        file_hash.update(str(file_size).encode())
+        f.seek(0)
+        file_hash.update(f.read(block_size))
+        if file_size > block_size:
+            f.seek(max(block_size, file_size - block_size))
+            file_hash.update(f.read(block_size))
+    return file_hash.hexdigest()
+
+def create_manifest(path, command, inputs):
+    manifest_inputs = []
+    for input_path in sorted(inputs):
+        try:
+            input_stat = os.stat(input_path)
+        except OSError:
+            continue
+        manifest_input = {"path": str(input_path), "size": input_stat.st_size, "mtime": input_stat.st_mtime_ns}
+        if windows_config.IncrementalCacheHash:
+            manifest_input["hash"] = get_fast_hash(input_path)
+        manifest_inputs.append(manifest_input)
+    return {"command": f"{path} {command}", "tool": get_tool_fingerprint(path), "inputs": manifest_inputs}
+
+def load_manifest(manifest_file):
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def manifest_matches(saved_manifest, manifest):
+    # the outputs recorded by a run are not part of what makes it up to date
+    return saved_manifest != None and {key: value for key, value in saved_manifest.items() if key != "outputs"} == manifest
+
+def is_up_to_date(path, command, log_file, inputs):
+    log_file = Path(log_file)
+    if not windows_config.IncrementalCache:
+        return windows_convert.output_exists(log_file)
+    return windows_convert.output_exists(log_file) and manifest_matches(load_manifest(log_file.with_name(f"{log_file.stem}_manifest.json")), create_manifest(path, command, inputs))
+
+def remove_previous_run(log_file):
+    # log, manifest and the outputs the manifest recorded, the EZ tools name their outputs after the run time and a
+    # rerun would otherwise leave the older copy next to the new one
+    log_file = Path(log_file)
+    manifest_file = log_file.with_name(f"{log_file.stem}_manifest.json")
+    saved_manifest = load_manifest(manifest_file)
+    old_files = [log_file, manifest_file] + windows_convert.get_converted_files(log_file)
+    for output_name in (saved_manifest or {}).get("outputs", []):
+        output_file = log_file.parent.joinpath(output_name)
+        old_files += [output_file] + windows_convert.get_converted_files(output_file)
+    for old_file in old_files:
+        if old_file.exists():
+            os.remove(old_file)
+
+def execute_process(path, command, log_file, working_dir = tempfile.gettempdir(), progress_callback=print_progress, inputs=None):
+    log_file = Path(log_file)
+    manifest_file = log_file.with_name(f"{log_file.stem}_manifest.json")
+    manifest = None
+    if windows_config.IncrementalCache:
+        manifest = create_manifest(path, command, inputs if inputs != None else [])
+        if windows_convert.output_exists(log_file) and manifest_matches(load_manifest(manifest_file), manifest):
+            print("{0}: {1} is up to date, reusing previous results".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_file.name))
+            return None
+    elif windows_convert.output_exists(log_file):
+        return None
+    if ' ' in path:
+        path = f"\"{path}\""
+    args = [path] + shlex.split(command)
+    running_log_file = log_file.with_name(f"{log_file.stem}_running{log_file.suffix}")
+    failed_log_file = log_file.with_name(f"{log_file.stem}_failed{log_file.suffix}")
+    if failed_log_file.exists():
+        os.remove(failed_log_file)
+    input_bytes = sum(input_file["size"] for input_file in manifest["inputs"]) if manifest != None else sum(os.path.getsize(input_file) for input_file in (inputs or []) if os.path.exists(input_file))
+    output_files = lock_output_dir(log_file.parent)
+    try:
+        if manifest != None:
+            remove_previous_run(log_file)
+            output_files = list_output_files(log_file.parent)
+        result = run_and_get_output(args, working_dir, running_log_file, lambda progress: progress_callback(log_file, progress) if progress_callback != None else None)
+    except OSError as e:
+        output_bytes, _ = unlock_output_dir(log_file.parent, output_files)
+        with open(failed_log_file, "w") as f:
+            f.write(f"Run '{path} {command}' failed!\r\n")
+            f.write(f"{e}\r\n")
+        record_metric("process", log_file.stem, get_target_name(log_file), status=None, error=str(e), input_bytes=input_bytes, output_bytes=output_bytes)
+        return {"status": None, "error": str(e)}
+    except BaseException:
+        unlock_output_dir(log_file.parent, output_files)
+        raise
+
+    output_bytes, produced_files = unlock_output_dir(log_file.parent, output_files)
+    if result["status"] == 0:
+        os.replace(running_log_file, log_file)
+        if manifest != None:
+            with open(manifest_file, "w") as f:
+                json.dump(dict(manifest, outputs=produced_files), f, indent=1)
+    else:
+        with open(running_log_file, "a") as f:
+            f.write(f"Run '{path} {command}' failed with exit code {result['status']}!\r\n")
+        os.replace(running_log_file, failed_log_file)
+    record_metric("process", log_file.stem, get_target_name(log_file), status=result["status"], wall_time=result["wall_time"], cpu_time=result["cpu_time"], peak_rss_kb=result["peak_rss_kb"], input_bytes=input_bytes, output_bytes=output_bytes, output_lines=result["lines"])
+    print("{0}: {1} exited with {2} after {3:.1f}s, peak RSS {4} MB".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_file.name, result["status"], result["wall_time"], result["peak_rss_kb"] // 1024 if result["peak_rss_kb"] != None else "n/a"))
+    return result
+
+EVTX_CHUNK_OFFSET = 0x1000
+EVTX_CHUNK_SIZE = 0x10000
+EVENT_NAMESPACE = "{http://schemas.microsoft.com/win/2004/08/events/event}"
+EVTX_RECORD_MAGIC = b"\x2a\x2a\x00\x00"
+FILETIME_EPOCH = datetime(1601, 1, 1)
+FILTER_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# time window and allow-lists applied to the event log and journal modules (--since/--until/--event-ids/--channels)
+event_filter = {"since": None, "until": None, "event_ids": [], "channels": []}
+evtx_time_range_cache = {}
+evtx_time_range_lock = threading.Lock()
+
+def parse_filter_time(value):
+    # YYYY-MM-DD[ HH:MM:SS] in UTC
+    if value == None or value == "":
+        return None
+    for time_format in [FILTER_TIME_FORMAT, "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]:
+        try:
+            return datetime.strptime(str(value).strip().rstrip("Z"), time_format)
+        except ValueError:
+            continue
+    raise ValueError(f"invalid time {value}, expected YYYY-MM-DD[ HH:MM:SS]")
+
+def init_event_filter(since=None, until=None, event_ids=None, channels=None, use_config=True):
+    # command line values over the windows_config ones, queue workers get the coordinator's filter through the queue
+    # and use it as it is (use_config False), an empty value there means no filter
+    global event_filter
+    if not use_config:
+        event_ids = event_ids or []
+        channels = channels or []
+    since = parse_filter_time(since if since != None or not use_config else windows_config.FilterSince)
+    until = parse_filter_time(until if until != None or not use_config else windows_config.FilterUntil)
+    if since != None and until != None and since > until:
+        raise ValueError("--since is after --until")
+    event_filter = {
+        "since": since.strftime(FILTER_TIME_FORMAT) if since != None else None,
+        "until": until.strftime(FILTER_TIME_FORMAT) if until != None else None,
+        "event_ids": [int(event_id) for event_id in (event_ids if event_ids or not use_config else windows_config.FilterEventIds)],
+        "channels": list(channels if channels or not use_config else windows_config.FilterChannels),
+    }
+    if event_filter["since"] or event_filter["until"] or event_filter["event_ids"] or event_filter["channels"]:
+        print("using event filter: since {0}, until {1}, event ids {2}, channels {3}".format(event_filter["since"] or "-", event_filter["until"] or "-", ",".join(str(event_id) for event_id in event_filter["event_ids"]) or "all", ", ".join(event_filter["channels"]) or "all"))
+    return event_filter
+
+def get_filter_args(tool):
+    # the time window (and event ids where the tool has such a filter) as the tool's own options
+    since = event_filter["since"]
+    until = event_filter["until"]
+    filter_args = []
+    if tool in ["hayabusa", "hayabusa_timeline"]:
+        if since != None:
+            filter_args.append(f"--timeline-start \"{since} +00:00\"")
+        if until != None:
+            filter_args.append(f"--timeline-end \"{until} +00:00\"")
+        if tool == "hayabusa_timeline" and event_filter["event_ids"]:
+            filter_args.append("--include-eid {0}".format(",".join(str(event_id) for event_id in event_filter["event_ids"])))
+    elif tool == "chainsaw":
+        if since != None:
+            filter_args.append("--from \"{0}\"".format(since.replace(" ", "T")))
+        if until != None:
+            filter_args.append("--to \"{0}\"".format(until.replace(" ", "T")))
+    elif tool == "zircolite":
+        if since != None:
+            filter_args.append("--after \"{0}\"".format(since.replace(" ", "T")))
+        if until != None:
+            filter_args.append("--before \"{0}\"".format(until.replace(" ", "T")))
+    elif tool == "EvtxECmd":
+        if since != None:
+            filter_args.append(f"--sd \"{since}\"")
+        if until != None:
+            filter_args.append(f"--ed \"{until}\"")
+        if event_filter["event_ids"]:
+            filter_args.append("--inc {0}".format(",".join(str(event_id) for event_id in event_filter["event_ids"])))
+    return "".join(" " + filter_arg for filter_arg in filter_args)
+
+def to_filetime(value):
+    return (value - FILETIME_EPOCH) // timedelta(microseconds=1) * 10
+
+def read_evtx_time_range(evtx_file):
+    # oldest and newest record time (FILETIME) from the first and last record of every chunk, the log is circular
+    # so chunks are not in time order. None when no chunk could be read
+    first_time = None
+    last_time = None
+    with open(evtx_file, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        for chunk_offset in range(EVTX_CHUNK_OFFSET, file_size - EVTX_CHUNK_SIZE + 1, EVTX_CHUNK_SIZE):
+            f.seek(chunk_offset)
+            header = f.read(0x30)
+            if len(header) < 0x30 or header[:8] != b"ElfChnk\0":
+                continue
+            last_record_offset = struct.unpack_from("<I", header, 0x2C)[0]
+            for record_offset in [0x200, last_record_offset]:
+                if record_offset < 0x200 or record_offset > EVTX_CHUNK_SIZE - 0x18:
+                    continue
+                f.seek(chunk_offset + record_offset)
+                record = f.read(0x18)
+                if len(record) < 0x18 or record[:4] != EVTX_RECORD_MAGIC:
+                    continue
+                record_time = struct.unpack_from("<Q", record, 0x10)[0]
+                first_time = record_time if first_time == None else min(first_time, record_time)
+                last_time = record_time if last_time == None else max(last_time, record_time)
+    return [first_time, last_time] if first_time != None else None
+
+def get_evtx_time_range(evtx_file):
+    file_stat = os.stat(evtx_file)
+    key = (str(evtx_file), file_stat.st_size, file_stat.st_mtime_ns)
+    with evtx_time_range_lock:
+        if key in evtx_time_range_cache:
+            return evtx_time_range_cache[key]
+    time_range = read_evtx_time_range(evtx_file)
+    with evtx_time_range_lock:
+        evtx_time_range_cache[key] = time_range
+    return time_range
+
+def filter_evtx_files(evtx_files):
+    # drops logs of other channels (by file name) and logs without any record in the time window before any tool opens them
+    since = parse_filter_time(event_filter["since"])
+    until = parse_filter_time(event_filter["until"])
+    channels = set(channel.lower() for channel in event_filter["channels"])
+    if since == None and until == None and not channels:
+        return evtx_files
+    kept_files = []
+    for evtx_file in evtx_files:
+        if channels and Path(evtx_file).stem.replace("%4", "/").lower() not in channels:
+            continue
+        if since != None or until != None:
+            try:
+                time_range = get_evtx_time_range(evtx_file)
+            except OSError:
+                time_range = None
+            if time_range != None and (since != None and time_range[1] < to_filetime(since) or until != None and time_range[0] > to_filetime(until)):
+                continue
+        kept_files.append(evtx_file)
+    if len(kept_files) != len(evtx_files):
+        print("{0}: Event filter kept {1} of {2} evtx files".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(kept_files), len(evtx_files)))
+    return kept_files
+
+def parse_script_block_xml(record_xml):
+    root = ElementTree.fromstring(record_xml)
+    system = root.find(f"{EVENT_NAMESPACE}System")
+    if system == None or system.findtext(f"{EVENT_NAMESPACE}EventID", "").strip() != "4104":
+        return None
+    event_data = {}
+    for data in root.iter(f"{EVENT_NAMESPACE}Data"):
+        event_data[data.get("Name")] = data.text or ""
+    time_created = system.find(f"{EVENT_NAMESPACE}TimeCreated")
+    return {
+        "ScriptBlockId": event_data.get("ScriptBlockId", ""),
+        "MessageNumber": int(event_data.get("MessageNumber") or 1),
+        "MessageTotal": int(event_data.get("MessageTotal") or 1),
+        "ScriptBlockText": event_data.get("ScriptBlockText", ""),
+        "Path": event_data.get("Path", ""),
+        "TimeCreated": time_created.get("SystemTime", "") if time_created != None else "",
+        "Computer": system.findtext(f"{EVENT_NAMESPACE}Computer", ""),
+    }
+
+def parse_script_block_json(event):
+    event_data = event.get("Event", {}).get("EventData") or {}
+    system = event.get("Event", {}).get("System", {})
+    return {
+        "ScriptBlockId": str(event_data.get("ScriptBlockId", "")),
+        "MessageNumber": int(event_data.get("MessageNumber") or 1),
+        "MessageTotal": int(event_data.get("MessageTotal") or 1),
+        "ScriptBlockText": str(event_data.get("ScriptBlockText") or ""),
+        "Path": str(event_data.get("Path") or ""),
+        "TimeCreated": str(system.get("TimeCreated", {}).get("#attributes", {}).get("SystemTime", "")),
+        "Computer": str(system.get("Computer", "")),
+    }
+
+def read_script_block_chunks(evtx_file, chunk_numbers):
+    fragments = []
+    with open(evtx_file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for chunk_number in chunk_numbers:
+                chunk = Evtx.ChunkHeader(buf, EVTX_CHUNK_OFFSET + chunk_number * EVTX_CHUNK_SIZE)
+                if not chunk.check_magic():
+                    continue
+                for record in chunk.records():
+                    try:
+                        fragment = parse_script_block_xml(record.xml())
+                    except Exception:
+                        continue
+                    if fragment != None:
+                        fragment["EvtxFile"] = str(evtx_file)
+                        fragments.append(fragment)
+    return fragments
+
+def iter_script_block_fragments(evtx_files, evtx_cache_dir):
+    if evtx_cache_dir != None:
+        for cached_file in find_cached_events(evtx_cache_dir, "Microsoft-Windows-PowerShell/Operational", 4104):
+            for event in iter_cached_events([cached_file]):
+                fragment = parse_script_block_json(event)
+                fragment["EvtxFile"] = cached_file.stem
+                yield fragment
+        return
+
+    tasks = []
+    for evtx_file in evtx_files:
+        chunk_count = max(0, (os.path.getsize(evtx_file) - EVTX_CHUNK_OFFSET) // EVTX_CHUNK_SIZE)
+        for first_chunk in range(0, chunk_count, windows_config.ScriptBlockChunksPerTask):
+            tasks.append((evtx_file, range(first_chunk, min(chunk_count, first_chunk + windows_config.ScriptBlockChunksPerTask))))
+
+    workers = get_job_workers(windows_config.ScriptBlockWorkers)
+    # spawned, the job threads of the scheduler may hold locks at the time of a fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        running_tasks = []
+        for task in tasks:
+            running_tasks.append(executor.submit(read_script_block_chunks, *task))
+            if len(running_tasks) >= workers * 2:
+                yield from running_tasks.pop(0).result()
+        for running_task in running_tasks:
+            yield from running_task.result()
+
+def write_script_block(result_dir, script_blocks, block, text, complete):
+    block_hash = hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()
+    if block_hash not in script_blocks:
+        output_file = Path(result_dir).joinpath(f"{block_hash}.ps1")
+        with open(output_file, "w", encoding="utf-8", errors="replace") as f:
+            f.write(text)
+        script_blocks[block_hash] = {"SHA256": block_hash, "ScriptBlockId": block["ScriptBlockId"], "Path": block["Path"], "Computer": block["Computer"], "FirstSeen": block["TimeCreated"], "LastSeen": block["TimeCreated"], "Count": 0, "Complete": complete, "EvtxFile": block["EvtxFile"], "OutputFile": output_file.name}
+    summary = script_blocks[block_hash]
+    summary["Count"] += 1
+    summary["FirstSeen"] = min(summary["FirstSeen"], block["TimeCreated"])
+    summary["LastSeen"] = max(summary["LastSeen"], block["TimeCreated"])
 
 def module_script_block_powershell(source, dest, log_prefix):
-    powershell_evtx = ""
-    for file_evtx in Path(source).rglob(r"Microsoft-Windows-PowerShell%4Operational.evtx"):
-        powershell_evtx = file_evtx.resolve()
-        break
-    if powershell_evtx != "":
-        powershell_script_block_result_dir = Path(dest).joinpath("powershell_script_block")
+    powershell_evtx_files = filter_evtx_files(get_module_inputs(source, "module_script_block_powershell"))
+    if not powershell_evtx_files:
+        return
 
-        os.makedirs(powershell_script_block_result_dir, exist_ok=True)
+    powershell_script_block_result_dir = Path(dest).joinpath("powershell_script_block")
 
-        script_block_command = f"-e \"{powershell_evtx}\" -o {powershell_script_block_result_dir} -s"
+    os.makedirs(powershell_script_block_result_dir, exist_ok=True)
 
-        log_ps_script_block_file = powershell_script_block_result_dir.joinpath(f"output_{log_prefix}.txt")
+    log_ps_script_block_file = powershell_script_block_result_dir.joinpath(f"output_{log_prefix}.txt")
+    manifest_file = powershell_script_block_result_dir.joinpath(f"output_{log_prefix}_manifest.json")
 
-        execute_process(script_block_bin, script_block_command, log_ps_script_block_file, hayabusa_dir)
+    evtx_cache_dir = get_evtx_cache(source, Path(dest).parent)
+    if evtx_cache_dir != None:
+        powershell_evtx_files = [str(cached_file) for cached_file in find_cached_events(evtx_cache_dir, "Microsoft-Windows-PowerShell/Operational", 4104)]
+    elif Evtx == None:
+        print("python-evtx is not installed, skipping powershell script block extraction")
+        return
+
+    # extracted in this process, the manifest names the interpreter and module like execute_process does for a tool
+    command_line = f"{Path(__file__).name} {log_prefix}"
+    if is_up_to_date(sys.executable, command_line, log_ps_script_block_file, powershell_evtx_files):
+        print("{0}: {1} is up to date, reusing previous results".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_ps_script_block_file.name))
+        return
+    remove_previous_run(log_ps_script_block_file)
+    manifest = create_manifest(sys.executable, command_line, powershell_evtx_files)
+
+    start_time = time.monotonic()
+    script_blocks = {}
+    pending_blocks = {}
+    event_count = 0
+    for fragment in iter_script_block_fragments(powershell_evtx_files, evtx_cache_dir):
+        event_count += 1
+        if fragment["MessageTotal"] <= 1:
+            write_script_block(powershell_script_block_result_dir, script_blocks, fragment, fragment["ScriptBlockText"], True)
+            continue
+        pending_block = pending_blocks.setdefault(fragment["ScriptBlockId"], dict(fragment, Parts={}))
+        pending_block["Parts"][fragment["MessageNumber"]] = fragment["ScriptBlockText"]
+        if len(pending_block["Parts"]) >= pending_block["MessageTotal"]:
+            text = "".join(pending_block["Parts"][number] for number in sorted(pending_block["Parts"]))
+            write_script_block(powershell_script_block_result_dir, script_blocks, pending_block, text, True)
+            del pending_blocks[fragment["ScriptBlockId"]]
+    for pending_block in pending_blocks.values():
+        text = "".join(pending_block["Parts"][number] for number in sorted(pending_block["Parts"]))
+        write_script_block(powershell_script_block_result_dir, script_blocks, pending_block, text, False)
+
+    with open(powershell_script_block_result_dir.joinpath("script_blocks.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["SHA256", "ScriptBlockId", "Path", "Computer", "FirstSeen", "LastSeen", "Count", "Complete", "EvtxFile", "OutputFile"])
+        writer.writeheader()
+        for script_block in sorted(script_blocks.values(), key=lambda script_block: script_block["FirstSeen"]):
+            writer.writerow(script_block)
+
+    with open(log_ps_script_block_file, "w") as f:
+        f.write(f"Processed {event_count} 4104 events from {len(powershell_evtx_files)} files in {time.monotonic() - start_time:.1f}s\r\n")
+        f.write(f"Wrote {len(script_blocks)} unique script blocks, {len(pending_blocks)} incomplete\r\n")
+    if windows_config.IncrementalCache:
+        with open(manifest_file, "w") as f:
+            json.dump(dict(manifest, outputs=["script_blocks.csv"] + sorted(script_block["OutputFile"] for script_block in script_blocks.values())), f, indent=1)
+    print("{0}: {1} wrote {2} unique script blocks from {3} events".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_prefix, len(script_blocks), event_count))
+    return
 
 def module_SQLECmd(source, dest, log_prefix):
-    log_file = Path(dest).joinpath(f"output_{log_prefix}.txt")
-    command_line = f"-d \"{source}\" --csv \"{dest}\""
-    execute_process(SQLECmd_bin, command_line, log_file)
+    run_directory_tool(source, dest, log_prefix, "module_SQLECmd")
     return
 
-def module_MFTECmd(source, dest, log_prefix):
-    mft_file = ""
-    j_file = ""
+USN_PAGE_SIZE = 0x1000
+USN_SCAN_BLOCK = 1024 * 1024
+
+def get_ntfs_volume(source, ntfs_file, marker):
+    # volume folder (the parent of $Extend for $J) plus a name prefix such as C_$MFT, tagged for the output names
+    prefix = os.path.basename(ntfs_file)[:-len(marker)]
+    if marker == "$J":
+        prefix = re.sub(r"\$UsnJrnl(%3A|:)?$", "", prefix, flags=re.IGNORECASE)
+    prefix = prefix.strip("_-. ")
+    volume_dir = os.path.dirname(ntfs_file)
+    if os.path.basename(volume_dir).lower() == "$extend":
+        volume_dir = os.path.dirname(volume_dir)
+    parts = [part for part in Path(os.path.relpath(volume_dir, source)).parts if part != "."] + ([prefix] if prefix else [])
+    tag = re.sub(r"[^A-Za-z0-9]+", "_", "_".join(parts)).strip("_") or "volume"
+    return (volume_dir, prefix.lower()), tag
+
+def find_ntfs_volumes(source):
+    volumes = {}
+    for marker, key in [["$MFT", "mft"], ["$J", "j"]]:
+        for ntfs_file in find_artifact_files(source, suffix=marker):
+            if os.path.getsize(ntfs_file) == 0:
+                continue
+            volume_key, tag = get_ntfs_volume(source, ntfs_file, marker)
+            volume = volumes.setdefault(volume_key, {"tag": tag, "mft": None, "j": None})
+            if volume[key] == None:
+                volume[key] = ntfs_file
+    tags = set()
+    for volume in sorted(volumes.values(), key=lambda volume: volume["tag"]):
+        tag = volume["tag"]
+        while volume["tag"] in tags:
+            volume["tag"] = f"{tag}_{len(tags)}"
+        tags.add(volume["tag"])
+    return sorted(volumes.values(), key=lambda volume: volume["tag"])
+
+def find_usn_data_offset(j_file):
+    # the leading part of $J is sparse (zeros once copied), skip holes with SEEK_DATA then scan the zeros through mmap
+    with open(j_file, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        if hasattr(os, "SEEK_DATA"):
+            try:
+                offset = os.lseek(f.fileno(), 0, os.SEEK_DATA)
+            except OSError as e:
+                # ENXIO: no data after the offset, the whole file is a hole. Anything else, $J is parsed in full
+                return file_size if e.errno == errno.ENXIO else 0
+        offset -= offset % mmap.ALLOCATIONGRANULARITY
+        zero_block = bytes(USN_SCAN_BLOCK)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while offset < file_size:
+                block = mm[offset:offset + USN_SCAN_BLOCK]
+                if block != zero_block[:len(block)]:
+                    offset += len(block) - len(block.lstrip(b"\0"))
+                    return offset - offset % USN_PAGE_SIZE
+                offset += len(block)
+    return file_size
+
+def read_usn_page_time(f, page_offset):
+    # FILETIME of the record starting at page_offset, None when no record starts there (a record's USN is its offset in $J)
+    f.seek(page_offset)
+    record = f.read(0x40)
+    if len(record) < 0x40:
+        return None
+    record_length, major_version, _ = struct.unpack_from("<IHH", record)
+    if major_version == 2:
+        usn, record_time = struct.unpack_from("<qQ", record, 0x18)
+    elif major_version == 3:
+        usn, record_time = struct.unpack_from("<qQ", record, 0x28)
+    else:
+        return None
+    if record_length < 0x3C or record_length > USN_PAGE_SIZE or usn != page_offset:
+        return None
+    return record_time
+
+def find_usn_time_offset(j_file, data_offset, since_filetime):
+    # records are written in time order and do not span pages, binary search for the last page starting before since.
+    # Every record before that page is older than since, pages that do not start with a record keep their range
+    with open(j_file, "rb") as f:
+        low = data_offset // USN_PAGE_SIZE
+        high = os.fstat(f.fileno()).st_size // USN_PAGE_SIZE
+        while high - low > 1:
+            middle = (low + high) // 2
+            page = middle
+            record_time = read_usn_page_time(f, page * USN_PAGE_SIZE)
+            while record_time == None and page + 1 < high and page - middle < 16:
+                page += 1
+                record_time = read_usn_page_time(f, page * USN_PAGE_SIZE)
+            if record_time == None or record_time >= since_filetime:
+                high = middle
+            else:
+                low = page
+    return low * USN_PAGE_SIZE
+
+def copy_file_from(source_file, dest_file, offset):
+    # copy_file_range keeps the copy in the kernel (a reflink on btrfs/xfs), sendfile and a plain copy are the fallbacks
+    with open(source_file, "rb") as source_f, open(dest_file, "wb") as dest_f:
+        remaining = os.fstat(source_f.fileno()).st_size - offset
+        for copy_function in [getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)]:
+            if copy_function == None:
+                continue
+            try:
+                while remaining > 0:
+                    if copy_function == os.sendfile:
+                        copied = os.sendfile(dest_f.fileno(), source_f.fileno(), offset, min(remaining, 0x7ffff000))
+                    else:
+                        copied = copy_function(source_f.fileno(), dest_f.fileno(), min(remaining, 0x7ffff000), offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+                    remaining -= copied
+                return
+            except OSError:
+                continue
+        source_f.seek(offset)
+        shutil.copyfileobj(source_f, dest_f, USN_SCAN_BLOCK)
+
+def rebase_usn_output(csv_file, staged_file, j_file, data_offset):
+    # map the trimmed copy back to the collected $J in SourceFile and OffsetToData
+    temp_file = Path(csv_file).with_name(Path(csv_file).name + ".tmp")
+    with open(csv_file, "r", newline="", encoding="utf-8", errors="replace") as f, open(temp_file, "w", newline="", encoding="utf-8") as temp_f:
+        reader = csv.DictReader(f)
+        writer = csv.DictWriter(temp_f, fieldnames=reader.fieldnames or [])
+        writer.writeheader()
+        for row in reader:
+            if row.get("SourceFile") == str(staged_file):
+                row["SourceFile"] = j_file
+            if (row.get("OffsetToData") or "").isdigit():
+                row["OffsetToData"] = str(int(row["OffsetToData"]) + data_offset)
+            writer.writerow(row)
+    os.replace(temp_file, csv_file)
+
+def run_MFTECmd_usn(volume, dest, log_prefix):
+    j_file = volume["j"]
+    inputs = [j_file] + ([volume["mft"]] if volume["mft"] else [])
+    log_file = Path(dest).joinpath(f"output_{log_prefix}_{volume['tag']}_j.txt")
+    output_file = Path(dest).joinpath(f"{volume['tag']}_MFTECmd_$J_Output.csv")
+    data_offset = find_usn_data_offset(j_file) if windows_config.NtfsTrimUsnJournal else 0
+    if data_offset >= os.path.getsize(j_file):
+        print("{0}: {1} has no USN records".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), j_file))
+        return
+    # records older than --since are cut with the empty part, the window is in the staged path so the manifest follows it
+    stage_name = volume["tag"]
+    since = parse_filter_time(event_filter["since"])
+    if since != None and windows_config.NtfsTrimUsnJournal:
+        data_offset = find_usn_time_offset(j_file, data_offset, to_filetime(since))
+        stage_name += "_since_{0}".format(since.strftime("%Y%m%d%H%M%S"))
+    trimmed = data_offset >= windows_config.NtfsTrimMinBytes
+    parse_file = Path(dest).joinpath("usn_trim", stage_name, "$J") if trimmed else j_file
+    if not trimmed:
+        data_offset = 0
+    command_line = f"-f \"{parse_file}\"" + (f" -m \"{volume['mft']}\"" if volume["mft"] else "") + f" --csv \"{dest}\" --csvf \"{output_file.name}\""
+    if not trimmed or is_up_to_date(MFTECmd_bin, command_line, log_file, inputs):
+        execute_process(MFTECmd_bin, command_line, log_file, inputs=inputs)
+        return
 
-    for path in Path(source).rglob("*$MFT"):
-        mft_file = path.resolve()
-    for path in Path(source).rglob("*$J"):
-        j_file = path.resolve()
-    
-    log_ntfs_file = Path(dest).joinpath(f"output_{log_prefix}_mft_j.txt")
-
-    if mft_file != "" and j_file != "":
-        command_line = f"-f \"{j_file}\" -m \"{mft_file}\" --csv \"{dest}\""
-        execute_process(MFTECmd_bin, command_line, log_ntfs_file)
-    elif mft_file != "":
-        command_line = f"-f \"{mft_file}\" --csv \"{dest}\""
-        execute_process(MFTECmd_bin, command_line, log_ntfs_file)
+    os.makedirs(parse_file.parent, exist_ok=True)
+    start_time = time.monotonic()
+    copy_file_from(j_file, parse_file, data_offset)
+    print("{0}: Skipped {1} MB of empty or out of window USN journal in {2}, staged {3} MB in {4:.1f}s".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), data_offset // (1024 * 1024), j_file, os.path.getsize(parse_file) // (1024 * 1024), time.monotonic() - start_time))
+    try:
+        result = execute_process(MFTECmd_bin, command_line, log_file, inputs=inputs)
+    finally:
+        shutil.rmtree(parse_file.parent, ignore_errors=True)
+        try:
+            os.rmdir(parse_file.parent.parent)
+        except OSError:
+            pass
+    if result != None and result.get("status") == 0 and output_file.exists():
+        rebase_usn_output(output_file, parse_file, j_file, data_offset)
+
+def module_MFTECmd(source, dest, log_prefix):
+    volumes = find_ntfs_volumes(source)
+    if not volumes:
+        return
+    print("{0}: {1} found {2} volumes: {3}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_prefix, len(volumes), ", ".join(volume["tag"] for volume in volumes)))
+
+    def run_MFTECmd_mft(volume):
+        log_file = Path(dest).joinpath(f"output_{log_prefix}_{volume['tag']}_mft.txt")
+        command_line = f"-f \"{volume['mft']}\" --csv \"{dest}\" --csvf \"{volume['tag']}_MFTECmd_$MFT_Output.csv\""
+        execute_process(MFTECmd_bin, command_line, log_file, inputs=[volume["mft"]])
+
+    tasks = []
+    for volume in volumes:
+        if volume["mft"]:
+            tasks.append([run_MFTECmd_mft, volume])
+        if volume["j"]:
+            tasks.append([lambda volume: run_MFTECmd_usn(volume, dest, log_prefix), volume])
+    with ThreadPoolExecutor(max_workers=max(1, min(get_job_workers(windows_config.NtfsWorkers), len(tasks)))) as executor:
+        for future in [executor.submit(task_function, volume) for task_function, volume in tasks]:
+            future.result()
     return
 
 def module_AmcacheParser(source, dest, log_prefix):
     log_file = Path(dest).joinpath(f"output_{log_prefix}.txt")
-    for amcache_file_path in Path(source).rglob("Amcache.hve"):
+    for amcache_file_path in find_artifact_files(source, name="Amcache.hve"):
         command_line = f"-f \"{amcache_file_path}\" --csv \"{dest}\" -i --mp"
-        execute_process(AmcacheParser_bin, command_line, log_file)
+        execute_process(AmcacheParser_bin, command_line, log_file, inputs=get_module_inputs(source, "module_AmcacheParser"))
         break
     return
 
 def module_AppCompatCacheParser(source, dest, log_prefix):
     log_file = Path(dest).joinpath(f"output_{log_prefix}.txt")
-    for appcom_file_path in Path(source).rglob("SYSTEM"):
+    for appcom_file_path in find_artifact_files(source, name="SYSTEM"):
         command_line = f"-f \"{appcom_file_path}\" --csv \"{dest}\""
-        execute_process(AppCompatCacheParser_bin, command_line, log_file)
+        execute_process(AppCompatCacheParser_bin, command_line, log_file, inputs=get_module_inputs(source, "module_AppCompatCacheParser"))
         break
     return
 
 def module_prefetchruncounts(source, dest, log_prefix):
     log_file = Path(dest).joinpath(f"output_{log_prefix}.csv")
     prefetch_dir = ""
-    for prefetch_search_dir in Path(source).rglob("*"):
-        if prefetch_search_dir.name.lower() == "prefetch":
-            prefetch_dir = prefetch_search_dir.resolve()
-            break
+    for prefetch_search_dir in find_artifact_dirs(source, "prefetch"):
+        prefetch_dir = Path(prefetch_search_dir).resolve()
+        break
 
     if prefetch_dir != "":
         command_line = f"\"{prefetch_dir}\""
-        execute_process(prefetchruncounts_bin, command_line, log_file)
+        execute_process(prefetchruncounts_bin, command_line, log_file, inputs=get_module_inputs(source, "module_prefetchruncounts"))
     return
 
 def module_EvtxECmd(source, dest, log_prefix):
     evtxcmd_result_dir = Path(dest).joinpath("sofelk_evtx")
     os.makedirs(evtxcmd_result_dir, exist_ok=True)
     log_file = Path(evtxcmd_result_dir).joinpath(f"output_{log_prefix}.txt")
-    command_line = f"-d \"{source}\" --json \"{evtxcmd_result_dir}\""
-    execute_process(EvtxEcmd_bin, command_line, log_file)
+    evtx_files = [evtx_file for evtx_file in find_artifact_files(source, ext=".evtx") if os.path.getsize(evtx_file) > 0]
+    kept_files = filter_evtx_files(evtx_files)
+    if not kept_files:
+        return
+    evtx_dir = source
+    inputs = get_module_inputs(source, "module_EvtxECmd")
+    path_map = {}
+    if len(kept_files) != len(evtx_files):
+        # EvtxECmd only reads folders, the evtx files kept by the event filter are linked into one of their own
+        evtx_dir = stage_evtx_files(kept_files, evtxcmd_result_dir.joinpath("evtx"), path_map)
+        inputs = kept_files
+    command_line = f"-d \"{evtx_dir}\" --json \"{evtxcmd_result_dir}\"" + get_filter_args("EvtxECmd")
+    result = execute_process(EvtxEcmd_bin, command_line, log_file, inputs=inputs)
+    if path_map:
+        shutil.rmtree(evtx_dir, ignore_errors=True)
+        path_prefixes = sorted(set((os.path.dirname(staged_file) + os.sep, os.path.dirname(evtx_file) + os.sep) for staged_file, evtx_file in path_map.items()))
+        for output_file in evtxcmd_result_dir.glob("*.json") if result != None else []:
+            if not output_file.name.endswith("_manifest.json"):
+                windows_convert.rebase_output_file(output_file, path_prefixes)
     return
 
-def module_PECmd(source, dest, log_prefix):
+# EZ tools parsing a whole folder: [tool, arguments after --csv, column naming the parsed file (to split batched runs)]
+directory_tools = {
+    "module_PECmd": [PECmd_bin, "--mp -q", "SourceFilename"],
+    "module_JLECmd": [JLECmd_bin, "--mp -q", "SourceFile"],
+    "module_RBCmd": [RBCmd_bin, "-q", "SourceName"],
+    "module_SQLECmd": [SQLECmd_bin, "", "SourceFile"],
+}
+
+def get_directory_command(source, dest, tool_args):
+    return f"-d \"{source}\" --csv \"{dest}\" {tool_args}".strip()
+
+def run_directory_tool(source, dest, log_prefix, module_name):
+    tool_bin, tool_args, _ = directory_tools[module_name]
     log_file = Path(dest).joinpath(f"output_{log_prefix}.txt")
-    command_line = f"-d \"{source}\" --csv \"{dest}\" --mp -q"
-    execute_process(PECmd_bin, command_line, log_file)
+    execute_process(tool_bin, get_directory_command(source, dest, tool_args), log_file, inputs=get_module_inputs(source, module_name))
+
+def module_PECmd(source, dest, log_prefix):
+    run_directory_tool(source, dest, log_prefix, "module_PECmd")
     return
 
 def module_JLECmd(source, dest, log_prefix):
-    log_file = Path(dest).joinpath(f"output_{log_prefix}.txt")
-    command_line = f"-d \"{source}\" --csv \"{dest}\" --mp -q"
-    execute_process(JLECmd_bin, command_line, log_file)
+    run_directory_tool(source, dest, log_prefix, "module_JLECmd")
     return
 
 def module_RBCmd(source, dest, log_prefix):
-    log_file = Path(dest).joinpath(f"output_{log_prefix}.txt")
-    command_line = f"-d \"{source}\" --csv \"{dest}\" -q"
-    execute_process(RBCmd_bin, command_line, log_file)
+    run_directory_tool(source, dest, log_prefix, "module_RBCmd")
     return
 
 def module_SBECmd(source, dest, log_prefix):
     log_file = Path(dest).joinpath(f"output_{log_prefix}.txt")
     command_line = f"-d \"{source}\" --csv \"{dest}\""
-    execute_process(SBECmd_bin, command_line, log_file)
+    execute_process(SBECmd_bin, command_line, log_file, inputs=get_module_inputs(source, "module_SBECmd"))
     return
 
 def module_WxTCmd(source, dest, log_prefix):
     log_file = Path(dest).joinpath(f"output_{log_prefix}.txt")
-    for activities_file_path in Path(source).rglob("ActivitiesCache.db"):
+    for activities_file_path in find_artifact_files(source, name="ActivitiesCache.db"):
         command_line = f"-f \"{activities_file_path}\" --csv \"{dest}\""
-        execute_process(AmcacheParser_bin, command_line, log_file)
+        execute_process(AmcacheParser_bin, command_line, log_file, inputs=get_module_inputs(source, "module_WxTCmd"))
         break
     return
 
 def module_RecentFileCacheParser(source, dest, log_prefix):
     log_file = Path(dest).joinpath(f"output_{log_prefix}.txt")
-    for recent_cache_file_path in Path(source).rglob("RecentFileCache.bcf"):
+    for recent_cache_file_path in find_artifact_files(source, name="RecentFileCache.bcf"):
         command_line = f"-f \"{recent_cache_file_path}\" --csv \"{dest}\""
-        execute_process(AmcacheParser_bin, command_line, log_file)
+        execute_process(AmcacheParser_bin, command_line, log_file, inputs=get_module_inputs(source, "module_RecentFileCacheParser"))
         break
     return
 
+registry_hive_names = ["SYSTEM", "SOFTWARE", "SAM", "SECURITY", "DEFAULT", "NTUSER.DAT", "UsrClass.dat", "Amcache.hve"]
+registry_hive_cache = {}
+registry_hive_locks = {}
+registry_hive_lock = threading.Lock()
+
+def find_hive_logs(source, hive_file):
+    hive_dir = os.path.dirname(hive_file)
+    hive_logs = []
+    for log_ext in [".LOG1", ".LOG2"]:
+        hive_logs += [log_file for log_file in find_artifact_files(source, name=os.path.basename(hive_file) + log_ext) if os.path.dirname(log_file) == hive_dir]
+    return hive_logs
+
+def hash_files(files):
+    sha1 = hashlib.sha1()
+    for hash_file in files:
+        with open(hash_file, "rb") as f:
+            while True:
+                data = f.read(1024 * 1024)
+                if not data:
+                    break
+                sha1.update(data)
+        sha1.update(b"\0")
+    return sha1.hexdigest()
+
+def find_registry_hives(source):
+    # one entry per distinct hive (content of the hive and its transaction logs), copies like RegBack are listed as duplicates
+    hives = {}
+    for hive_name in registry_hive_names:
+        # live hives first, so a copy in a deeper backup folder is the duplicate
+        for hive_file in sorted(find_artifact_files(source, name=hive_name), key=lambda hive_file: (len(Path(hive_file).parts), hive_file)):
+            if os.path.getsize(hive_file) == 0:
+                continue
+            hive_files = [hive_file] + find_hive_logs(source, hive_file)
+            try:
+                hive_hash = hash_files(hive_files)
+            except OSError as e:
+                print(f"Failed to hash {hive_file}: {e}")
+                continue
+            if hive_hash in hives:
+                hives[hive_hash]["duplicates"].append(hive_file)
+            else:
+                hives[hive_hash] = {"sha1": hive_hash, "hive": hive_file, "files": hive_files, "duplicates": []}
+    return list(hives.values())
+
+def get_registry_hives(source):
+    source = str(Path(source).resolve())
+    with registry_hive_lock:
+        source_lock = registry_hive_locks.setdefault(source, threading.Lock())
+    with source_lock:
+        if source not in registry_hive_cache:
+            registry_hive_cache[source] = find_registry_hives(source)
+        return registry_hive_cache[source]
+
+def release_target_caches(source, dest=None):
+    # the artifact index, registry hives, evtx time ranges and evtx cache entry of a target are only kept while its jobs run,
+    # the evtx cache is keyed by its folder in the result root (dest)
+    source = str(Path(source).resolve())
+    with artifact_index_lock:
+        artifact_index_cache.pop(source, None)
+        artifact_index_locks.pop(source, None)
+    with registry_hive_lock:
+        registry_hive_cache.pop(source, None)
+        registry_hive_locks.pop(source, None)
+    with evtx_time_range_lock:
+        for key in [key for key in evtx_time_range_cache if key[0].startswith(source + os.sep)]:
+            del evtx_time_range_cache[key]
+    if dest != None:
+        with evtx_cache_lock:
+            evtx_cache_locks.pop(str(Path(dest).joinpath(EVTX_CACHE_DIR).resolve()), None)
+
+def write_hive_list(hive_result_dir, hives):
+    os.makedirs(hive_result_dir, exist_ok=True)
+    with open(Path(hive_result_dir).joinpath("hives.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["SHA1", "HivePath", "Duplicates"])
+        for hive in hives:
+            writer.writerow([hive["sha1"], hive["hive"], "|".join(hive["duplicates"])])
+
+def run_RECmd_batch(source, dest, log_prefix, batch_file):
+    hives = get_registry_hives(source)
+    if not hives:
+        return
+    batch_name = Path(batch_file).stem
+    hive_result_dir = Path(dest).joinpath("hives", batch_name)
+    write_hive_list(hive_result_dir, hives)
+    print("{0}: {1} runs {2} distinct hives ({3} duplicates skipped)".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_prefix, len(hives), sum(len(hive["duplicates"]) for hive in hives)))
+
+    def run_hive(hive_number):
+        hive = hives[hive_number]
+        hive_dir = hive_result_dir.joinpath(f"{hive_number}_{Path(hive['hive']).name}")
+        os.makedirs(hive_dir, exist_ok=True)
+        log_file = hive_dir.joinpath(f"output_{log_prefix}.txt")
+        command_line = f"-f \"{hive['hive']}\" --bn \"{batch_file}\" --nl false --csv \"{hive_dir}\""
+        result = execute_process(RECmd_bin, command_line, log_file, inputs=hive["files"])
+        return hive_dir, result, log_file
+
+    with ThreadPoolExecutor(max_workers=max(1, min(get_job_workers(windows_config.RegistryHiveWorkers), len(hives)))) as executor:
+        hive_results = list(executor.map(run_hive, range(len(hives))))
+    failed_hives = [str(hive_dir) for hive_dir, _, log_file in hive_results if not log_file.exists()]
+    if failed_hives:
+        print("{0}: {1} failed on {2}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_prefix, ", ".join(failed_hives)))
+
+    output_file = Path(dest).joinpath(f"RECmd_Batch_{batch_name}_Output.csv")
+    if any(result != None for _, result, _ in hive_results) or not windows_convert.output_exists(output_file):
+        csv_files = []
+        for hive_dir, _, log_file in hive_results:
+            hive_csv_files = sorted(hive_dir.glob(f"*_RECmd_Batch_{batch_name}_Output.csv"))
+            if log_file.exists() and hive_csv_files:
+                csv_files.append(hive_csv_files[-1])
+        merge_csv_files(csv_files, output_file, None)
+    return
+
+RECmd_batch_files = {"module_RECmd": "DFIRBatch.reb", "module_RECmd_ASEP": "RegistryASEPs.reb"}
+
+def get_RECmd_batch_file(module_name):
+    return Path(eztool_dir).joinpath("RECmd", "BatchExamples", RECmd_batch_files[module_name])
+
 def module_RECmd_ASEP(source, dest, log_prefix):
-    log_reg_asep_file = Path(dest).joinpath(f"output_{log_prefix}_reg_asep.txt")
-    regsitry_asep_script = Path(eztool_dir).joinpath("RECmd", "BatchExamples", "RegistryASEPs.reb")
-    command_line_RegistryASEP = f"-d \"{source}\" --bn \"{regsitry_asep_script}\" --nl false --csv \"{dest}\""
-    execute_process(RECmd_bin, command_line_RegistryASEP, log_reg_asep_file)
+    run_RECmd_batch(source, dest, log_prefix, get_RECmd_batch_file("module_RECmd_ASEP"))
     return
 
 def module_RECmd(source, dest, log_prefix):
-    log_dfir_batch_file = Path(dest).joinpath(f"output_{log_prefix}_dfir_batch.txt")
-    dfir_batch_script = Path(eztool_dir).joinpath("RECmd", "BatchExamples", "DFIRBatch.reb")
-    command_line_dfir_batch = f"-d \"{source}\" --bn \"{dfir_batch_script}\" --nl false --csv \"{dest}\""
-    execute_process(RECmd_bin, command_line_dfir_batch, log_dfir_batch_file)
-    
+    run_RECmd_batch(source, dest, log_prefix, get_RECmd_batch_file("module_RECmd"))
     return
 
-def module_hayabusa_logon(source, dest, log_prefix):
-    evtx_dir = None
-    for sample_evtx in Path(source).rglob("*.evtx"):
-        evtx_dir = sample_evtx.parent.resolve()
-        break
+def collect_evtx_files(source):
+    return filter_evtx_files([evtx_file for evtx_file in find_artifact_files(source, ext=".evtx") if os.path.getsize(evtx_file) > 0])
+
+def create_evtx_shards(evtx_files, shard_count):
+    total_size = sum(os.path.getsize(evtx_file) for evtx_file in evtx_files)
+    if total_size < windows_config.EvtxShardMinBytes:
+        shard_count = 1
+    shard_count = max(1, min(shard_count, len(evtx_files)))
+    shards = [[0, n, []] for n in range(shard_count)]
+    for evtx_file in sorted(evtx_files, key=os.path.getsize, reverse=True):
+        shard = heapq.heappop(shards)
+        shard[0] += os.path.getsize(evtx_file)
+        shard[2].append(evtx_file)
+        heapq.heappush(shards, shard)
+    return [shard[2] for shard in sorted(shards, key=lambda shard: shard[1]) if shard[2]]
+
+def link_file(source_file, dest_file):
+    try:
+        os.link(source_file, dest_file)
+    except OSError:
+        os.symlink(source_file, dest_file)
+
+def get_evtx_stage_dir(result_dir, stage_name):
+    # outside the target tree, the same folder for the same result folder so the command lines in the manifests stay the same
+    stage_root = Path(windows_config.EvtxStageDir) if windows_config.EvtxStageDir else Path(tempfile.gettempdir()).joinpath("dfir_evtx")
+    result_hash = hashlib.sha1(str(Path(result_dir).resolve()).encode("utf-8")).hexdigest()[:12]
+    return stage_root.joinpath(result_hash, stage_name)
+
+def remove_evtx_stage_dir(stage_dir):
+    shutil.rmtree(stage_dir, ignore_errors=True)
+    try:
+        os.rmdir(Path(stage_dir).parent)
+    except OSError:
+        pass
+
+def stage_evtx_files(evtx_files, stage_dir, path_map=None):
+    if os.path.exists(stage_dir):
+        shutil.rmtree(stage_dir)
+    parent_dirs = {}
+    for evtx_file in evtx_files:
+        parent_dir = os.path.dirname(evtx_file)
+        if parent_dir not in parent_dirs:
+            parent_dirs[parent_dir] = Path(stage_dir).joinpath(str(len(parent_dirs)))
+            os.makedirs(parent_dirs[parent_dir])
+        staged_file = parent_dirs[parent_dir].joinpath(os.path.basename(evtx_file))
+        link_file(evtx_file, staged_file)
+        if path_map != None:
+            path_map[str(staged_file)] = evtx_file
+    return Path(stage_dir)
+
+def run_evtx_shards(source, result_dir, log_prefix, tool_bin, working_dir, build_command):
+    evtx_files = collect_evtx_files(source)
+    if not evtx_files:
+        return None
+
+    shards = create_evtx_shards(evtx_files, windows_config.EvtxShardCount)
+    path_map = {}
+    print("{0}: {1} split {2} evtx files into {3} shards".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_prefix, len(evtx_files), len(shards)))
+
+    def run_shard(shard_number):
+        shard_dir = Path(result_dir).joinpath("shards", f"shard_{shard_number}")
+        os.makedirs(shard_dir, exist_ok=True)
+        evtx_dir = stage_evtx_files(shards[shard_number], get_evtx_stage_dir(result_dir, f"{log_prefix}_shard_{shard_number}"), path_map)
+        log_file = shard_dir.joinpath(f"output_{log_prefix}.txt")
+        result = execute_process(tool_bin, build_command(evtx_dir, shard_dir), log_file, working_dir, inputs=shards[shard_number])
+        remove_evtx_stage_dir(evtx_dir)
+        return shard_dir, result, log_file
+
+    # the shards stay the same between runs (their manifests), only as many run at once as the job was granted
+    with ThreadPoolExecutor(max_workers=max(1, min(get_job_workers(windows_config.EvtxShardCount), len(shards)))) as executor:
+        shard_results = list(executor.map(run_shard, range(len(shards))))
+    if not all(log_file.exists() for _, _, log_file in shard_results):
+        print("{0}: {1} has failed shards, results are not merged".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_prefix))
+        return None
+    return [shard_dir for shard_dir, _, _ in shard_results], any(result != None for _, result, _ in shard_results), path_map
+
+def read_csv_rows(csv_file, path_columns=None, path_map=None):
+    with open(csv_file, "r", newline="", encoding="utf-8", errors="replace") as f:
+        for row in csv.DictReader(f):
+            if path_map:
+                for column in path_columns:
+                    if row.get(column) in path_map:
+                        row[column] = path_map[row[column]]
+            yield row
+
+def merge_csv_files(csv_files, output_file, timestamp_column, path_columns=None, path_map=None):
+    csv_files = [csv_file for csv_file in csv_files if Path(csv_file).exists()]
+    if not csv_files:
+        return
+    if path_columns == None:
+        path_map = None
+    if len(csv_files) == 1 and not path_map:
+        # copied, a hard link would let the conversion of the output rewrite the shard csv as well
+        if Path(output_file).exists():
+            os.remove(output_file)
+        shutil.copyfile(csv_files[0], output_file)
+        return
+    header = []
+    for csv_file in csv_files:
+        with open(csv_file, "r", newline="", encoding="utf-8", errors="replace") as f:
+            for column in next(csv.reader(f), []):
+                if column not in header:
+                    header.append(column)
+    with open(output_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=header)
+        writer.writeheader()
+        csv_rows = [read_csv_rows(csv_file, path_columns, path_map) for csv_file in csv_files]
+        for row in heapq.merge(*csv_rows, key=lambda row: row.get(timestamp_column) or "") if timestamp_column != None else itertools.chain(*csv_rows):
+            writer.writerow(row)
+
+EVTX_CACHE_DIR = "evtx_cache"
+evtx_cache_locks = {}
+evtx_cache_lock = threading.Lock()
+
+def get_event_channel_and_id(event):
+    system = event.get("Event", {}).get("System", {})
+    event_id = system.get("EventID", "")
+    if isinstance(event_id, dict):
+        event_id = event_id.get("#text", "")
+    return str(system.get("Channel", "unknown")).replace("/", "%4"), str(event_id)
+
+def get_split_list_file(cache_dir, cache_key):
+    return Path(f"{cache_dir}_logs").joinpath(f"split_{cache_key}.json")
+
+def split_evtx_jsonl(jsonl_file, cache_dir, cache_key):
+    # the files written for this evtx are listed next to its log, a rerun removes exactly those
+    split_files = {}
+    try:
+        with open(jsonl_file, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    channel, event_id = get_event_channel_and_id(json.loads(line))
+                except ValueError:
+                    continue
+                if (channel, event_id) not in split_files:
+                    split_dir = Path(cache_dir).joinpath(channel, event_id)
+                    os.makedirs(split_dir, exist_ok=True)
+                    split_files[(channel, event_id)] = open(split_dir.joinpath(f"{cache_key}.json"), "w", encoding="utf-8")
+                split_files[(channel, event_id)].write(line if line.endswith("\n") else line + "\n")
+    finally:
+        for split_file in split_files.values():
+            split_file.close()
+        with open(get_split_list_file(cache_dir, cache_key), "w") as f:
+            json.dump([str(Path(channel, event_id, f"{cache_key}.json")) for channel, event_id in split_files], f)
+
+def remove_cached_events(cache_dir, cache_key):
+    split_list_file = get_split_list_file(cache_dir, cache_key)
+    try:
+        with open(split_list_file, "r") as f:
+            cached_files = [Path(cache_dir).joinpath(cached_file) for cached_file in json.load(f)]
+    except (OSError, ValueError):
+        # cache written before the split files were listed
+        cached_files = [event_dir.joinpath(f"{cache_key}.json") for channel_dir in Path(cache_dir).glob("*") for event_dir in channel_dir.glob("*")]
+    for cached_file in cached_files:
+        if cached_file.exists():
+            os.remove(cached_file)
+    if split_list_file.exists():
+        os.remove(split_list_file)
+
+def decode_evtx_file(evtx_file, cache_dir):
+    cache_key = "{0}_{1}".format(Path(evtx_file).stem.replace("%4", "_"), hashlib.sha1(str(evtx_file).encode()).hexdigest()[:12])
+    log_dir = Path(f"{cache_dir}_logs")
+    jsonl_file = log_dir.joinpath(f"{cache_key}.jsonl")
+    log_file = log_dir.joinpath(f"output_evtx_dump_{cache_key}.txt")
+    command_line = f"--no-confirm-overwrite -t 1 -o jsonl -f \"{jsonl_file}\" \"{evtx_file}\""
+    result = execute_process(zircolite_evtx_bin, command_line, log_file, inputs=[evtx_file], progress_callback=None)
+    if result != None and result.get("status") == 0:
+        remove_cached_events(cache_dir, cache_key)
+        split_evtx_jsonl(jsonl_file, cache_dir, cache_key)
+    if jsonl_file.exists():
+        os.remove(jsonl_file)
+    return cache_key
+
+def build_evtx_cache(source, cache_dir):
+    evtx_files = collect_evtx_files(source)
+    os.makedirs(f"{cache_dir}_logs", exist_ok=True)
+    print("{0}: Decoding {1} evtx files into {2}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(evtx_files), cache_dir))
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=windows_config.EvtxDecodeWorkers) as executor:
+        cache_keys = set(executor.map(decode_evtx_file, evtx_files, [cache_dir] * len(evtx_files)))
+    record_metric("discovery", "evtx_cache", get_target_name(cache_dir), wall_time=time.monotonic() - start_time, files=len(evtx_files), input_bytes=sum(os.path.getsize(evtx_file) for evtx_file in evtx_files))
+    for cached_file in Path(cache_dir).glob("*/*/*.json"):
+        if cached_file.stem not in cache_keys:
+            os.remove(cached_file)
+    for split_list_file in Path(f"{cache_dir}_logs").glob("split_*.json"):
+        if split_list_file.stem[len("split_"):] not in cache_keys:
+            os.remove(split_list_file)
+    return Path(cache_dir)
+
+def get_evtx_cache(source, dest_root):
+    if not windows_config.EvtxDecodeCache:
+        return None
+    cache_dir = str(Path(dest_root).joinpath(EVTX_CACHE_DIR).resolve())
+    with evtx_cache_lock:
+        if cache_dir not in evtx_cache_locks:
+            evtx_cache_locks[cache_dir] = [threading.Lock(), None]
+        cache_entry = evtx_cache_locks[cache_dir]
+    with cache_entry[0]:
+        if cache_entry[1] == None:
+            cache_entry[1] = build_evtx_cache(source, cache_dir)
+        return cache_entry[1]
+
+def find_cached_events(cache_dir, channel, event_id=None):
+    channel_dir = Path(cache_dir).joinpath(channel.replace("/", "%4"))
+    if event_id == None:
+        return sorted(channel_dir.glob("*/*.json"))
+    return sorted(channel_dir.joinpath(str(event_id)).glob("*.json"))
+
+def iter_cached_events(cached_files):
+    for cached_file in cached_files:
+        if os.path.getsize(cached_file) == 0:
+            continue
+        with open(cached_file, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for line in iter(mm.readline, b""):
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
 
-    if evtx_dir == None or not evtx_dir.exists():
+def module_hayabusa_logon(source, dest, log_prefix):
+    evtx_files = collect_evtx_files(source)
+    if not evtx_files:
         return
     
     haya_result_dir = Path(dest).joinpath("hayabusa")
 
     os.makedirs(haya_result_dir, exist_ok=True)
 
+    evtx_dir = stage_evtx_files(evtx_files, get_evtx_stage_dir(haya_result_dir, f"{log_prefix}_logon"))
+
     haya_result_logon = haya_result_dir.joinpath("logon-summary.csv")
 
-    haya_logon_cmd = f'logon-summary -q --no-color -d "{evtx_dir}" -o "{haya_result_logon}"'
+    haya_logon_cmd = f'logon-summary -q --no-color -C -d "{evtx_dir}" -o "{haya_result_logon}"' + get_filter_args("hayabusa")
 
     log_logon_file = haya_result_dir.joinpath(f"output_{log_prefix}_logon.txt")
 
-    execute_process(hayabusa_bin, haya_logon_cmd, log_logon_file, hayabusa_dir)
+    execute_process(hayabusa_bin, haya_logon_cmd, log_logon_file, hayabusa_dir, inputs=evtx_files)
+
+    remove_evtx_stage_dir(evtx_dir)
     
     return
 
 def module_hayabusa_timeline(source, dest, log_prefix):
-    evtx_dir = None
-    for sample_evtx in Path(source).rglob("*.evtx"):
-        evtx_dir = sample_evtx.parent.resolve()
-        break
-
-    if evtx_dir == None or not evtx_dir.exists():
-        return
-    
     haya_result_dir = Path(dest).joinpath("hayabusa")
 
     os.makedirs(haya_result_dir, exist_ok=True)
 
     haya_result_timeline = haya_result_dir.joinpath("timeline")
 
-    haya_timeline_cmd = f'csv-timeline -q --no-color -w -T -H "{haya_result_timeline}_overview.html" -d "{evtx_dir}" -o "{haya_result_timeline}.csv"'
+    def build_command(evtx_dir, shard_dir):
+        shard_timeline = shard_dir.joinpath("timeline")
+        return f'csv-timeline -q --no-color -w -T -C -H "{shard_timeline}_overview.html" -d "{evtx_dir}" -o "{shard_timeline}.csv"' + get_filter_args("hayabusa_timeline")
 
-    log_timeline_file = haya_result_dir.joinpath(f"output_{log_prefix}_timeline.txt")
-    
-    execute_process(hayabusa_bin, haya_timeline_cmd, log_timeline_file, hayabusa_dir)
+    shard_result = run_evtx_shards(source, haya_result_dir, f"{log_prefix}_timeline", hayabusa_bin, hayabusa_dir, build_command)
+    if shard_result == None:
+        return
+    shard_dirs, updated, path_map = shard_result
+    if updated or not windows_convert.output_exists(f"{haya_result_timeline}.csv"):
+        merge_csv_files([shard_dir.joinpath("timeline.csv") for shard_dir in shard_dirs], f"{haya_result_timeline}.csv", "Timestamp", ["EvtxFile"], path_map)
+        for shard_number, shard_dir in enumerate(shard_dirs):
+            if shard_dir.joinpath("timeline_overview.html").exists():
+                overview_name = "timeline_overview.html" if len(shard_dirs) == 1 else f"timeline_overview_shard_{shard_number}.html"
+                shutil.copyfile(shard_dir.joinpath("timeline_overview.html"), haya_result_dir.joinpath(overview_name))
 
     return
 
 def module_chainsaw(source, dest, log_prefix):
-    evtx_dir = None
-    for sample_evtx in Path(source).rglob("*.evtx"):
-        evtx_dir = sample_evtx.parent.resolve()
-        break
-
-    if evtx_dir == None or not evtx_dir.exists():
-        return
-    
     chainsaw_result_dir = Path(dest).joinpath("chainsaw")
 
     chainsaw_rule_dir = Path(chainsaw_dir).joinpath("rules")
@@ -296,75 +1515,592 @@ def module_chainsaw(source, dest, log_prefix):
 
     os.makedirs(chainsaw_result_dir, exist_ok=True)
 
-    chainsaw_command_line = f"hunt {evtx_dir} --rule \"{chainsaw_rule_dir}\" --sigma \"{chainsaw_sigma_dir}\" --mapping \"{chainsaw_mappings_file}\" --csv --output {chainsaw_result_dir} --full --skip-errors"
+    def build_command(evtx_dir, shard_dir):
+        return f"hunt \"{evtx_dir}\" --rule \"{chainsaw_rule_dir}\" --sigma \"{chainsaw_sigma_dir}\" --mapping \"{chainsaw_mappings_file}\" --csv --output \"{shard_dir.joinpath('hunt')}\" --full --skip-errors" + get_filter_args("chainsaw")
 
-    log_chainsaw_file = chainsaw_result_dir.joinpath(f"output_{log_prefix}.txt")
-
-    execute_process(chainsaw_bin, chainsaw_command_line, log_chainsaw_file, chainsaw_dir)
+    shard_result = run_evtx_shards(source, chainsaw_result_dir, log_prefix, chainsaw_bin, chainsaw_dir, build_command)
+    if shard_result == None:
+        return
+    shard_dirs, updated, path_map = shard_result
+    csv_names = set()
+    for shard_dir in shard_dirs:
+        csv_names.update(csv_file.name for csv_file in shard_dir.joinpath("hunt").glob("*.csv"))
+    for csv_name in sorted(csv_names):
+        if updated or not windows_convert.output_exists(chainsaw_result_dir.joinpath(csv_name)):
+            merge_csv_files([shard_dir.joinpath("hunt", csv_name) for shard_dir in shard_dirs], chainsaw_result_dir.joinpath(csv_name), "timestamp", ["path"], path_map)
 
     return
 
+def merge_zircolite_json(json_files, output_file):
+    json_files = [json_file for json_file in json_files if Path(json_file).exists()]
+    if not json_files:
+        return
+    detections = {}
+    for json_file in json_files:
+        if not Path(json_file).exists():
+            continue
+        with open(json_file, "r", encoding="utf-8") as f:
+            for detection in json.load(f):
+                key = detection.get("id") or detection.get("title")
+                if key not in detections:
+                    detections[key] = dict(detection, matches=[], count=0)
+                detections[key]["matches"] += detection.get("matches", [])
+                detections[key]["count"] += detection.get("count", len(detection.get("matches", [])))
+    for detection in detections.values():
+        detection["matches"].sort(key=lambda match: str(match.get("SystemTime", "")))
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(list(detections.values()), f, indent=2)
+
+def merge_zircolite_db(db_files, output_file):
+    db_files = [db_file for db_file in db_files if Path(db_file).exists()]
+    if not db_files:
+        return
+    if Path(output_file).exists():
+        os.remove(output_file)
+    shutil.copyfile(db_files[0], output_file)
+    connection = sqlite3.connect(output_file)
+    try:
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(logs)")]
+        for db_file in db_files[1:]:
+            connection.execute("ATTACH DATABASE ? AS shard", (str(db_file),))
+            shard_columns = [row[1] for row in connection.execute("PRAGMA shard.table_info(logs)") if row[1] != "row_id"]
+            for column in shard_columns:
+                if column not in columns:
+                    connection.execute(f'ALTER TABLE logs ADD COLUMN "{column}" TEXT COLLATE NOCASE')
+                    columns.append(column)
+            column_list = ", ".join(f'"{column}"' for column in shard_columns)
+            connection.execute(f"INSERT INTO logs ({column_list}) SELECT {column_list} FROM shard.logs")
+            connection.commit()
+            connection.execute("DETACH DATABASE shard")
+    finally:
+        connection.close()
+
 def module_zircolite(source, dest, log_prefix):
     zircolite_config_file = Path(zircolite_dir).joinpath("config", "fieldMappings.json")
 
     zircolite_rule_windows_1 = Path(zircolite_dir).joinpath("rules", "rules_windows_generic_pysigma.json")
 
-    os.makedirs(Path(dest).joinpath("zircolite"), exist_ok=True)
+    zircolite_result_dir = Path(dest).joinpath("zircolite")
 
-    zircolite_result_db_file = Path(dest).joinpath("zircolite", "Zircolite_detections.db")
+    os.makedirs(zircolite_result_dir, exist_ok=True)
 
-    zircolite_result_json_file = Path(dest).joinpath("zircolite", "Zircolite_detections.json")
+    zircolite_result_db_file = zircolite_result_dir.joinpath("Zircolite_detections.db")
 
-    evtx_dir = None
-    for sample_evtx in Path(source).rglob("*.evtx"):
-        evtx_dir = sample_evtx.parent.resolve()
-        break
+    zircolite_result_json_file = zircolite_result_dir.joinpath("Zircolite_detections.json")
+
+    evtx_cache_dir = get_evtx_cache(source, Path(dest).parent)
+    if evtx_cache_dir != None:
+        cached_files = sorted(evtx_cache_dir.glob("*/*/*.json"))
+        if not cached_files:
+            return
+        zircolite_command_line = f"--events \"{evtx_cache_dir}\" --jsononly --ruleset \"{zircolite_rule_windows_1}\" --outfile \"{zircolite_result_json_file}\" --dbfile \"{zircolite_result_db_file}\" --config \"{zircolite_config_file}\"" + get_filter_args("zircolite")
+        log_zircolite_file = zircolite_result_dir.joinpath(f"output_{log_prefix}.txt")
+        execute_process(zircolite_bin, zircolite_command_line, log_zircolite_file, tempfile.gettempdir(), inputs=cached_files)
+        return
+
+    def build_command(evtx_dir, shard_dir):
+        return f"--events \"{evtx_dir}\" --ruleset \"{zircolite_rule_windows_1}\" --outfile \"{shard_dir.joinpath(zircolite_result_json_file.name)}\" --dbfile \"{shard_dir.joinpath(zircolite_result_db_file.name)}\" --config \"{zircolite_config_file}\" --evtx_dump \"{zircolite_evtx_bin}\"" + get_filter_args("zircolite")
 
-    if evtx_dir == None or not evtx_dir.exists():
+    shard_result = run_evtx_shards(source, zircolite_result_dir, log_prefix, zircolite_bin, tempfile.gettempdir(), build_command)
+    if shard_result == None:
         return
-    zircolite_command_line = f"--events {evtx_dir} --ruleset \"{zircolite_rule_windows_1}\" --outfile \"{zircolite_result_json_file}\" --dbfile \"{zircolite_result_db_file}\" --config \"{zircolite_config_file}\" --evtx_dump \"{zircolite_evtx_bin}\""
+    shard_dirs, updated, _ = shard_result
+    if updated or not windows_convert.output_exists(zircolite_result_json_file):
+        merge_zircolite_json([shard_dir.joinpath(zircolite_result_json_file.name) for shard_dir in shard_dirs], zircolite_result_json_file)
+        merge_zircolite_db([shard_dir.joinpath(zircolite_result_db_file.name) for shard_dir in shard_dirs], zircolite_result_db_file)
+
+    return
+
+module_tool = {
+    "module_hayabusa_logon": "hayabusa",
+    "module_hayabusa_timeline": "hayabusa",
+    "module_chainsaw": "chainsaw",
+    "module_zircolite": "zircolite",
+    "module_script_block_powershell": "python",
+    "module_prefetchruncounts": "python",
+}
+
+# modules running several processes at once: the config setting with their count, each one takes a job slot
+# and counts against ToolConcurrency of the module's tool
+module_workers = {
+    "module_hayabusa_timeline": "EvtxShardCount",
+    "module_chainsaw": "EvtxShardCount",
+    "module_zircolite": "EvtxShardCount",
+    "module_RECmd": "RegistryHiveWorkers",
+    "module_RECmd_ASEP": "RegistryHiveWorkers",
+    "module_MFTECmd": "NtfsWorkers",
+    "module_script_block_powershell": "ScriptBlockWorkers",
+}
+job_context = threading.local()
+
+def get_module_workers(module_name):
+    return max(1, getattr(windows_config, module_workers[module_name])) if module_name in module_workers else 1
+
+def get_job_workers(default):
+    # processes the job running in this thread may start, the configured count outside the scheduler
+    return max(1, min(default, getattr(job_context, "workers", default)))
+
+def get_available_memory_mb():
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+def get_cpu_load():
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):
+        return None
+
+class JobScheduler:
+    def __init__(self, max_jobs=None, tool_limits=None, cpu_load_limit=None, memory_reserve_mb=None):
+        self.max_jobs = max_jobs if max_jobs else windows_config.MaxJobs
+        self.tool_limits = tool_limits if tool_limits != None else windows_config.ToolConcurrency
+        self.cpu_load_limit = cpu_load_limit if cpu_load_limit != None else windows_config.CpuLoadLimit
+        self.memory_reserve_mb = memory_reserve_mb if memory_reserve_mb != None else windows_config.MemoryReserveMB
+        self.condition = threading.Condition()
+        self.pending = []
+        self.running = 0
+        self.tool_running = {}
+        self.total = 0
+        self.finished = 0
+        self.closed = False
+        self.group_finished = {}
+        self.group_running = {}
+        self.target_finished = {}
+        self.target_conversions = {}
+        self.converter = None
+        self.conversions = []
+
+    def submit(self, job):
+        with self.condition:
+            self.pending.append(job)
+            self.total += 1
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def tool_available(self, job):
+        limit = self.tool_limits.get(job["tool"])
+        return limit == None or self.tool_running.get(job["tool"], 0) < limit
+
+    def resources_available(self):
+        if self.running == 0:
+            return True
+        if self.cpu_load_limit:
+            cpu_load = get_cpu_load()
+            if cpu_load != None and cpu_load > self.cpu_load_limit:
+                return False
+        if self.memory_reserve_mb:
+            available_memory = get_available_memory_mb()
+            if available_memory != None and available_memory < self.memory_reserve_mb:
+                return False
+        return True
+
+    def grant_workers(self, job):
+        # inner workers of the job, as many as free slots of the scheduler and of its tool allow
+        available = self.max_jobs - self.running
+        limit = self.tool_limits.get(job["tool"])
+        if limit != None:
+            available = min(available, limit - self.tool_running.get(job["tool"], 0))
+        return max(1, min(job.get("workers", 1), available))
+
+    def get_job_groups(self, job):
+        return [member["group"] for member in job.get("members", [job]) if member.get("group") != None]
+
+    def next_job(self):
+        # jobs writing into a folder no other job writes into go first, tools sharing a folder run one at a time
+        if self.running >= self.max_jobs:
+            return None, False
+        next_job = None
+        for job in self.pending:
+            if self.tool_available(job):
+                if not any(group in self.group_running for group in self.get_job_groups(job)):
+                    next_job = job
+                    break
+                next_job = next_job or job
+        if next_job == None:
+            return None, False
+        if not self.resources_available():
+            return None, True
+        self.pending.remove(next_job)
+        return next_job, False
+
+    def run_job(self, job, workers=1):
+        job_context.workers = workers
+        try:
+            job["function"](*job["args"])
+        except Exception as e:
+            print("{0}: {1} on {2} failed: {3}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job["name"], job["target"], e))
+        finally:
+            try:
+                self.finish_members(job.get("members", [job]))
+            finally:
+                with self.condition:
+                    self.running -= workers
+                    self.tool_running[job["tool"]] -= workers
+                    for group in self.get_job_groups(job):
+                        self.group_running[group] -= 1
+                        if self.group_running[group] == 0:
+                            del self.group_running[group]
+                    self.finished += 1
+                    print("{0}: {1} on {2} finished ({3}/{4}).".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job["name"], job["target"], self.finished, self.total))
+                    self.condition.notify_all()
+
+    def finish_members(self, members):
+        # a batched job stands for one job of each of its targets
+        cleanups = []
+        with self.condition:
+            for member in members:
+                if member.get("group") != None:
+                    self.group_finished[member["group"]] = self.group_finished.get(member["group"], 0) + 1
+                    if self.group_finished[member["group"]] == member["group_size"]:
+                        conversion = self.convert_group(member["group"], member["target"], [[member["args"][0], member["staged_from"]]] if member.get("staged_from") != None else None)
+                        if conversion != None and member.get("cleanup") != None:
+                            self.target_conversions.setdefault(member["args"][0], []).append(conversion)
+                if member.get("target_size") != None:
+                    source = member["args"][0]
+                    self.target_finished[source] = self.target_finished.get(source, 0) + 1
+                    if self.target_finished[source] == member["target_size"]:
+                        del self.target_finished[source]
+                        cleanups.append([source, member["args"][3], member.get("cleanup"), self.target_conversions.pop(source, [])])
+        # last job of a target, its cached index and hives are dropped and an extracted archive or staged target
+        # is handed back before the job counts as finished
+        for source, dest, cleanup, conversions in cleanups:
+            release_target_caches(source, dest)
+            if cleanup == None:
+                continue
+            try:
+                cleanup(conversions)
+            except Exception as e:
+                print("{0}: Cleanup after the last job failed: {1}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), e))
+
+    def convert_group(self, group, target, path_prefixes=None):
+        # every job writing into this (target, category) folder is done, convert its outputs while other jobs keep running.
+        # Outputs of a staged target get the paths of the share back first
+        if windows_convert.get_output_format() == None and path_prefixes == None:
+            return
+        if self.converter == None:
+            # spawned, a worker forked while a job thread starts its tool would keep the exec pipe of Popen open
+            self.converter = ProcessPoolExecutor(max_workers=windows_config.ConvertWorkers, mp_context=multiprocessing.get_context("spawn"))
+        start_time = time.monotonic()
+        future = self.converter.submit(windows_convert.convert_result_dir, group, None, path_prefixes)
+        future.add_done_callback(lambda future: self.converted_group(future, group, target, start_time))
+        self.conversions.append(future)
+        return future
+
+    def converted_group(self, future, group, target, start_time):
+        try:
+            converted = future.result()
+        except Exception as e:
+            print("{0}: Converting {1} failed: {2}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), group, e))
+            return
+        if not converted:
+            return
+        windows_convert.print_converted(converted)
+        record_metric("post", "convert", target, wall_time=time.monotonic() - start_time, files=len(converted), input_bytes=sum(input_size for _, input_size, _ in converted), output_bytes=sum(output_size for _, _, output_size in converted))
+
+    def run(self):
+        with self.condition:
+            while True:
+                if self.closed and not self.pending and self.running == 0:
+                    break
+                job, resource_wait = self.next_job()
+                if job == None:
+                    self.condition.wait(windows_config.ResourceRecheckSeconds if resource_wait else None)
+                    continue
+                workers = self.grant_workers(job)
+                self.running += workers
+                self.tool_running[job["tool"]] = self.tool_running.get(job["tool"], 0) + workers
+                for group in self.get_job_groups(job):
+                    self.group_running[group] = self.group_running.get(group, 0) + 1
+                job_thread = threading.Thread(target=self.run_job, args=(job, workers), name=job["name"], daemon=True)
+                job_thread.start()
+        if self.converter != None:
+            self.converter.shutdown(wait=True)
+        return
+
+def get_thread_cpu_time():
+    if resource != None and hasattr(resource, "RUSAGE_THREAD"):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    return None
+
+def run_module(source, module_function, module_result_dir, dest):
+    get_artifact_index(source, dest)
+    os.makedirs(module_result_dir, exist_ok=True)
+    start_time = time.monotonic()
+    start_cpu_time = get_thread_cpu_time()
+    status = 0
+    try:
+        module_function(source, module_result_dir, module_function.__name__)
+    except Exception:
+        status = None
+        raise
+    finally:
+        cpu_time = get_thread_cpu_time() - start_cpu_time if start_cpu_time != None else None
+        record_metric("module", module_function.__name__, Path(source).name, status=status, wall_time=time.monotonic() - start_time, cpu_time=cpu_time, input_bytes=sum(os.path.getsize(input_file) for input_file in get_module_inputs(source, module_function.__name__)))
+    return
+
+def get_batch_inputs(source, module_name):
+    # [original file, path below the target's staging folder] of what the module reads in this target
+    if module_name in RECmd_batch_files:
+        return [[hive_file, os.path.join(str(hive_number), os.path.basename(hive_file))] for hive_number, hive in enumerate(get_registry_hives(source)) for hive_file in hive["files"]]
+    return [[input_file, os.path.relpath(input_file, source)] for input_file in get_module_inputs(source, module_name)]
+
+def get_batch_command(source, dest, module_name):
+    if module_name in RECmd_batch_files:
+        return f"-d \"{source}\" --bn \"{get_RECmd_batch_file(module_name)}\" --nl false --csv \"{dest}\""
+    return get_directory_command(source, dest, directory_tools[module_name][1])
+
+def split_batch_csv(csv_file, output_name, column, stage_dir, path_map, members):
+    # rows go to the member whose staging folder holds the parsed file, with the staged path put back to the original.
+    # Returns the files written and whether every row found its target
+    stage_prefix = os.path.join(str(stage_dir), "")
+    files = {}
+    writers = {}
+    unmatched = 0
+    try:
+        with open(csv_file, "r", newline="", encoding="utf-8-sig", errors="replace") as f:
+            reader = csv.DictReader(f)
+            if column not in (reader.fieldnames or []):
+                print("{0}: {1} has no {2} column, it can not be split".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), Path(csv_file).name, column))
+                return [], False
+            for row in reader:
+                staged_path = row.get(column) or ""
+                if staged_path in path_map:
+                    member_number, row[column] = path_map[staged_path]
+                elif staged_path.startswith(stage_prefix) and staged_path[len(stage_prefix):].split(os.sep, 1)[0].isdigit():
+                    member_number, _, relative_path = staged_path[len(stage_prefix):].partition(os.sep)
+                    member_number = int(member_number)
+                    row[column] = os.path.join(members[member_number]["source"], relative_path)
+                else:
+                    unmatched += 1
+                    continue
+                if member_number not in writers:
+                    output_file = Path(members[member_number]["result_dir"]).joinpath(output_name)
+                    os.makedirs(output_file.parent, exist_ok=True)
+                    files[member_number] = open(output_file, "w", newline="", encoding="utf-8")
+                    writers[member_number] = csv.DictWriter(files[member_number], fieldnames=reader.fieldnames)
+                    writers[member_number].writeheader()
+                writers[member_number].writerow(row)
+    finally:
+        for output_f in files.values():
+            output_f.close()
+    output_files = [Path(members[member_number]["result_dir"]).joinpath(output_name) for member_number in files]
+    if unmatched:
+        print("{0}: {1} rows of {2} did not match a staged target".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), unmatched, Path(csv_file).name))
+    return output_files, unmatched == 0
+
+def run_module_batch(module_name, member_args, batch_dir):
+    # one tool run over the inputs of many targets staged under batch_dir/stage/<n>/, the dotnet startup and map loading
+    # are paid once instead of once per target. Each target still gets its own log and manifest for incremental runs
+    functions = list_module_parser()
+    tool_bin = RECmd_bin if module_name in RECmd_batch_files else directory_tools[module_name][0]
+    members = []
+    for source, module_function, module_result_dir, dest in member_args:
+        get_artifact_index(source, dest)
+        os.makedirs(module_result_dir, exist_ok=True)
+        inputs = get_batch_inputs(source, module_name)
+        if not inputs:
+            continue
+        log_file = Path(module_result_dir).joinpath(f"output_{module_name}.txt")
+        command = get_batch_command(source, module_result_dir, module_name)
+        if windows_config.IncrementalCache and is_up_to_date(tool_bin, command, log_file, [input_file for input_file, _ in inputs]):
+            print("{0}: {1} is up to date, reusing previous results".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), log_file))
+            continue
+        remove_previous_run(log_file)
+        members.append({"source": source, "result_dir": module_result_dir, "dest": dest, "inputs": inputs, "log_file": log_file, "command": command})
 
-    log_zircolite_file =  Path(dest).joinpath("zircolite", f"output_{log_prefix}.txt")
+    def run_per_target():
+        for member in members:
+            run_module(member["source"], functions[module_name], member["result_dir"], member["dest"])
 
-    execute_process(zircolite_bin, zircolite_command_line, log_zircolite_file, tempfile.gettempdir())
+    if len(members) <= 1:
+        run_per_target()
+        return
 
+    start_time = time.monotonic()
+    stage_dir = Path(batch_dir).joinpath("stage")
+    output_dir = Path(batch_dir).joinpath("output")
+    if Path(batch_dir).exists():
+        shutil.rmtree(batch_dir)
+    os.makedirs(output_dir)
+    path_map = {}
+    for member_number, member in enumerate(members):
+        for input_file, relative_path in member["inputs"]:
+            staged_file = stage_dir.joinpath(str(member_number), relative_path)
+            os.makedirs(staged_file.parent, exist_ok=True)
+            link_file(input_file, staged_file)
+            path_map[str(staged_file)] = [member_number, input_file]
+    print("{0}: {1} runs once for {2} targets ({3} files)".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), module_name, len(members), len(path_map)))
+
+    log_file = Path(batch_dir).joinpath(f"output_{module_name}.txt")
+    execute_process(tool_bin, get_batch_command(stage_dir, output_dir, module_name), log_file, inputs=[input_file for member in members for input_file, _ in member["inputs"]])
+    try:
+        if not log_file.exists():
+            print("{0}: {1} batch failed, running it per target".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), module_name))
+            run_per_target()
+            return
+        column = "HivePath" if module_name in RECmd_batch_files else directory_tools[module_name][2]
+        split_files = []
+        split_complete = True
+        for csv_file in sorted(output_dir.rglob("*.csv")):
+            output_name = str(csv_file.relative_to(output_dir))
+            if module_name in RECmd_batch_files:
+                output_name = "RECmd_Batch_{0}_Output.csv".format(Path(RECmd_batch_files[module_name]).stem)
+            output_files, complete = split_batch_csv(csv_file, output_name, column, stage_dir, path_map, members)
+            split_files += output_files
+            split_complete = split_complete and complete
+        if not split_complete:
+            # a target would miss rows but look up to date, its manifest is only written by a run of its own
+            print("{0}: {1} batch output could not be split, running it per target".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), module_name))
+            for split_file in split_files:
+                if split_file.exists():
+                    os.remove(split_file)
+            run_per_target()
+            return
+        for member in members:
+            if module_name in RECmd_batch_files:
+                write_hive_list(Path(member["result_dir"]).joinpath("hives", Path(RECmd_batch_files[module_name]).stem), get_registry_hives(member["source"]))
+            shutil.copyfile(log_file, member["log_file"])
+            if windows_config.IncrementalCache:
+                member_outputs = sorted(os.path.relpath(split_file, member["result_dir"]) for split_file in split_files if str(split_file).startswith(str(member["result_dir"]) + os.sep))
+                with open(member["log_file"].with_name(f"{member['log_file'].stem}_manifest.json"), "w") as f:
+                    json.dump(dict(create_manifest(tool_bin, member["command"], [input_file for input_file, _ in member["inputs"]]), outputs=member_outputs), f, indent=1)
+        record_metric("module", module_name, Path(batch_dir).name, status=0, wall_time=time.monotonic() - start_time, targets=len(members), input_bytes=sum(os.path.getsize(input_file) for member in members for input_file, _ in member["inputs"]))
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        try:
+            os.rmdir(Path(batch_dir).parent)
+        except OSError:
+            pass
     return
 
-def entry_processing(entry, module_function=None):
+def create_batch_job(module_name, jobs, batch_dir):
+    if len(jobs) == 1:
+        return jobs[0]
+    return {
+        "name": module_name,
+        "target": "{0} targets".format(len(jobs)),
+        "tool": jobs[0]["tool"],
+        "function": run_module_batch,
+        "args": (module_name, [job["args"] for job in jobs], batch_dir),
+        "members": jobs
+    }
+
+def batch_entry_jobs(job_batches, batch_root, batch_targets=None, held_targets=None):
+    # jobs of BatchModules are held back and yielded as one job per BatchTargets targets, the rest passes through.
+    # Targets with a cleanup (extracted or staged) hold a slot until their last job, the pending batches are flushed
+    # once held_targets of them wait in a batch, before discovery would wait for a slot they hold
+    batch_targets = batch_targets if batch_targets else windows_config.BatchTargets
+    pending = {}
+    batch_numbers = itertools.count()
+    for jobs in job_batches:
+        target_jobs = []
+        for job in jobs:
+            if job["name"] not in windows_config.BatchModules or job["name"] not in directory_tools and job["name"] not in RECmd_batch_files:
+                target_jobs.append(job)
+                continue
+            pending.setdefault(job["name"], []).append(job)
+            if len(pending[job["name"]]) >= batch_targets:
+                target_jobs.append(create_batch_job(job["name"], pending.pop(job["name"]), Path(batch_root).joinpath("{0}_{1}".format(job["name"], next(batch_numbers)))))
+        if held_targets and len(set(job["args"][0] for module_jobs in pending.values() for job in module_jobs if job.get("cleanup") != None)) >= held_targets:
+            for module_name in list(pending.keys()):
+                target_jobs.append(create_batch_job(module_name, pending.pop(module_name), Path(batch_root).joinpath("{0}_{1}".format(module_name, next(batch_numbers)))))
+        yield target_jobs
+    yield [create_batch_job(module_name, jobs, Path(batch_root).joinpath("{0}_{1}".format(module_name, next(batch_numbers)))) for module_name, jobs in pending.items()]
+
+def create_entry_jobs(entry, module_function=None):
     global processing_module
 
-    dest = Path(entry["full_path"]).joinpath(ROOT_RESULT_PATH)
+    # archive targets are parsed from a scratch copy, their results go next to the archive
+    dest = Path(entry["result_path"]) if entry.get("result_path") else Path(entry["full_path"]).joinpath(ROOT_RESULT_PATH)
 
     print("{0}: Destination directory set to {1}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), dest))
 
+    module_jobs = []
     if module_function == None:
-        module_threads = []
         for module in processing_module:
             module_result_dir = Path.joinpath(dest, module["name"])
-            os.makedirs(module_result_dir, exist_ok=True)
-            for module_function in module["module_list"]:
-                result_thread = threading.Thread(target=module_function, args=(entry["full_path"], module_result_dir, module_function.__name__))
-                result_thread.name = module_function.__name__
-                result_thread.start()
-                module_threads.append(result_thread)
-        total_module = len(module_threads)                
-        finished_module = 0
-        while module_threads:
-            time.sleep(5)
-            temp_active_threads = []
-            for thread in module_threads:
-                if thread.is_alive():
-                    temp_active_threads.append(thread)
-                else:
-                    finished_module+=1
-                    print("{0}: {1} finished ({2}/{3}).".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), thread.name, finished_module, total_module))
-            module_threads = temp_active_threads
+            for entry_module_function in module["module_list"]:
+                module_jobs.append([entry_module_function, module_result_dir])
     else:
-        module_result_dir = Path.joinpath(dest, module_function.__name__)
-        module_function(entry["full_path"], module_result_dir, module_function.__name__)
+        module_jobs.append([module_function, Path.joinpath(dest, module_function.__name__)])
+
+    jobs = []
+    for job_module_function, module_result_dir in module_jobs:
+        jobs.append({
+            "name": job_module_function.__name__,
+            "target": Path(entry["full_path"]).name,
+            "tool": module_tool.get(job_module_function.__name__, "eztool"),
+            "function": run_module,
+            "args": (entry["full_path"], job_module_function, module_result_dir, dest),
+            "group": str(module_result_dir),
+            "group_size": sum(1 for _, result_dir in module_jobs if result_dir == module_result_dir),
+            "cleanup": entry.get("cleanup"),
+            "staged_from": entry.get("staged_from"),
+            "workers": get_module_workers(job_module_function.__name__),
+            "target_size": len(module_jobs)
+        })
+    return jobs
+
+def get_archive_artifacts(module_function=None):
+    # artifacts read by the enabled modules, nothing else is extracted from an archive
+    global processing_module
+
+    module_names = [module_function.__name__] if module_function != None else [entry_module_function.__name__ for module in processing_module for entry_module_function in module["module_list"]]
+    artifact_list = []
+    for module_name in module_names:
+        artifact_list += module_artifacts.get(module_name, [])
+    return artifact_list
+
+def open_extract_slots():
+    # ArchiveExtractTargets extracted targets at a time for the whole run, a slot is freed by the cleanup of a parsed target
+    return threading.Semaphore(max(1, windows_config.ArchiveExtractTargets))
+
+def expand_entry(entry, target_pattern, module_function=None, extract_slots=None):
+    # an archive entry becomes one entry per target found inside it, extracted only when the previous one was handed over
+    if not entry.get("archive"):
+        yield entry
+        return
+    yield from windows_archive.iter_archive_targets(entry["full_path"], target_pattern, get_archive_artifacts(module_function), ROOT_RESULT_PATH, sevenzip_bin, entry.get("whole_archive", False), extract_slots)
+
+def open_stager(module_function=None):
+    if windows_config.StagingDir == None:
+        return None
+    return windows_staging.TargetStager(windows_config.StagingDir, get_archive_artifacts(module_function), ROOT_RESULT_PATH, record_metric)
+
+def stage_entry(stager, entry):
+    # extracted archive targets are already local
+    if stager == None or entry.get("archive"):
+        return entry
+    return stager.stage(entry)
+
+def entry_processing(entry, module_function=None, max_jobs=None, target_pattern=None):
+    stager = open_stager(module_function)
+    scheduler = JobScheduler(max_jobs)
+    scheduler_thread = threading.Thread(target=scheduler.run, name="scheduler", daemon=True)
+    scheduler_thread.start()
+    try:
+        for target_entry in expand_entry(entry, target_pattern, module_function, open_extract_slots()):
+            for job in create_entry_jobs(stage_entry(stager, target_entry), module_function):
+                scheduler.submit(job)
+    finally:
+        scheduler.close()
+        scheduler_thread.join()
+        if stager != None:
+            stager.close()
     return
 
-def windows_parser(target_dir, target_pattern_file = Path(__file__).parent.joinpath("target.txt"), module_function=None):  
+def load_target_patterns(target_pattern_file):
     pattern_data = []
 
     with open(target_pattern_file, "r") as f:
@@ -379,20 +2115,400 @@ def windows_parser(target_dir, target_pattern_file = Path(__file__).parent.joinp
             continue
         print(f"Found pattern: \"{pattern}\"")
         pattern_list.append(pattern)
-
-    data_entry = []
+    return pattern_list
+
+def compile_target_patterns(pattern_list):
+    return re.compile("|".join(f"(?:{pattern})" for pattern in pattern_list))
+
+def is_volume_marker(dir_entry):
+    # Windows/System32 or $Extend, the folder holding it is the root of a collected volume
+    name = dir_entry.name.lower()
+    if name == "$extend":
+        return True
+    return name == "windows" and any(os.path.isdir(os.path.join(dir_entry.path, system_dir)) for system_dir in ["System32", "system32"])
+
+def find_targets(target_dir, pattern_list, max_depth=None):
+    # yields targets while walking, does not descend into a matched target or a known artifact folder.
+    # archives are yielded as {"full_path", "archive"} entries, expand_entry looks for targets inside them
+    target_pattern = compile_target_patterns(pattern_list)
+    prune_dirs = set(prune_dir.lower() for prune_dir in windows_config.DiscoveryPruneDirs)
+    max_depth = max_depth if max_depth != None else windows_config.DiscoveryMaxDepth
+    found_targets = set()
+    pending_dirs = [(str(Path(target_dir).resolve()), 1)]
+    while pending_dirs:
+        current_dir, depth = pending_dirs.pop()
+        try:
+            dir_entries = []
+            archive_entries = []
+            with os.scandir(current_dir) as it:
+                for dir_entry in it:
+                    if dir_entry.is_dir():
+                        dir_entries.append(dir_entry)
+                    elif windows_config.ArchiveSources and windows_archive.is_archive(dir_entry.name) and dir_entry.is_file():
+                        archive_entries.append(dir_entry)
+        except OSError as e:
+            print(f"Failed to scan {current_dir}: {e}")
+            continue
+        # <archive name>/ next to an archive holds its results, not a target, unless it holds anything else
+        archive_stems = set(os.path.splitext(archive_entry.name)[0] for archive_entry in archive_entries)
+        for archive_entry in sorted(archive_entries, key=lambda archive_entry: archive_entry.name):
+            full_path = os.path.realpath(archive_entry.path)
+            if full_path not in found_targets:
+                found_targets.add(full_path)
+                yield {"full_path": full_path, "archive": True}
+        # the artifact folder names are pruned only in a volume folder, a case folder named like one of them is still searched
+        volume_dir = any(is_volume_marker(dir_entry) for dir_entry in dir_entries)
+        sub_dirs = []
+        for dir_entry in sorted(dir_entries, key=lambda dir_entry: dir_entry.name):
+            if dir_entry.name in archive_stems and windows_archive.is_result_dir(dir_entry.path, ROOT_RESULT_PATH):
+                continue
+            if target_pattern.search(dir_entry.name):
+                full_path = os.path.realpath(dir_entry.path)
+                if full_path not in found_targets:
+                    found_targets.add(full_path)
+                    yield {"full_path": full_path}
+            elif dir_entry.name.lower() != ROOT_RESULT_PATH.lower() and not (volume_dir and dir_entry.name.lower() in prune_dirs) and not dir_entry.is_symlink() and (not max_depth or depth < max_depth):
+                sub_dirs.append((dir_entry.path, depth + 1))
+        pending_dirs += reversed(sub_dirs)
+
+def windows_parser(target_dir, target_pattern_file = Path(__file__).parent.joinpath("target.txt"), module_function=None, max_jobs=None, work_queue=None, max_depth=None):  
+    pattern_list = load_target_patterns(target_pattern_file)
+    target_pattern = compile_target_patterns(pattern_list)
 
     print("{0}: Parsing {1}...".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), target_dir))
-    for path in Path(target_dir).rglob("*"):
-        if path.is_dir():
-            for pattern in pattern_list:
-                if re.search(pattern, path.name):
-                    data_entry.append({"full_path": str(path.resolve())})           
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        results = executor.map(entry_processing, data_entry, [module_function] * len(data_entry))
+    start_time = time.monotonic()
+    targets = 0
+    stager = open_stager(module_function) if work_queue == None else None
+    extract_slots = open_extract_slots()
+    def discover_jobs():
+        nonlocal targets
+        for entry in find_targets(target_dir, pattern_list, max_depth):
+            # blocks while ArchiveExtractTargets targets are extracted or StagingTargets targets are staged,
+            # the scheduler (or the queue workers) keeps parsing them meanwhile
+            for target_entry in expand_entry(entry, target_pattern, module_function, extract_slots):
+                targets += 1
+                yield create_entry_jobs(stage_entry(stager, target_entry), module_function)
+        record_metric("discovery", "targets", Path(target_dir).name, wall_time=time.monotonic() - start_time, targets=targets)
+
+    job_batches = discover_jobs()
+    if work_queue != None:
+        # workers read extracted archive targets from the scratch directory, it has to be shared like the case
+        queue_coordinator(work_queue, target_dir, job_batches)
+        return
+    scheduler = JobScheduler(max_jobs)
+    scheduler_thread = threading.Thread(target=scheduler.run, name="scheduler", daemon=True)
+    scheduler_thread.start()
+    if windows_config.BatchModules:
+        # a batch holds its extracted or staged targets until it runs, it can not wait for more of them than there are slots
+        held_targets = ([windows_config.StagingTargets] if stager != None else []) + ([windows_config.ArchiveExtractTargets] if windows_config.ArchiveSources else [])
+        job_batches = batch_entry_jobs(job_batches, Path(target_dir).resolve().joinpath(ROOT_RESULT_PATH, "batch"), windows_config.BatchTargets, max(1, min(held_targets)) if held_targets else None)
+    try:
+        for jobs in job_batches:
+            for job in jobs:
+                scheduler.submit(job)
+    finally:
+        scheduler.close()
+        scheduler_thread.join()
+        if stager != None:
+            stager.close()
     
     print("{0}: Done...".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
 
+def queue_jobs(work_queue, jobs):
+    return work_queue.enqueue([{"target": job["args"][0], "module": job["name"], "tool": job["tool"], "result_dir": str(job["args"][2]), "dest": str(job["args"][3])} for job in jobs])
+
+def queue_coordinator(work_queue, case_dir, job_batches):
+    # workers resolve the module by name and need the same paths, so the case must be mounted at the same place on every node
+    work_queue.set_setting("case_dir", str(Path(case_dir).resolve()))
+    work_queue.set_setting("event_filter", event_filter)
+    work_queue.set_setting("closed", False)
+    # extracted archive targets are removed once none of their jobs is pending or running, which frees the slot
+    # the discovery waits for while the next jobs are queued
+    cleanups = {}
+    cleanup_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def cleanup_finished_targets():
+        with cleanup_lock:
+            targets = list(cleanups.keys())
+        if not targets:
+            return
+        open_targets = set(work_queue.open_targets(targets))
+        for target in targets:
+            if target not in open_targets:
+                with cleanup_lock:
+                    cleanup = cleanups.pop(target)
+                cleanup([])
+
+    def watch_cleanups():
+        while not stopped.wait(windows_config.QueuePollSeconds):
+            try:
+                cleanup_finished_targets()
+            except (OSError, RuntimeError) as e:
+                print(f"Checking finished targets failed: {e}")
+
+    cleanup_thread = threading.Thread(target=watch_cleanups, name="queue_cleanup", daemon=True)
+    cleanup_thread.start()
+    try:
+        total_jobs = 0
+        for jobs in job_batches:
+            total_jobs += queue_jobs(work_queue, jobs)
+            with cleanup_lock:
+                for job in jobs:
+                    if job.get("cleanup") != None:
+                        cleanups[job["args"][0]] = job["cleanup"]
+        work_queue.set_setting("closed", True)
+        print("{0}: Queued {1} jobs, waiting for workers...".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), total_jobs))
+
+        last_counts = None
+        while True:
+            work_queue.requeue_expired()
+            counts = work_queue.counts()
+            if counts != last_counts:
+                print("{0}: Queue pending {1}, running {2}, done {3}, failed {4}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), counts["pending"], counts["running"], counts["done"], counts["failed"]))
+                last_counts = counts
+            if counts["pending"] == 0 and counts["running"] == 0:
+                break
+            time.sleep(windows_config.QueuePollSeconds)
+    finally:
+        stopped.set()
+        cleanup_thread.join()
+        with cleanup_lock:
+            for cleanup in cleanups.values():
+                cleanup([])
+            cleanups.clear()
+    # workers only run modules, outputs of the queued targets are converted once the queue drained
+    windows_convert.print_converted(windows_convert.convert_results(case_dir, ROOT_RESULT_PATH))
+    print("{0}: Done...".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return counts
+
+def queue_worker(work_queue, worker_name=None, max_jobs=None, tool_limits=None):
+    worker_name = worker_name if worker_name else "{0}_{1}".format(socket.gethostname(), os.getpid())
+    max_jobs = max_jobs if max_jobs else windows_config.MaxJobs
+    tool_limits = tool_limits if tool_limits != None else windows_config.ToolConcurrency
+    functions = list_module_parser()
+    condition = threading.Condition()
+    running = {}
+    lost = set()
+    stopped = threading.Event()
+    print("{0}: Worker {1} started, max {2} jobs".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), worker_name, max_jobs))
+
+    def heartbeat():
+        while not stopped.wait(windows_config.QueueHeartbeatSeconds):
+            with condition:
+                job_keys = [job_key for job_key in running if job_key not in lost]
+            if not job_keys:
+                continue
+            try:
+                owned = work_queue.heartbeat(worker_name, [list(job_key) for job_key in job_keys], windows_config.QueueLeaseSeconds)
+            except (OSError, RuntimeError) as e:
+                print(f"Worker {worker_name} heartbeat failed: {e}")
+                continue
+            with condition:
+                for job_key in set(job_keys) - set(tuple(job_key) for job_key in owned):
+                    lost.add(job_key)
+                    print("{0}: Lease of job {1} lost, it was requeued".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_key[0]))
+
+    def run_queue_job(job):
+        job_key = (job["id"], job["attempts"])
+        job_context.workers = job["workers"]
+        error = None
+        try:
+            if job["module"] not in functions:
+                raise ValueError("module {0} not found".format(job["module"]))
+            run_module(job["target"], functions[job["module"]], job["result_dir"], job["dest"])
+        except Exception as e:
+            error = str(e)
+            print("{0}: {1} on {2} failed: {3}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job["module"], Path(job["target"]).name, e))
+        # a job whose lease was lost belongs to its next claim, this result is not reported
+        with condition:
+            completed = 0 if job_key in lost else None
+        try:
+            if completed == None:
+                completed = work_queue.complete(job["id"], worker_name, error, job["attempts"])
+        except (OSError, RuntimeError) as e:
+            print(f"Worker {worker_name} could not complete job {job['id']}: {e}")
+        if completed == 0:
+            print("{0}: {1} on {2} finished after its lease was lost, result discarded.".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job["module"], Path(job["target"]).name))
+        else:
+            print("{0}: {1} on {2} finished.".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job["module"], Path(job["target"]).name))
+        with condition:
+            del running[job_key]
+            lost.discard(job_key)
+            target_running = any(running_job["target"] == job["target"] for running_job in running.values())
+            condition.notify_all()
+        # the cached index and hives of a target are dropped once no job of it is left in the queue
+        if not target_running:
+            try:
+                target_open = job["target"] in work_queue.open_targets([job["target"]])
+            except (OSError, RuntimeError):
+                target_open = False
+            if not target_open:
+                release_target_caches(job["target"], job["dest"])
+
+    heartbeat_thread = threading.Thread(target=heartbeat, name="heartbeat", daemon=True)
+    heartbeat_thread.start()
+    unreachable_since = None
+    try:
+        while True:
+            with condition:
+                while sum(job["workers"] for job in running.values()) >= max_jobs:
+                    condition.wait()
+                tool_running = {}
+                for job in running.values():
+                    tool_running[job["tool"]] = tool_running.get(job["tool"], 0) + job["workers"]
+                busy_tools = [tool for tool, limit in tool_limits.items() if tool_running.get(tool, 0) >= limit]
+            try:
+                job = work_queue.claim(worker_name, windows_config.QueueLeaseSeconds, busy_tools)
+                counts = work_queue.counts() if job == None else None
+                closed = work_queue.get_setting("closed", False) if job == None else False
+                unreachable_since = None
+            except (OSError, RuntimeError) as e:
+                unreachable_since = unreachable_since or time.monotonic()
+                if time.monotonic() - unreachable_since > windows_config.QueueLeaseSeconds:
+                    print(f"Worker {worker_name} giving up, queue unreachable: {e}")
+                    break
+                time.sleep(windows_config.QueuePollSeconds)
+                continue
+            if job != None:
+                with condition:
+                    available = max_jobs - sum(running_job["workers"] for running_job in running.values())
+                    if tool_limits.get(job["tool"]) != None:
+                        available = min(available, tool_limits[job["tool"]] - tool_running.get(job["tool"], 0))
+                    job["workers"] = max(1, min(get_module_workers(job["module"]), available))
+                    running[(job["id"], job["attempts"])] = job
+                threading.Thread(target=run_queue_job, args=(job,), name=job["module"], daemon=True).start()
+                continue
+            with condition:
+                if closed and counts["pending"] == 0 and not running and counts["running"] == 0:
+                    break
+                condition.wait(windows_config.QueuePollSeconds)
+    finally:
+        with condition:
+            while running:
+                condition.wait()
+        stopped.set()
+    print("{0}: Worker {1} done...".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), worker_name))
+
+def watch_folder(target_dir, target_pattern_file = Path(__file__).parent.joinpath("target.txt"), module_function=None, max_jobs=None, work_queue=None, max_depth=None):
+    # queue every target once nothing below it changed for WatchStableSeconds, until interrupted
+    pattern_list = load_target_patterns(target_pattern_file)
+    target_pattern = compile_target_patterns(pattern_list)
+    target_dir = Path(target_dir).resolve()
+    skip_dir_names = [ROOT_RESULT_PATH]
+    watcher = windows_watch.open_inotify(skip_dir_names) if windows_config.WatchMode in ["auto", "inotify"] else None
+    print("{0}: Watching {1} ({2}), targets are queued after {3}s without changes".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), target_dir, "inotify" if watcher != None else "polling", windows_config.WatchStableSeconds))
+
+    scheduler = None
+    scheduler_thread = None
+    if work_queue != None:
+        work_queue.set_setting("case_dir", str(target_dir))
+        work_queue.set_setting("event_filter", event_filter)
+        work_queue.set_setting("closed", False)
+    else:
+        scheduler = JobScheduler(max_jobs)
+        scheduler_thread = threading.Thread(target=scheduler.run, name="scheduler", daemon=True)
+        scheduler_thread.start()
+
+    candidates = {}
+    queued_targets = set()
+
+    def add_candidate(path):
+        if path in candidates or path in queued_targets or not target_pattern.search(Path(path).name):
+            return
+        print("{0}: Found target {1}, waiting for the upload to settle".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), path))
+        candidates[path] = {"last_change": time.monotonic(), "signature": windows_watch.get_tree_signature(path, skip_dir_names) if watcher == None else None}
+
+    def touch_candidates(path):
+        for parent in [Path(path)] + list(Path(path).parents):
+            if str(parent) in candidates:
+                candidates[str(parent)]["last_change"] = time.monotonic()
+            if parent == target_dir:
+                break
+
+    def add_targets():
+        # the same targets as a one-off run finds: matched folders not inside another target, pruned folders and max depth
+        for entry in find_targets(target_dir, pattern_list, max_depth):
+            if not entry.get("archive"):
+                add_candidate(entry["full_path"])
+
+    def is_inside_target(path):
+        for parent in Path(path).parents:
+            if str(parent) in candidates or str(parent) in queued_targets:
+                return True
+            if parent == target_dir:
+                break
+        return False
+
+    def add_watched_tree(path):
+        # every folder is watched to see the uploads settle, the targets among them come from add_targets
+        try:
+            watcher.add_tree(path)
+        except OSError as e:
+            print(f"inotify watch failed, polling instead: {e}")
+            return False
+        return True
+
+    try:
+        if watcher != None and not add_watched_tree(str(target_dir)):
+            watcher.close()
+            watcher = None
+        add_targets()
+
+        while True:
+            if watcher != None:
+                events = watcher.read_events(windows_config.WatchPollSeconds)
+                if events == None or any(created_dir and not add_watched_tree(path) for path, created_dir in events):
+                    print("{0}: inotify lost events, polling instead".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                    watcher.close()
+                    watcher = None
+                    for candidate in candidates.values():
+                        candidate["signature"] = None
+                else:
+                    for path, created_dir in events:
+                        touch_candidates(path)
+                    # a folder created inside a known target is part of its upload, anywhere else it may be a new target
+                    if any(created_dir and not is_inside_target(path) for path, created_dir in events):
+                        add_targets()
+            else:
+                time.sleep(windows_config.WatchPollSeconds)
+                add_targets()
+                for path, candidate in candidates.items():
+                    signature = windows_watch.get_tree_signature(path, skip_dir_names)
+                    if signature != candidate["signature"]:
+                        candidate["signature"] = signature
+                        candidate["last_change"] = time.monotonic()
+
+            for path in list(candidates.keys()):
+                if not os.path.isdir(path):
+                    del candidates[path]
+                    continue
+                if time.monotonic() - candidates[path]["last_change"] < windows_config.WatchStableSeconds:
+                    continue
+                del candidates[path]
+                queued_targets.add(path)
+                if watcher != None:
+                    watcher.remove_tree(path)
+                jobs = create_entry_jobs({"full_path": path}, module_function)
+                if work_queue != None:
+                    queue_jobs(work_queue, jobs)
+                else:
+                    for job in jobs:
+                        scheduler.submit(job)
+                print("{0}: Queued {1} jobs for {2}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(jobs), path))
+                record_metric("discovery", "watch", Path(path).name, targets=1, jobs=len(jobs))
+    except KeyboardInterrupt:
+        print("{0}: Stopped watching {1}, finishing queued jobs...".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), target_dir))
+    finally:
+        if watcher != None:
+            watcher.close()
+    if work_queue != None:
+        work_queue.set_setting("closed", True)
+    else:
+        scheduler.close()
+        scheduler_thread.join()
+    print("{0}: Done...".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
 def init_module_config():   
     global processing_module
     
@@ -470,11 +2586,24 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     group = parser.add_mutually_exclusive_group(required=True)
 
-    group.add_argument("-s", help="single_target_folder")
+    group.add_argument("-s", help="single_target_folder_or_archive")
     group.add_argument("-r", help="multiple_target_folders")
+    group.add_argument("--worker", help="run_queued_jobs_from (queue file or tcp://host:port)")
 
     parser.add_argument("-f", help="target_file_patterns (regex, default from target.txt)")
     parser.add_argument("-m", help="single_parser")
+    parser.add_argument("--max-jobs", type=int, help="max_concurrent_jobs (default MaxJobs from windows_config.py)")
+    parser.add_argument("--timeline", action="store_true", help="build_super_timeline_after_parsing")
+    parser.add_argument("--store", action="store_true", help="load_results_into_case_database_after_parsing")
+    parser.add_argument("--metrics-prom", help="prometheus_textfile_for_run_metrics")
+    parser.add_argument("--queue", help="queue_jobs_for_workers_instead_of_running (queue file or tcp://host:port)")
+    parser.add_argument("--listen", help="serve_queue_file_to_workers_on (host:port)")
+    parser.add_argument("--watch", action="store_true", help="keep_watching_multiple_target_folders_for_new_targets")
+    parser.add_argument("--max-depth", type=int, help="max_folder_depth_searched_for_targets (default DiscoveryMaxDepth from windows_config.py)")
+    parser.add_argument("--since", help="parse_events_from (UTC YYYY-MM-DD[ HH:MM:SS], default FilterSince from windows_config.py)")
+    parser.add_argument("--until", help="parse_events_until (UTC YYYY-MM-DD[ HH:MM:SS], default FilterUntil from windows_config.py)")
+    parser.add_argument("--event-ids", type=int, nargs="+", help="event_ids_kept_by_hayabusa_timeline_and_EvtxECmd")
+    parser.add_argument("--channels", nargs="+", help="event_log_channels_parsed (e.g. Security Microsoft-Windows-PowerShell/Operational)")
     
     args = parser.parse_args()
 
@@ -489,18 +2618,65 @@ if __name__ == "__main__":
     else:
         init_module_config()
 
+    try:
+        init_event_filter(args.since, args.until, args.event_ids, args.channels)
+    except ValueError as e:
+        print(f"{e}!")
+        exit(-1)
+
+    work_queue = None
+    if args.worker:
+        print(f"queue_worker: {args.worker}")
+        work_queue = windows_queue.open_queue(args.worker)
+        worker_name = "{0}_{1}".format(socket.gethostname(), os.getpid())
+        case_dir = work_queue.get_setting("case_dir")
+        if case_dir != None:
+            init_run_metrics(Path(case_dir).joinpath(ROOT_RESULT_PATH), f"run_metrics_{worker_name}.jsonl")
+        # the coordinator's filter when it published one, the local windows_config only when it did not
+        published_filter = work_queue.get_setting("event_filter")
+        if published_filter != None:
+            init_event_filter(**published_filter, use_config=False)
+        else:
+            init_event_filter()
+        queue_worker(work_queue, worker_name, args.max_jobs)
+        print_metrics_summary()
+        if args.metrics_prom:
+            write_prometheus_metrics(args.metrics_prom)
+        exit(0)
+
+    if args.queue or args.listen:
+        queue_root = Path(args.r or args.s)
+        if queue_root.is_file():
+            queue_root = queue_root.resolve().parent.joinpath(os.path.splitext(queue_root.name)[0])
+        queue_address = args.queue if args.queue else queue_root.joinpath(ROOT_RESULT_PATH, windows_queue.QUEUE_FILE)
+        if not str(queue_address).startswith("tcp://"):
+            os.makedirs(Path(queue_address).parent, exist_ok=True)
+        elif args.listen:
+            print(f"--listen needs a queue file!")
+            exit(-1)
+        print(f"queue_jobs: {queue_address}")
+        work_queue = windows_queue.open_queue(queue_address)
+        if args.listen:
+            listen_address = windows_queue.parse_address(args.listen)
+            windows_queue.QueueServer(listen_address, work_queue).start()
+            print(f"serving queue on {listen_address[0]}:{listen_address[1]}")
+            if windows_config.QueueToken == None and listen_address[0] not in ["127.0.0.1", "localhost", "::1"]:
+                print(f"QueueToken is not set, anyone reaching {listen_address[0]}:{listen_address[1]} can queue and complete jobs")
+
     if args.r:
         print("multiple_target_folder")
         multiple_target = Path(args.r)
         if not Path(multiple_target).exists():
             print(f"target not found!")
             exit(-1)
+        init_run_metrics(multiple_target.joinpath(ROOT_RESULT_PATH))
         if args.f:
             print("apply target_file_path")
             target_pattern = Path(args.f)
-            windows_parser(multiple_target, target_pattern, module_function)
+            (watch_folder if args.watch else windows_parser)(multiple_target, target_pattern, module_function, args.max_jobs, work_queue, args.max_depth)
         else:
-            windows_parser(multiple_target, module_function=module_function)
+            (watch_folder if args.watch else windows_parser)(multiple_target, module_function=module_function, max_jobs=args.max_jobs, work_queue=work_queue, max_depth=args.max_depth)
+        case_dir = multiple_target
     
     elif args.s:
         print("single_target_folder")
@@ -508,6 +2684,31 @@ if __name__ == "__main__":
         if not Path(single_target).exists():
             print(f"target not found!")
             exit(-1)
-        entry_processing({"name": single_target.name, "full_path": str(single_target.resolve())}, module_function)
+        entry = {"name": single_target.name, "full_path": str(single_target.resolve())}
+        target_pattern = None
+        if single_target.is_file() and windows_archive.is_archive(single_target):
+            # -s on an archive: targets inside it matching the patterns, else the archive itself is the target
+            entry.update({"archive": True, "whole_archive": True})
+            target_pattern = compile_target_patterns(load_target_patterns(Path(args.f) if args.f else Path(__file__).parent.joinpath("target.txt")))
+            single_target = single_target.resolve().parent.joinpath(os.path.splitext(single_target.name)[0])
+        init_run_metrics(single_target.joinpath(ROOT_RESULT_PATH))
+        if work_queue != None:
+            queue_coordinator(work_queue, single_target, (create_entry_jobs(target_entry, module_function) for target_entry in expand_entry(entry, target_pattern, module_function, open_extract_slots())))
+        else:
+            entry_processing(entry, module_function, args.max_jobs, target_pattern)
+        case_dir = single_target
+
+    if args.timeline:
+        start_time = time.monotonic()
+        windows_timeline.build_timeline(case_dir, ROOT_RESULT_PATH)
+        record_metric("post", "timeline", case_dir.name, wall_time=time.monotonic() - start_time)
+    if args.store:
+        start_time = time.monotonic()
+        windows_store.ingest_results(case_dir, ROOT_RESULT_PATH)
+        record_metric("post", "store", case_dir.name, wall_time=time.monotonic() - start_time)
+
+    print_metrics_summary()
+    if args.metrics_prom:
+        write_prometheus_metrics(args.metrics_prom)
    
     exit(0)
\ No newline at end of file
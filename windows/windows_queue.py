@@ -0,0 +1,208 @@
+import hmac
+import json
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+import windows_config
+
+QUEUE_FILE = "queue.db"
+QUEUE_METHODS = ["enqueue", "claim", "heartbeat", "complete", "requeue_expired", "counts", "open_targets", "set_setting", "get_setting"]
+
+class WorkQueue:
+    # jobs table shared by the coordinator and the workers, each claim/complete is one short transaction.
+    # the rollback journal (not WAL) is kept so the file also works on a shared volume with working locks
+    def __init__(self, queue_file):
+        self.queue_file = str(queue_file)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.queue_file, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, target TEXT, module TEXT, tool TEXT, result_dir TEXT, dest TEXT, state TEXT, worker TEXT, attempts INTEGER DEFAULT 0, lease_until REAL, created REAL, started REAL, finished REAL, error TEXT, UNIQUE(target, module))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, id)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+
+    def transaction(self, callback, *args):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = callback(*args)
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            return result
+
+    def enqueue(self, jobs):
+        # finished jobs of a target are queued again, the incremental manifests skip the unchanged ones
+        def insert_jobs():
+            for job in jobs:
+                self.connection.execute("INSERT INTO jobs (target, module, tool, result_dir, dest, state, created) VALUES (?, ?, ?, ?, ?, 'pending', ?) ON CONFLICT(target, module) DO UPDATE SET tool = excluded.tool, result_dir = excluded.result_dir, dest = excluded.dest, state = 'pending', worker = NULL, attempts = 0, error = NULL, created = excluded.created WHERE state IN ('done', 'failed')",
+                    (job["target"], job["module"], job["tool"], job["result_dir"], job["dest"], time.time()))
+            return len(jobs)
+        return self.transaction(insert_jobs)
+
+    def expire_leases(self):
+        now = time.time()
+        self.connection.execute("UPDATE jobs SET state = 'failed', finished = ?, error = 'lease expired' WHERE state = 'running' AND lease_until < ? AND attempts >= ?", (now, now, windows_config.QueueMaxAttempts))
+        return self.connection.execute("UPDATE jobs SET state = 'pending', worker = NULL WHERE state = 'running' AND lease_until < ?", (now,)).rowcount
+
+    def requeue_expired(self):
+        return self.transaction(self.expire_leases)
+
+    def claim(self, worker, lease_seconds, exclude_tools=None):
+        exclude_tools = list(exclude_tools or [])
+        def claim_job():
+            self.expire_leases()
+            query = "SELECT * FROM jobs WHERE state = 'pending'"
+            if exclude_tools:
+                query += " AND tool NOT IN ({0})".format(", ".join("?" * len(exclude_tools)))
+            row = self.connection.execute(query + " ORDER BY id LIMIT 1", exclude_tools).fetchone()
+            if row == None:
+                return None
+            now = time.time()
+            self.connection.execute("UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1, lease_until = ?, started = ? WHERE id = ?", (worker, now + lease_seconds, now, row["id"]))
+            return dict(row, state="running", worker=worker, attempts=row["attempts"] + 1)
+        return self.transaction(claim_job)
+
+    def heartbeat(self, worker, jobs, lease_seconds):
+        # jobs as [id, attempt], a job queued again and claimed once more (even by the same worker) is not extended
+        def extend_leases():
+            owned = []
+            for job_id, attempt in jobs:
+                if self.connection.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'running' AND attempts = ?", (time.time() + lease_seconds, job_id, worker, attempt)).rowcount:
+                    owned.append([job_id, attempt])
+            return owned
+        return self.transaction(extend_leases)
+
+    def complete(self, job_id, worker, error=None, attempt=None):
+        # 0 when the lease of this attempt was lost, the job belongs to its next claim and the result is discarded
+        def finish_job():
+            return self.connection.execute("UPDATE jobs SET state = ?, finished = ?, error = ? WHERE id = ? AND worker = ? AND state = 'running' AND (? IS NULL OR attempts = ?)", ("failed" if error != None else "done", time.time(), error, job_id, worker, attempt, attempt)).rowcount
+        return self.transaction(finish_job)
+
+    def counts(self):
+        with self.lock:
+            counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+            for state, count in self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+                counts[state] = count
+            return counts
+
+    def open_targets(self, targets):
+        # targets among the given ones that still have pending or running jobs
+        with self.lock:
+            return [target for target in targets if self.connection.execute("SELECT 1 FROM jobs WHERE target = ? AND state IN ('pending', 'running') LIMIT 1", (target,)).fetchone() != None]
+
+    def set_setting(self, key, value):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO settings VALUES (?, ?)", (key, json.dumps(value)))
+
+    def get_setting(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+            return json.loads(row[0]) if row != None else default
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class QueueRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if windows_config.QueueToken != None and not hmac.compare_digest(str(request.get("token") or "").encode("utf-8"), str(windows_config.QueueToken).encode("utf-8")):
+                    raise PermissionError("invalid queue token")
+                if request.get("method") not in QUEUE_METHODS:
+                    raise ValueError("unknown method {0}".format(request.get("method")))
+                response = {"result": getattr(self.server.work_queue, request["method"])(*request.get("args", []))}
+            except Exception as e:
+                response = {"error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+class QueueServer(socketserver.ThreadingTCPServer):
+    # json line broker in front of a WorkQueue, for workers that cannot share the queue file
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, work_queue):
+        self.work_queue = work_queue
+        super().__init__(address, QueueRequestHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="queue_server", daemon=True).start()
+        return self
+
+class QueueClient:
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.lock = threading.Lock()
+        self.connection = None
+        self.reader = None
+
+    def call(self, method, *args):
+        with self.lock:
+            try:
+                if self.connection == None:
+                    self.connection = socket.create_connection(self.address, timeout=60)
+                    self.reader = self.connection.makefile("rb")
+                self.connection.sendall((json.dumps({"method": method, "args": args, "token": windows_config.QueueToken}) + "\n").encode("utf-8"))
+                line = self.reader.readline()
+                if not line:
+                    raise ConnectionError("queue broker closed the connection")
+            except OSError:
+                self.close_connection()
+                raise
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def enqueue(self, jobs):
+        return self.call("enqueue", jobs)
+
+    def claim(self, worker, lease_seconds, exclude_tools=None):
+        return self.call("claim", worker, lease_seconds, list(exclude_tools or []))
+
+    def heartbeat(self, worker, jobs, lease_seconds):
+        return self.call("heartbeat", worker, jobs, lease_seconds)
+
+    def complete(self, job_id, worker, error=None, attempt=None):
+        return self.call("complete", job_id, worker, error, attempt)
+
+    def requeue_expired(self):
+        return self.call("requeue_expired")
+
+    def counts(self):
+        return self.call("counts")
+
+    def open_targets(self, targets):
+        return self.call("open_targets", list(targets))
+
+    def set_setting(self, key, value):
+        return self.call("set_setting", key, value)
+
+    def get_setting(self, key, default=None):
+        return self.call("get_setting", key, default)
+
+    def close_connection(self):
+        if self.connection != None:
+            self.connection.close()
+        self.connection = None
+        self.reader = None
+
+    def close(self):
+        with self.lock:
+            self.close_connection()
+
+def parse_address(address):
+    # a port alone is served on the loopback only, the broker runs queue methods for anyone reaching it
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+def open_queue(address):
+    # tcp://host:port connects to a broker, anything else is a queue file
+    if str(address).startswith("tcp://"):
+        return QueueClient(*parse_address(str(address)[len("tcp://"):]))
+    return WorkQueue(address)
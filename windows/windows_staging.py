@@ -0,0 +1,254 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from datetime import datetime
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import windows_archive
+import windows_config
+import windows_convert
+
+STAGING_STATE_FILE = "staging.json"
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+MANIFEST_SUFFIX = "_manifest.json"
+# decoded evtx are not copied back, their manifests would skip a decode whose output is missing locally
+SEED_SKIP_DIRS = ["evtx_cache", "evtx_cache_logs"]
+
+def list_target_files(target_dir, artifact_list, skip_dir_names):
+    # [path, relative path, size, mtime] of the files the enabled modules read, one scandir walk over the share
+    target_files = []
+    pending_dirs = [str(target_dir)]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as it:
+                for dir_entry in it:
+                    try:
+                        if dir_entry.is_dir(follow_symlinks=False):
+                            if not (dir_entry.name in skip_dir_names and current_dir == str(target_dir)):
+                                pending_dirs.append(dir_entry.path)
+                            continue
+                        if not dir_entry.is_file():
+                            continue
+                        relative_path = os.path.relpath(dir_entry.path, target_dir)
+                        parts = relative_path.lower().split(os.sep)
+                        if any(windows_archive.match_artifact(parts, artifact) for artifact in artifact_list):
+                            file_stat = dir_entry.stat()
+                            target_files.append([dir_entry.path, relative_path, file_stat.st_size, file_stat.st_mtime_ns])
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Failed to scan {current_dir}: {e}")
+    return target_files
+
+def is_same_file(path, size, mtime_ns):
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return False
+    return file_stat.st_size == size and file_stat.st_mtime_ns == mtime_ns
+
+def copy_file(source_file, dest_file):
+    # large sequential reads from the share, the copy keeps the source mtime so manifests match on the next run
+    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+    temp_file = dest_file + ".tmp"
+    with open(source_file, "rb") as source_f, open(temp_file, "wb") as dest_f:
+        shutil.copyfileobj(source_f, dest_f, COPY_BLOCK_SIZE)
+    shutil.copystat(source_file, temp_file)
+    os.replace(temp_file, dest_file)
+
+def sync_tree(source_dir, dest_dir):
+    # copies the files of source_dir missing or changed (size, mtime) in dest_dir, returns the bytes copied
+    copied_bytes = 0
+    for current_dir, _, file_names in os.walk(source_dir):
+        for file_name in file_names:
+            source_file = os.path.join(current_dir, file_name)
+            dest_file = os.path.join(dest_dir, os.path.relpath(source_file, source_dir))
+            source_stat = os.stat(source_file)
+            if is_same_file(dest_file, source_stat.st_size, source_stat.st_mtime_ns):
+                continue
+            copy_file(source_file, dest_file)
+            copied_bytes += source_stat.st_size
+    return copied_bytes
+
+def load_manifest_outputs(manifest_file):
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f).get("outputs", [])
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def remove_replaced_outputs(source_dir, dest_dir):
+    # outputs of earlier runs that only exist on the share, the rerun removed them locally but sync_tree never deletes
+    removed = 0
+    for current_dir, _, file_names in os.walk(source_dir):
+        for file_name in file_names:
+            if not file_name.endswith(MANIFEST_SUFFIX):
+                continue
+            source_file = os.path.join(current_dir, file_name)
+            dest_file = os.path.join(dest_dir, os.path.relpath(source_file, source_dir))
+            old_outputs = load_manifest_outputs(dest_file)
+            new_outputs = load_manifest_outputs(source_file)
+            if not old_outputs or new_outputs == None:
+                continue
+            for output_name in set(old_outputs) - set(new_outputs):
+                output_file = Path(dest_file).parent.joinpath(output_name)
+                for candidate in [output_file] + windows_convert.get_converted_files(output_file):
+                    if candidate.exists():
+                        candidate.unlink()
+                        removed += 1
+    return removed
+
+def seed_results(source_result_dir, local_result_dir):
+    # manifests and logs of earlier runs from the share, so an evicted target is still up to date where it did not change.
+    # The copy lands at the same local path (hash of the source), which is the one the manifests name
+    seeded = 0
+    for current_dir, dir_names, file_names in os.walk(source_result_dir):
+        dir_names[:] = [dir_name for dir_name in dir_names if dir_name not in SEED_SKIP_DIRS]
+        stems = [file_name[:-len(MANIFEST_SUFFIX)] for file_name in file_names if file_name.endswith(MANIFEST_SUFFIX)]
+        for file_name in file_names:
+            if not any(file_name == stem + MANIFEST_SUFFIX or file_name.startswith(stem + ".") for stem in stems):
+                continue
+            source_file = os.path.join(current_dir, file_name)
+            local_file = os.path.join(local_result_dir, os.path.relpath(source_file, source_result_dir))
+            source_stat = os.stat(source_file)
+            if not is_same_file(local_file, source_stat.st_size, source_stat.st_mtime_ns):
+                copy_file(source_file, local_file)
+                seeded += 1
+    return seeded
+
+def get_dir_size(directory):
+    return sum(os.path.getsize(os.path.join(current_dir, file_name)) for current_dir, _, file_names in os.walk(directory) for file_name in file_names)
+
+class TargetStager:
+    # local copies of the targets' artifacts, a target is staged while the previous ones are parsed (up to
+    # StagingTargets at a time) and results are written back to the share in the background once it is done.
+    # Copies stay cached until the byte budget needs their space, least recently used first
+    def __init__(self, staging_dir, artifact_list, result_dir_name, record_metric=None):
+        self.staging_dir = Path(staging_dir)
+        self.artifact_list = artifact_list
+        self.result_dir_name = result_dir_name
+        self.record_metric = record_metric
+        self.budget_bytes = windows_config.StagingBudgetBytes
+        self.max_targets = max(1, windows_config.StagingTargets)
+        self.condition = threading.Condition()
+        self.entries = {}
+        self.copier = ThreadPoolExecutor(max_workers=max(1, windows_config.StagingCopyWorkers))
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.load_cache()
+
+    def load_cache(self):
+        # copies left by earlier runs are reused when the same target comes again
+        for dir_entry in os.scandir(self.staging_dir):
+            state_file = Path(dir_entry.path).joinpath(STAGING_STATE_FILE)
+            if not dir_entry.is_dir() or not state_file.exists():
+                continue
+            try:
+                with open(state_file, "r") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                shutil.rmtree(dir_entry.path, ignore_errors=True)
+                continue
+            self.entries[state["source"]] = {"dir": Path(dir_entry.path), "bytes": get_dir_size(dir_entry.path), "active": False, "last_used": state.get("last_used", 0)}
+
+    def used_bytes(self):
+        return sum(entry["bytes"] for entry in self.entries.values())
+
+    def evict(self, needed_bytes, keep_source):
+        # called with the condition held, drops released copies (not the one being staged) until needed_bytes fit in the budget
+        for source, entry in sorted(self.entries.items(), key=lambda item: item[1]["last_used"]):
+            if self.used_bytes() + needed_bytes <= self.budget_bytes:
+                return True
+            if entry["active"] or source == keep_source:
+                continue
+            print("{0}: Evicting staged copy of {1} ({2} MB)".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), source, entry["bytes"] // (1024 * 1024)))
+            shutil.rmtree(entry["dir"], ignore_errors=True)
+            del self.entries[source]
+        return self.used_bytes() + needed_bytes <= self.budget_bytes
+
+    def reserve(self, source, needed_bytes):
+        # waits for a free target slot and budget, None when the target can never fit
+        with self.condition:
+            while True:
+                active = sum(1 for entry in self.entries.values() if entry["active"])
+                if active < self.max_targets and self.evict(needed_bytes, source):
+                    entry = self.entries.setdefault(source, {"dir": self.staging_dir.joinpath(hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]), "bytes": 0})
+                    entry.update({"active": True, "last_used": time.time()})
+                    entry["bytes"] += needed_bytes
+                    return entry
+                if active == 0:
+                    return None
+                self.condition.wait()
+
+    def stage(self, entry):
+        # returns the entry to parse, the original one when it cannot be staged
+        source = str(Path(entry["full_path"]).resolve())
+        start_time = time.monotonic()
+        target_files = list_target_files(source, self.artifact_list, [self.result_dir_name])
+        cached = self.entries.get(source)
+        local_target = (cached["dir"] if cached != None else self.staging_dir.joinpath(hashlib.sha1(source.encode("utf-8")).hexdigest()[:12])).joinpath(Path(source).name)
+        copy_files = [[path, str(local_target.joinpath(relative_path)), size] for path, relative_path, size, mtime in target_files if not is_same_file(local_target.joinpath(relative_path), size, mtime)]
+        needed_bytes = sum(size for _, _, size in copy_files)
+        staged = self.reserve(source, needed_bytes)
+        if staged == None:
+            print("{0}: {1} does not fit in StagingBudgetBytes, parsing it in place".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), source))
+            return entry
+
+        try:
+            for future in [self.copier.submit(copy_file, path, local_file) for path, local_file, _ in sorted(copy_files, key=lambda copy_file: copy_file[2], reverse=True)]:
+                future.result()
+        except OSError as e:
+            print(f"Failed to stage {source}: {e}")
+            with self.condition:
+                staged["active"] = False
+                self.condition.notify_all()
+            return entry
+        try:
+            seeded = seed_results(Path(source).joinpath(self.result_dir_name), local_target.joinpath(self.result_dir_name))
+        except OSError as e:
+            print(f"Failed to seed the manifests of {source}, its modules run again: {e}")
+            seeded = 0
+        with open(staged["dir"].joinpath(STAGING_STATE_FILE), "w") as f:
+            json.dump({"source": source, "last_used": staged["last_used"]}, f)
+        print("{0}: Staged {1} ({2} files, {3} MB copied, {4} MB cached, {5} earlier logs and manifests seeded) in {6:.1f}s".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), source, len(target_files), needed_bytes // (1024 * 1024), (sum(size for _, _, size, _ in target_files) - needed_bytes) // (1024 * 1024), seeded, time.monotonic() - start_time))
+        if self.record_metric != None:
+            self.record_metric("staging", "copy", Path(source).name, wall_time=time.monotonic() - start_time, files=len(target_files), input_bytes=needed_bytes)
+
+        staged_entry = dict(entry)
+        staged_entry.update({"full_path": str(local_target), "staged_from": source, "cleanup": lambda conversions: self.release(source, local_target, conversions)})
+        return staged_entry
+
+    def release(self, source, local_target, conversions):
+        # last job of the target finished, results go back to the share once its outputs are converted
+        self.writer.submit(self.write_back, source, local_target, conversions)
+
+    def write_back(self, source, local_target, conversions):
+        start_time = time.monotonic()
+        wait(conversions)
+        local_result_dir = local_target.joinpath(self.result_dir_name)
+        try:
+            copied_bytes = 0
+            if local_result_dir.exists():
+                remove_replaced_outputs(local_result_dir, Path(source).joinpath(self.result_dir_name))
+                copied_bytes = sync_tree(local_result_dir, Path(source).joinpath(self.result_dir_name))
+            print("{0}: Wrote back {1} MB of results to {2} in {3:.1f}s".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), copied_bytes // (1024 * 1024), source, time.monotonic() - start_time))
+            if self.record_metric != None:
+                self.record_metric("staging", "writeback", Path(source).name, wall_time=time.monotonic() - start_time, output_bytes=copied_bytes)
+        except OSError as e:
+            print(f"Failed to write back results of {source}, they are kept in {local_result_dir}: {e}")
+        with self.condition:
+            entry = self.entries.get(source)
+            if entry != None:
+                entry["active"] = False
+                entry["bytes"] = get_dir_size(entry["dir"])
+            self.condition.notify_all()
+
+    def close(self):
+        # waits for the pending write backs, the staged copies stay for the next run
+        self.writer.shutdown(wait=True)
+        self.copier.shutdown(wait=True)
@@ -0,0 +1,206 @@
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+import itertools
+import json
+import os
+import re
+import sqlite3
+import windows_config
+import windows_convert
+import windows_timeline
+
+STORE_FILE = "case.db"
+SKIP_DIRS = windows_convert.SKIP_DIRS
+
+timestamp_columns = ["timestamp", "timecreated", "updatetimestamp", "lastwritetimestamp", "filekeylastwritetimestamp", "lastmodifiedtimeutc", "runtime", "lastrun", "created0x10", "sourcecreated", "targetcreated", "deletedon", "lastmodified", "systemtime"]
+path_columns = ["fullpath", "path", "localpath", "targetidabsolutepath", "filename", "executablename", "hivepath", "sourcefile"]
+sha1_columns = ["sha1", "filesha1"]
+user_columns = ["username", "user", "targetusername", "subjectusername", "userid"]
+event_id_columns = ["eventid", "event_id"]
+
+def pick_value(row, columns):
+    for column in columns:
+        value = row.get(column)
+        if value not in [None, ""]:
+            return str(value)
+    return None
+
+def normalize_row(row):
+    lower_row = {str(column).lower(): value for column, value in row.items() if column != None}
+    timestamp = None
+    for column in timestamp_columns:
+        timestamp = windows_timeline.normalize_timestamp(str(lower_row.get(column) or ""))
+        if timestamp != None:
+            break
+    if lower_row.get("parentpath") and (lower_row.get("filename") or lower_row.get("name")):
+        path = windows_timeline.join_path(lower_row, "parentpath", "filename" if lower_row.get("filename") else "name")
+    else:
+        path = pick_value(lower_row, path_columns)
+    event_id = pick_value(lower_row, event_id_columns)
+    try:
+        event_id = int(event_id) if event_id != None else None
+    except ValueError:
+        event_id = None
+    description = pick_value(lower_row, ["ruletitle", "title", "mapdescription", "description", "category", "updatereasons"])
+    return [timestamp, path, pick_value(lower_row, sha1_columns), pick_value(lower_row, user_columns), event_id, description, json.dumps(row, default=str)]
+
+def iter_output_rows(output_file):
+    if windows_convert.get_output_name(output_file).lower().endswith(".csv"):
+        yield from windows_convert.iter_csv_rows(output_file)
+        return
+    with windows_convert.open_text(output_file) as f:
+        first_line = f.readline()
+        if first_line.lstrip().startswith("["):
+            for detection in json.loads(first_line + f.read()):
+                for match in detection.get("matches", []):
+                    yield dict(match, title=detection.get("title", ""))
+            return
+        for line in itertools.chain([first_line], f):
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(row, dict):
+                yield row
+
+def find_output_files(result_dir):
+    output_files = []
+    for current_dir, dir_names, file_names in os.walk(result_dir):
+        dir_names[:] = [dir_name for dir_name in dir_names if dir_name not in SKIP_DIRS]
+        for file_name in file_names:
+            if not re.search(r"\.(csv|json)(\.zst)?$|\.parquet$", file_name, re.IGNORECASE) or file_name.endswith("_manifest.json") or file_name == "artifact_index.json":
+                continue
+            output_files.append(Path(current_dir).joinpath(file_name))
+    return sorted(output_files)
+
+def open_store(store_file):
+    connection = sqlite3.connect(store_file)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS artifacts (host TEXT, source TEXT, file TEXT, timestamp TEXT, path TEXT COLLATE NOCASE, sha1 TEXT COLLATE NOCASE, user TEXT COLLATE NOCASE, event_id INTEGER, description TEXT, data TEXT)")
+    connection.execute("CREATE TABLE IF NOT EXISTS ingested_files (file TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, rows INTEGER)")
+    return connection
+
+def create_indexes(connection):
+    for column in ["host", "timestamp", "path", "sha1", "user", "event_id", "file"]:
+        connection.execute(f"CREATE INDEX IF NOT EXISTS idx_artifacts_{column} ON artifacts({column})")
+    connection.commit()
+
+def ingest_file(connection, host, output_file):
+    file_stat = output_file.stat()
+    ingested = connection.execute("SELECT size, mtime FROM ingested_files WHERE file = ?", (str(output_file),)).fetchone()
+    if ingested != None and ingested[0] == file_stat.st_size and ingested[1] == file_stat.st_mtime_ns:
+        return 0
+    connection.execute("DELETE FROM artifacts WHERE file = ?", (str(output_file),))
+    source = re.sub(r"^\d{14}_", "", output_file.name.split(".")[0])
+    batch = []
+    total_rows = 0
+    for row in iter_output_rows(output_file):
+        batch.append([host, source, str(output_file)] + normalize_row(row))
+        if len(batch) >= windows_config.StoreBatchRows:
+            connection.executemany("INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            total_rows += len(batch)
+            batch = []
+    if batch:
+        connection.executemany("INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+        total_rows += len(batch)
+    connection.execute("INSERT OR REPLACE INTO ingested_files VALUES (?, ?, ?, ?)", (str(output_file), file_stat.st_size, file_stat.st_mtime_ns, total_rows))
+    connection.commit()
+    return total_rows
+
+def ingest_results(root_dir, result_dir_name="WindowsParser", store_file=None):
+    store_file = Path(store_file) if store_file != None else Path(root_dir).joinpath(result_dir_name, STORE_FILE)
+    os.makedirs(store_file.parent, exist_ok=True)
+    result_dirs = windows_convert.find_result_dirs(root_dir, result_dir_name)
+    print("{0}: Loading results of {1} targets into {2}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(result_dirs), store_file))
+
+    connection = open_store(store_file)
+    connection.execute("PRAGMA synchronous=OFF")
+    try:
+        output_files = []
+        for result_dir in result_dirs:
+            for output_file in find_output_files(result_dir):
+                output_files.append(str(output_file))
+                total_rows = ingest_file(connection, result_dir.parent.name, output_file)
+                if total_rows:
+                    print("{0}: Loaded {1} rows from {2}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), total_rows, output_file))
+        for (stale_file,) in connection.execute("SELECT file FROM ingested_files").fetchall():
+            if stale_file not in output_files:
+                connection.execute("DELETE FROM artifacts WHERE file = ?", (stale_file,))
+                connection.execute("DELETE FROM ingested_files WHERE file = ?", (stale_file,))
+        connection.commit()
+        create_indexes(connection)
+    finally:
+        connection.close()
+    print("{0}: Store done...".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return store_file
+
+def query_store(store_file, sha1=None, path=None, user=None, event_id=None, host=None, source=None, since=None, until=None, hosts_only=False, limit=None):
+    match_conditions = []
+    parameters = []
+    for column, value in [["sha1", sha1], ["path", path], ["user", user]]:
+        if value == None:
+            continue
+        if "*" in value or "%" in value:
+            match_conditions.append(f"{column} LIKE ?")
+            parameters.append(value.replace("*", "%"))
+        else:
+            match_conditions.append(f"{column} = ?")
+            parameters.append(value)
+    if event_id != None:
+        match_conditions.append("event_id = ?")
+        parameters.append(event_id)
+
+    conditions = []
+    if match_conditions:
+        conditions.append("({0})".format(" OR ".join(match_conditions)))
+    for condition, value in [["host = ?", host], ["source LIKE ?", f"%{source}%" if source else None], ["timestamp >= ?", since], ["timestamp <= ?", until]]:
+        if value != None:
+            conditions.append(condition)
+            parameters.append(value)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    connection = sqlite3.connect(store_file)
+    try:
+        if hosts_only:
+            return connection.execute(f"SELECT host, COUNT(*) FROM artifacts{where} GROUP BY host ORDER BY host", parameters).fetchall()
+        query = f"SELECT host, source, timestamp, path, sha1, user, event_id, description FROM artifacts{where} ORDER BY timestamp"
+        if limit != None:
+            query += f" LIMIT {int(limit)}"
+        return connection.execute(query, parameters).fetchall()
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", required=True, help="parsed_target_folders")
+    parser.add_argument("--db", help="case_database (default <folder>/WindowsParser/case.db)")
+    parser.add_argument("--ingest", action="store_true", help="load_results_into_database")
+    parser.add_argument("--sha1", help="match_sha1")
+    parser.add_argument("--path", help="match_path (* as wildcard)")
+    parser.add_argument("--user", help="match_user (* as wildcard)")
+    parser.add_argument("--event-id", type=int, help="match_event_id")
+    parser.add_argument("--host", help="only_host")
+    parser.add_argument("--source", help="only_source (e.g. Amcache, MFTECmd)")
+    parser.add_argument("--since", help="only_after_timestamp (YYYY-MM-DD HH:MM:SS, UTC)")
+    parser.add_argument("--until", help="only_before_timestamp (YYYY-MM-DD HH:MM:SS, UTC)")
+    parser.add_argument("--hosts-only", action="store_true", help="list_matching_hosts")
+    parser.add_argument("--limit", type=int, help="max_rows")
+
+    args = parser.parse_args()
+
+    if not Path(args.r).exists():
+        print(f"target not found!")
+        exit(-1)
+    store_file = Path(args.db) if args.db else Path(args.r).joinpath("WindowsParser", STORE_FILE)
+    if args.ingest:
+        ingest_results(args.r, store_file=store_file)
+    if any(value != None for value in [args.sha1, args.path, args.user, args.event_id, args.host, args.source, args.since, args.until]) or args.hosts_only:
+        if not store_file.exists():
+            print(f"database not found, run with --ingest first!")
+            exit(-1)
+        for row in query_store(store_file, args.sha1, args.path, args.user, args.event_id, args.host, args.source, args.since, args.until, args.hosts_only, args.limit):
+            print("|".join("" if value == None else str(value) for value in row))
+
+    exit(0)
@@ -0,0 +1,191 @@
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import csv
+import heapq
+import os
+import re
+import shutil
+import sys
+import tempfile
+import windows_config
+import windows_convert
+
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+TIMELINE_HEADER = ["Timestamp", "Host", "Source", "TimestampType", "Description"]
+TIMESTAMP_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}:\d{2})(?:\.(\d+))?\s*(Z|[+-]\d{2}:?\d{2})?$")
+
+def normalize_timestamp(value):
+    match = TIMESTAMP_PATTERN.match(value.strip()) if value else None
+    if match == None:
+        return None
+    date_part, time_part, fraction, offset = match.groups()
+    fraction = (fraction or "")[:7].ljust(7, "0")
+    if offset != None and offset != "Z" and offset.replace(":", "") not in ["+0000", "-0000"]:
+        offset = offset.replace(":", "")
+        delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+        try:
+            local_time = datetime.strptime(f"{date_part} {time_part}", "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return None
+        utc_time = local_time - delta if offset[0] == "+" else local_time + delta
+        date_part, time_part = utc_time.strftime("%Y-%m-%d"), utc_time.strftime("%H:%M:%S")
+    if date_part.startswith("0001-") or date_part.startswith("1601-"):
+        return None
+    return f"{date_part} {time_part}.{fraction}"
+
+def join_path(row, parent_column, name_column):
+    parent = row.get(parent_column) or ""
+    name = row.get(name_column) or ""
+    return f"{parent}\\{name}" if parent and name else parent or name
+
+# [source name, glob below WindowsParser, timestamp columns, description]
+timeline_sources = [
+    ["MFT", "ntfs/*MFTECmd_$MFT_Output.csv", ["Created0x10", "Created0x30", "LastModified0x10", "LastRecordChange0x10", "LastAccess0x10"], lambda row: join_path(row, "ParentPath", "FileName")],
+    ["UsnJrnl", "ntfs/*MFTECmd_$J_Output.csv", ["UpdateTimestamp"], lambda row: "{0} {1}".format(join_path(row, "ParentPath", "Name"), row.get("UpdateReasons", ""))],
+    ["Prefetch", "execution/*PECmd_Output_Timeline.csv", ["RunTime"], lambda row: row.get("ExecutableName", "")],
+    ["Prefetch", "execution/output_module_prefetchruncounts.csv", None, None],
+    ["Amcache", "execution/*Amcache_*FileEntries.csv", ["FileKeyLastWriteTimestamp"], lambda row: "{0} SHA1:{1}".format(row.get("FullPath", ""), row.get("SHA1", ""))],
+    ["AppCompatCache", "execution/*AppCompatCache*.csv", ["LastModifiedTimeUTC"], lambda row: "{0} Executed:{1}".format(row.get("Path", ""), row.get("Executed", ""))],
+    ["Registry", "registry/*RECmd_Batch_*_Output.csv", ["LastWriteTimestamp"], lambda row: "{0}: {1} {2} {3}".format(row.get("Category", ""), row.get("Description", ""), row.get("ValueName", ""), row.get("ValueData", "")).strip()],
+    ["Hayabusa", "events/hayabusa/timeline.csv", ["Timestamp"], lambda row: "{0} {1} [{2}] {3} {4}".format(row.get("Channel", ""), row.get("EventID", ""), row.get("Level", ""), row.get("RuleTitle", ""), row.get("Details", "")).strip()],
+]
+
+def detect_timestamp_columns(row):
+    columns = []
+    for column, value in row.items():
+        if column and value and re.search("time|date|run|executed", column, re.IGNORECASE) and normalize_timestamp(value) != None:
+            columns.append(column)
+    return columns
+
+def iter_source_rows(csv_file, host, source_name, timestamp_columns, describe):
+    for row in windows_convert.iter_csv_rows(csv_file):
+        if timestamp_columns == None:
+            timestamp_columns = detect_timestamp_columns(row)
+        if describe == None:
+            description = " ".join(value for column, value in row.items() if value and column not in timestamp_columns)
+        else:
+            description = describe(row)
+        for timestamp_column in timestamp_columns:
+            timestamp = normalize_timestamp(row.get(timestamp_column))
+            if timestamp != None:
+                yield [timestamp, host, source_name, timestamp_column, description]
+
+def iter_timeline_rows(result_dirs):
+    for result_dir in result_dirs:
+        host = result_dir.parent.name
+        for source_name, source_glob, timestamp_columns, describe in timeline_sources:
+            for csv_file in windows_convert.glob_outputs(result_dir, source_glob):
+                print("{0}: Reading {1}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), csv_file))
+                yield from iter_source_rows(csv_file, host, source_name, timestamp_columns, describe)
+
+def write_sorted_run(rows, run_dir, run_number):
+    rows.sort()
+    run_file = Path(run_dir).joinpath(f"run_{run_number:06d}.csv")
+    with open(run_file, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+    return run_file
+
+def read_run(run_file):
+    with open(run_file, "r", newline="", encoding="utf-8") as f:
+        yield from csv.reader(f)
+
+def merge_runs(run_files, run_dir, fan_in):
+    run_number = len(run_files)
+    while len(run_files) > fan_in:
+        merged_runs = []
+        for first_run in range(0, len(run_files), fan_in):
+            group = run_files[first_run:first_run + fan_in]
+            run_number += 1
+            merged_run = Path(run_dir).joinpath(f"run_{run_number:06d}.csv")
+            with open(merged_run, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(heapq.merge(*[read_run(run_file) for run_file in group]))
+            for run_file in group:
+                os.remove(run_file)
+            merged_runs.append(merged_run)
+        run_files = merged_runs
+    return heapq.merge(*[read_run(run_file) for run_file in run_files])
+
+class TimelineWriter:
+    def __init__(self, output_dir, output_format, rows_per_file):
+        self.output_dir = Path(output_dir)
+        self.output_format = output_format
+        self.rows_per_file = rows_per_file
+        self.file_number = 0
+        self.rows = []
+        self.total_rows = 0
+        if self.output_format == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+            self.pyarrow = pyarrow
+            self.parquet = pyarrow.parquet
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.rows_per_file:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        self.file_number += 1
+        output_file = self.output_dir.joinpath(f"supertimeline_{self.file_number:05d}.{self.output_format}")
+        if self.output_format == "parquet":
+            columns = list(zip(*self.rows))
+            table = self.pyarrow.table({column: list(values) for column, values in zip(TIMELINE_HEADER, columns)})
+            self.parquet.write_table(table, output_file, compression="zstd")
+        else:
+            with open(output_file, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(TIMELINE_HEADER)
+                writer.writerows(self.rows)
+        self.total_rows += len(self.rows)
+        self.rows = []
+
+def build_timeline(root_dir, result_dir_name="WindowsParser", output_dir=None, output_format=None):
+    output_dir = Path(output_dir) if output_dir != None else Path(root_dir).joinpath(result_dir_name, "timeline")
+    output_format = output_format if output_format != None else windows_config.TimelineFormat
+    result_dirs = windows_convert.find_result_dirs(root_dir, result_dir_name)
+    print("{0}: Building timeline from {1} targets into {2}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(result_dirs), output_dir))
+
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+    run_dir = tempfile.mkdtemp(prefix="timeline_", dir=windows_config.TimelineTempDir)
+    try:
+        run_files = []
+        rows = []
+        for row in iter_timeline_rows(result_dirs):
+            rows.append(row)
+            if len(rows) >= windows_config.TimelineChunkRows:
+                run_files.append(write_sorted_run(rows, run_dir, len(run_files)))
+                rows = []
+        if rows:
+            run_files.append(write_sorted_run(rows, run_dir, len(run_files)))
+            rows = []
+
+        writer = TimelineWriter(output_dir, output_format, windows_config.TimelineOutputRows)
+        for row in merge_runs(run_files, run_dir, windows_config.TimelineMergeFanIn):
+            writer.write(row)
+        writer.flush()
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    print("{0}: Timeline done, {1} rows in {2} files".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), writer.total_rows, writer.file_number))
+    return output_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", required=True, help="parsed_target_folders")
+    parser.add_argument("-o", help="output_folder (default <folder>/WindowsParser/timeline)")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="output_format (default TimelineFormat from windows_config.py)")
+
+    args = parser.parse_args()
+
+    if not Path(args.r).exists():
+        print(f"target not found!")
+        exit(-1)
+    build_timeline(args.r, output_dir=args.o, output_format=args.format)
+
+    exit(0)
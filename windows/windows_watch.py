@@ -0,0 +1,140 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+class InotifyWatcher:
+    # recursive inotify watch through libc, only sees changes made by this host (not by other NFS/SMB clients)
+    def __init__(self, skip_dir_names=None):
+        self.skip_dir_names = set(skip_dir_names or [])
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.paths = {}
+
+    def add_watch(self, path):
+        if path in self.paths:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch {path} failed: {os.strerror(errno)}")
+        self.watches[wd] = path
+        self.paths[path] = wd
+
+    def add_tree(self, root):
+        # returns every directory now watched below root, they may have been created before the watch existed
+        added_dirs = []
+        pending_dirs = [str(root)]
+        while pending_dirs:
+            current_dir = pending_dirs.pop()
+            try:
+                self.add_watch(current_dir)
+            except FileNotFoundError:
+                continue
+            added_dirs.append(current_dir)
+            try:
+                with os.scandir(current_dir) as it:
+                    for dir_entry in it:
+                        if dir_entry.name not in self.skip_dir_names and dir_entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(dir_entry.path)
+            except OSError:
+                continue
+        return added_dirs
+
+    def remove_tree(self, root):
+        root = str(root)
+        for path in [path for path in self.paths if path == root or path.startswith(root + os.sep)]:
+            wd = self.paths.pop(path)
+            self.watches.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        # returns [(path, created_dir)], None when the kernel queue overflowed and events were lost
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buffer = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                path = self.watches.pop(wd, None)
+                if path != None:
+                    self.paths.pop(path, None)
+                continue
+            parent = self.watches.get(wd)
+            if parent == None:
+                continue
+            name = os.fsdecode(name)
+            if name in self.skip_dir_names:
+                continue
+            path = os.path.join(parent, name) if name else parent
+            events.append((path, bool(mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO))))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def open_inotify(skip_dir_names=None):
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return InotifyWatcher(skip_dir_names)
+    except (OSError, AttributeError) as e:
+        print(f"inotify not available, polling instead: {e}")
+        return None
+
+def get_tree_signature(root, skip_dir_names=None):
+    # (files, bytes, newest mtime) of everything below root, changes while an upload is still running
+    skip_dir_names = set(skip_dir_names or [])
+    files = 0
+    total_bytes = 0
+    newest_mtime = 0
+    pending_dirs = [str(root)]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as it:
+                for dir_entry in it:
+                    try:
+                        if dir_entry.is_dir(follow_symlinks=False):
+                            if dir_entry.name not in skip_dir_names:
+                                pending_dirs.append(dir_entry.path)
+                            continue
+                        file_stat = dir_entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    files += 1
+                    total_bytes += file_stat.st_size
+                    newest_mtime = max(newest_mtime, file_stat.st_mtime_ns)
+        except OSError:
+            continue
+    return [files, total_bytes, newest_mtime]